@@ -0,0 +1,289 @@
+import argparse
+import io
+
+import numpy as np
+import pandas as pd
+
+from matching import query_frame
+from normalize import MINOR_UNITS
+
+
+def ensure_allocation_schema(conn):
+    """Tables the FIFO allocation and the balances derived from it are written to"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS payment_allocation (
+                nomor_penerimaan VARCHAR(50) NOT NULL,
+                nomor_invoice VARCHAR(50) NOT NULL,
+                id_student VARCHAR(50) NOT NULL,
+                jumlah DECIMAL(15,2) NOT NULL,
+                PRIMARY KEY (nomor_penerimaan, nomor_invoice)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS payment_allocation_student_idx ON payment_allocation (id_student)")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS invoice_allocation (
+                nomor_invoice VARCHAR(50) PRIMARY KEY,
+                id_student VARCHAR(50) NOT NULL,
+                tanggal DATE NOT NULL,
+                total DECIMAL(15,2) NOT NULL,
+                jumlah_pembayaran DECIMAL(15,2) NOT NULL,
+                sisa DECIMAL(15,2) NOT NULL,
+                status VARCHAR(20) NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS invoice_allocation_student_idx ON invoice_allocation (id_student)")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS student_allocation (
+                id_student VARCHAR(50) PRIMARY KEY,
+                total_invoice DECIMAL(15,2) NOT NULL,
+                total_pembayaran DECIMAL(15,2) NOT NULL,
+                total_tagihan DECIMAL(15,2) NOT NULL,
+                kredit DECIMAL(15,2) NOT NULL,
+                tanggal_update TIMESTAMP DEFAULT NOW()
+            )
+        """)
+    conn.commit()
+
+
+# Allocated paid amount and status onto piutang_tagihan. A student's unapplied
+# credit goes on the student's newest invoice (marked Over Paid), so paid
+# amounts still add up to the student's receipts. Only changed invoices are
+# written, and their tanggal_update is set.
+INVOICE_BALANCES = """
+    UPDATE piutang_tagihan pt
+    SET jumlah_pembayaran = b.jumlah_pembayaran, status = b.status, tanggal_update = NOW()
+    FROM (
+        SELECT ia.nomor_invoice,
+               NULLIF(ia.jumlah_pembayaran + COALESCE(c.kredit, 0), 0) AS jumlah_pembayaran,
+               CASE WHEN c.kredit > 0 THEN 'Over Paid' ELSE ia.status END AS status
+        FROM (SELECT * FROM invoice_allocation {where}) ia
+        LEFT JOIN (
+            SELECT DISTINCT ON (ia.id_student) ia.nomor_invoice, sa.kredit
+            FROM (SELECT * FROM invoice_allocation {where}) ia
+            JOIN student_allocation sa ON sa.id_student = ia.id_student
+            WHERE sa.kredit > 0
+            ORDER BY ia.id_student, ia.tanggal DESC, ia.nomor_invoice DESC
+        ) c ON c.nomor_invoice = ia.nomor_invoice
+    ) b
+    WHERE pt.nomor_invoice = b.nomor_invoice
+      AND (pt.jumlah_pembayaran IS DISTINCT FROM b.jumlah_pembayaran OR pt.status IS DISTINCT FROM b.status)
+"""
+
+# students.total_tagihan from the allocation: outstanding minus unapplied credit
+STUDENT_BALANCES = """
+    UPDATE students s
+    SET total_tagihan = sa.total_tagihan - sa.kredit, tanggal_update = NOW()
+    FROM (SELECT * FROM student_allocation {where}) sa
+    WHERE s.id_student = sa.id_student
+"""
+
+
+def balance_update(statement, students=None):
+    """(query, params) of INVOICE_BALANCES or STUDENT_BALANCES for `students`, or everyone when None"""
+    if students is None:
+        return statement.format(where=""), None
+    return statement.format(where="WHERE id_student = ANY(%(students)s)"), {'students': list(students)}
+
+
+def _cents(amounts):
+    """Signed integer minor units of a column of decimal strings"""
+    return np.rint(pd.to_numeric(amounts).to_numpy(dtype=np.float64) * MINOR_UNITS).astype(np.int64)
+
+
+def _decimal(cents):
+    """Decimal strings of signed minor units, without going through floats"""
+    cents = pd.Series(cents, dtype=np.int64)
+    sign = pd.Series(np.where(cents < 0, '-', ''), index=cents.index)
+    cents = cents.abs()
+    return sign + (cents // MINOR_UNITS).astype(str) + '.' + (cents % MINOR_UNITS).astype(str).str.zfill(2)
+
+
+def load_ledger(conn, students=None):
+    """Invoices and receipts of `students`, or of everyone when None, oldest first"""
+    where, params = "", None
+    if students is not None:
+        where, params = "WHERE id_student = ANY(%s)", (list(students),)
+    invoices = query_frame(conn, f"""
+        SELECT nomor_invoice, id_student, tanggal, total FROM piutang_tagihan {where}
+        ORDER BY tanggal, nomor_invoice
+    """, params, ['nomor_invoice', 'id_student', 'tanggal', 'total'])
+    payments = query_frame(conn, f"""
+        SELECT nomor_penerimaan, id_student, tanggal, jumlah FROM penerimaan_penjualan {where}
+        ORDER BY tanggal, nomor_penerimaan
+    """, params, ['nomor_penerimaan', 'id_student', 'tanggal', 'jumlah'])
+    conn.commit()
+    return invoices, payments
+
+
+def _per_student(codes, cents, count):
+    totals = np.zeros(count, dtype=np.int64)
+    np.add.at(totals, codes, cents)
+    return totals
+
+
+def _starts_run(values):
+    """True where a value differs from the one before it"""
+    starts = np.ones(len(values), dtype=bool)
+    starts[1:] = values[1:] != values[:-1]
+    return starts
+
+
+def allocate(invoices, payments):
+    """Apply each student's receipts to the student's invoices, oldest invoice first
+
+    Rows of both frames are applied in the order given (load_ledger returns
+    them by date). Both sides are laid out on one number line: every student
+    gets a segment as long as the larger of its invoiced and paid totals,
+    and inside it the invoices and the receipts are cumulative intervals. A
+    receipt pays an invoice for as long as their intervals overlap, so all
+    students are allocated at once with cumulative sums and searchsorted,
+    without comparing receipts and invoices pairwise.
+
+    A negative receipt (a refund or a reversed transfer) reverses the
+    student's latest allocation: it takes its amount off the end of the
+    student's receipts, newest first. A student reversed beyond what was
+    received ends with a negative kredit, owed on top of the invoices.
+
+    Returns (allocations, invoice balances, student balances), amounts in
+    minor units.
+    """
+    codes, students = pd.factorize(pd.concat([invoices['id_student'], payments['id_student']],
+                                             ignore_index=True), sort=True)
+    inv_code, pay_code = codes[:len(invoices)], codes[len(invoices):]
+    # Group each side by student, keeping the given order within a student
+    inv_order = np.argsort(inv_code, kind='stable')
+    pay_order = np.argsort(pay_code, kind='stable')
+    invoices = invoices.iloc[inv_order].reset_index(drop=True)
+    payments = payments.iloc[pay_order].reset_index(drop=True)
+    inv_code, pay_code = inv_code[inv_order], pay_code[pay_order]
+    inv_cents, signed = _cents(invoices['total']), _cents(payments['jumlah'])
+
+    inv_total = _per_student(inv_code, inv_cents, len(students))
+    received = np.maximum(signed, 0)
+    received_total = _per_student(pay_code, received, len(students))
+    net_total = _per_student(pay_code, signed, len(students))
+    # Keep the first max(net, 0) received cents of each student; reversals remove the rest
+    pay_total = np.maximum(net_total, 0)
+    received_before = np.cumsum(received) - received - (np.cumsum(received_total) - received_total)[pay_code]
+    pay_cents = np.clip(pay_total[pay_code] - received_before, 0, received)
+    span = np.maximum(inv_total, pay_total)
+    base = np.cumsum(span) - span
+    # Running total within the student = running total overall minus the students before it
+    inv_end = base[inv_code] + np.cumsum(inv_cents) - (np.cumsum(inv_total) - inv_total)[inv_code]
+    inv_start = inv_end - inv_cents
+    pay_end = base[pay_code] + np.cumsum(pay_cents) - (np.cumsum(pay_total) - pay_total)[pay_code]
+    pay_start = pay_end - pay_cents
+
+    # Every piece between two consecutive boundaries lies in at most one invoice and one receipt
+    points = np.concatenate([inv_start, inv_end, pay_start, pay_end])
+    points.sort()
+    points = points[_starts_run(points)]
+    piece_start, piece_cents = points[:-1], np.diff(points)
+    inv = np.searchsorted(inv_start, piece_start, side='right') - 1
+    pay = np.searchsorted(pay_start, piece_start, side='right') - 1
+    covered = (inv >= 0) & (pay >= 0)
+    covered[covered] &= (piece_start[covered] < inv_end[inv[covered]]) & \
+                        (piece_start[covered] < pay_end[pay[covered]])
+    inv, pay, piece_cents = inv[covered], pay[covered], piece_cents[covered]
+    # Pieces of one receipt/invoice pair are adjacent (split only by empty invoices)
+    first = np.flatnonzero(_starts_run(inv) | _starts_run(pay))
+    pair_cents = np.add.reduceat(piece_cents, first) if len(first) else piece_cents
+    inv, pay = inv[first], pay[first]
+
+    allocations = pd.DataFrame({
+        'nomor_penerimaan': payments['nomor_penerimaan'].to_numpy()[pay],
+        'nomor_invoice': invoices['nomor_invoice'].to_numpy()[inv],
+        'id_student': invoices['id_student'].to_numpy()[inv],
+        'cents': pair_cents,
+    })
+
+    paid = np.zeros(len(invoices), dtype=np.int64)
+    np.add.at(paid, inv, pair_cents)
+    invoice_balances = pd.DataFrame({
+        'nomor_invoice': invoices['nomor_invoice'],
+        'id_student': invoices['id_student'],
+        'tanggal': invoices['tanggal'],
+        'total': inv_cents,
+        'paid': paid,
+        'sisa': inv_cents - paid,
+        'status': np.where(inv_cents == paid, 'Lunas', 'Belum Lunas'),
+    })
+
+    applied = np.minimum(inv_total, pay_total)
+    student_balances = pd.DataFrame({
+        'id_student': students,
+        'total_invoice': inv_total,
+        'total_pembayaran': net_total,
+        'total_tagihan': inv_total - applied,
+        'kredit': net_total - applied,
+    })
+    return allocations, invoice_balances, student_balances
+
+
+def _copy(cur, table, columns, frame):
+    buf = io.StringIO()
+    frame.to_csv(buf, index=False, header=False)
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+
+def save_allocation(conn, allocations, invoice_balances, student_balances, students=None):
+    """Replace the stored allocation of `students` (everyone when None) in one transaction"""
+    with conn.cursor() as cur:
+        for table in ('payment_allocation', 'invoice_allocation', 'student_allocation'):
+            if students is None:
+                cur.execute(f"TRUNCATE {table}")
+            else:
+                cur.execute(f"DELETE FROM {table} WHERE id_student = ANY(%s)", (list(students),))
+        _copy(cur, 'payment_allocation', ['nomor_penerimaan', 'nomor_invoice', 'id_student', 'jumlah'],
+              allocations.assign(cents=_decimal(allocations['cents'])))
+        _copy(cur, 'invoice_allocation',
+              ['nomor_invoice', 'id_student', 'tanggal', 'total', 'jumlah_pembayaran', 'sisa', 'status'],
+              invoice_balances.assign(total=_decimal(invoice_balances['total']),
+                                      paid=_decimal(invoice_balances['paid']),
+                                      sisa=_decimal(invoice_balances['sisa'])))
+        _copy(cur, 'student_allocation', ['id_student', 'total_invoice', 'total_pembayaran', 'total_tagihan', 'kredit'],
+              student_balances.assign(**{column: _decimal(student_balances[column]) for column in
+                                         ('total_invoice', 'total_pembayaran', 'total_tagihan', 'kredit')}))
+    conn.commit()
+
+
+def allocate_students(conn, students=None):
+    """Re-run the FIFO allocation for `students`, or for everyone when None
+
+    The allocated paid amounts and statuses are copied to piutang_tagihan;
+    students.total_tagihan is left to STUDENT_BALANCES. Returns (receipts
+    allocated, allocation rows, students allocated, invoices updated).
+    """
+    ensure_allocation_schema(conn)
+    invoices, payments = load_ledger(conn, students)
+    allocations, invoice_balances, student_balances = allocate(invoices, payments)
+    save_allocation(conn, allocations, invoice_balances, student_balances, students)
+    with conn.cursor() as cur:
+        cur.execute(*balance_update(INVOICE_BALANCES, students))
+        updated = cur.rowcount
+    conn.commit()
+    return len(payments), len(allocations), len(student_balances), updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Allocate receipts to each student's invoices, oldest invoice first.")
+    parser.add_argument('--student', action='append', help='Only re-allocate this student (repeatable)')
+    args = parser.parse_args()
+
+    from ingest import get_connection
+    from migrations import apply_migrations
+    conn = get_connection('accurate')
+    try:
+        apply_migrations(conn, 'accurate')
+        receipts, rows, students, _ = allocate_students(conn, args.student)
+        with conn.cursor() as cur:
+            cur.execute(*balance_update(STUDENT_BALANCES, args.student))
+        conn.commit()
+        print("\n📊 Allocation report:")
+        print(f"• Receipts allocated: {receipts}")
+        print(f"• Allocation rows in payment_allocation: {rows}")
+        print(f"• Students allocated: {students}")
+    finally:
+        conn.close()
@@ -1,27 +1,92 @@
+import argparse
+import csv
+import io
+import queue
+import threading
+from contextlib import closing
 import psycopg2
 from psycopg2 import sql, errors
-from datetime import datetime
-from config import DATABASES
+
+try:
+    import config
+except ImportError:     # the tests import this module without database settings
+    config = None
+
+from allocation import STUDENT_BALANCES, allocate_students, balance_update
+from ar_summary import refresh_summaries
+from matching import match_payments
+from metrics import Metrics, approx_bytes, instrument
+from migrations import apply_migrations
+from sources import SOURCE_ID_COLUMNS
+
+# Incremental runs re-read this many sequence numbers behind the watermark, so
+# a gateway transaction that committed after a later one is not missed
+WATERMARK_OVERLAP = 1000
+
+# Rows per server-side cursor round trip, and fetched batches buffered between threads
+FETCH_ITERSIZE = 10000
+FETCH_QUEUE_DEPTH = 4
+
+# Conflicting payment ids listed in the report; the full list is kept on the integrator
+SHOWN_CONFLICTS = 10
+
+# Receipts written this long before the last recompute are looked at again, so a
+# loader transaction that committed just after the mark is not missed
+RECOMPUTE_OVERLAP = '1 minute'
 
 class PaymentIntegrator:
-    def __init__(self):
-        self.connections = {
+    def __init__(self, incremental=False, itersize=FETCH_ITERSIZE, full_rebuild=False, connections=None,
+                 explain=False, match=True):
+        self.incremental = incremental
+        self.match = match
+        self.full_rebuild = full_rebuild
+        self.explain = explain
+        self.itersize = itersize
+        # Connections handed in (e.g. from the daemon's pools) stay open after a run
+        self.owns_connections = connections is None
+        self.connections = connections or {
             'accurate': self._connect('accurate'),
             'xendit': self._connect('xendit'),
             'paperid': self._connect('paperid')
         }
-        self.existing_refs = self._load_existing_references()
+        self.load_state()
+        self._reset_run()
+
+    def load_state(self):
+        """(Re)load the state kept between runs: known refs, watermarks and the recompute mark"""
+        for db_key, conn in self.connections.items():
+            apply_migrations(conn, db_key)
+        # Incremental runs check only candidate refs instead of loading all of them
+        self.existing_refs = set() if self.incremental else self._load_existing_references()
+        self.watermarks = self._load_watermarks() if self.incremental else {}
+        self.last_recompute, self.last_invoice_id = self._load_recompute_mark()
+
+    def _reset_run(self):
         self.stats = {
             'total_processed': 0,
             'xendit_skipped': 0,
             'paperid_skipped': 0,
+            'conflicts': 0,
+            'invoices_updated': 0,
+            'students_updated': 0,
+            'students_allocated': 0,
+            'unmatched': 0,
+            'match_candidates': 0,
+            'summary_days': 0,
+            'summary_students': 0,
             'errors': 0
         }
+        self.inserted = []      # (nomor_penerimaan, metode_pembayaran, nomor_invoice, id_student)
+        self.conflicts = []     # (metode_pembayaran, nomor_penerimaan) already in penerimaan_penjualan
+        self.metrics = Metrics('integrator')
+        if self.incremental:
+            # Only this run's refs; the watermarks and _existing_candidates cover earlier runs
+            self.existing_refs = set()
 
     def _connect(self, db_key):
         """Establish database connection"""
         try:
-            return psycopg2.connect(**DATABASES[db_key])
+            return instrument(psycopg2.connect(**config.DATABASES[db_key]))
         except psycopg2.OperationalError as e:
             print(f"🚨 Connection failed to {db_key.upper()}: {str(e)}")
             raise
@@ -29,145 +94,369 @@ class PaymentIntegrator:
     def _load_existing_references(self):
         """Load existing payment references"""
         try:
-            with self.connections['accurate'].cursor() as cur:
+            with self.connections['accurate'].cursor(name='integrator_refs') as cur:
+                cur.itersize = self.itersize
                 cur.execute("""
                     SELECT CONCAT(metode_pembayaran, ':', nomor_penerimaan)
                     FROM penerimaan_penjualan
                 """)
-                return {row[0] for row in cur.fetchall()}
+                refs = {row[0] for row in cur}
+            self.connections['accurate'].commit()
+            return refs
         except Exception as e:
             print(f"🔴 Failed loading references: {str(e)}")
             return set()
 
-    def _process_payments(self, source):
-        """Process payments from specified source"""
-        payments = []
+    def _load_watermarks(self):
+        """Load the last integrated ingest_seq per gateway"""
+        for source in SOURCE_ID_COLUMNS:
+            self._ensure_ingest_seq(source)
+        with self.connections['accurate'].cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS integrator_watermark (
+                    source VARCHAR(20) PRIMARY KEY,
+                    last_seq BIGINT NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP
+                )
+            """)
+            cur.execute("SELECT source, last_seq FROM integrator_watermark")
+            watermarks = dict(cur.fetchall())
+        self.connections['accurate'].commit()
+        return {source: watermarks.get(source, 0) for source in SOURCE_ID_COLUMNS}
+
+    def _ensure_ingest_seq(self, source):
+        """Give the gateway payments table a monotonically increasing ingest sequence"""
+        with self.connections[source].cursor() as cur:
+            cur.execute("ALTER TABLE payments ADD COLUMN IF NOT EXISTS ingest_seq BIGSERIAL")
+            cur.execute("CREATE INDEX IF NOT EXISTS payments_ingest_seq_idx ON payments (ingest_seq)")
+        self.connections[source].commit()
+
+    def _save_watermarks(self, cur, watermarks):
+        """Store `watermarks` as the new high-water marks in the caller's transaction"""
+        for source, last_seq in watermarks.items():
+            cur.execute("""
+                INSERT INTO integrator_watermark (source, last_seq, updated_at)
+                VALUES (%s, %s, NOW())
+                ON CONFLICT (source) DO UPDATE SET last_seq = EXCLUDED.last_seq, updated_at = NOW()
+            """, (source, last_seq))
+
+    def _existing_candidates(self, source, payment_ids):
+        """Return which of `payment_ids` are already in penerimaan_penjualan for this source"""
+        if not payment_ids:
+            return set()
+        with self.connections['accurate'].cursor() as cur:
+            cur.execute("""
+                SELECT nomor_penerimaan FROM penerimaan_penjualan
+                WHERE metode_pembayaran = %s AND nomor_penerimaan = ANY(%s)
+            """, (source, list(payment_ids)))
+            return {row[0] for row in cur.fetchall()}
+
+    def _fetch_payments(self, source, out, stop):
+        """Stream a gateway's payments into `out` in batches of `itersize` rows
+
+        Runs on its own thread over the source's own connection, with a named
+        server-side cursor so the table is never held in client memory. Stops
+        early, closing the cursor and its transaction, once `stop` is set.
+        """
+        conn = self.connections[source]
         try:
-            with self.connections[source].cursor() as cur:
-                cur.execute(f"""
-                    SELECT tanggal, jumlah, nomor_invoice, id_student, 
-                           {'id_xendit_payment' if source == 'xendit' else 'id_paper_payment'}, 
-                           %s AS source
-                    FROM payments
-                """, (source,))
-                
-                for payment in cur.fetchall():
-                    ref_id = f"{payment[5]}:{payment[4]}"
-                    if ref_id in self.existing_refs:
-                        self.stats[f'{source}_skipped'] += 1
-                    else:
-                        payments.append(payment)
-                        self.existing_refs.add(ref_id)
-            return payments
+            query = sql.SQL("""
+                SELECT tanggal, jumlah, nomor_invoice, id_student, {},
+                       %s AS source, {}
+                FROM payments
+                {}
+            """).format(
+                sql.Identifier(SOURCE_ID_COLUMNS[source]),
+                sql.SQL("ingest_seq" if self.incremental else "NULL"),
+                sql.SQL("WHERE ingest_seq > %s ORDER BY ingest_seq" if self.incremental else ""))
+            params = [source]
+            if self.incremental:
+                params.append(max(self.watermarks[source] - WATERMARK_OVERLAP, 0))
+            stage = f"fetch_{source}"
+            with conn.cursor(name=f"integrator_{source}") as cur:
+                cur.itersize = self.itersize
+                with self.metrics.stage(stage):
+                    cur.execute(query, params)
+                while not stop.is_set():
+                    with self.metrics.stage(stage):
+                        rows = cur.fetchmany(self.itersize)
+                    if not rows:
+                        break
+                    self.metrics.add(stage, rows_out=len(rows), bytes=approx_bytes(rows))
+                    out.put((source, rows))
+            conn.commit()
         except Exception as e:
-            print(f"🔴 Error processing {source} payments: {str(e)}")
-            self.stats['errors'] += 1
-            return []
+            conn.rollback()
+            out.put((source, e))
+        finally:
+            out.put((source, None))
+
+    def _new_payments(self, source, rows, seen):
+        """Drop payments already integrated or seen earlier in this run
+
+        The highest ingest_seq per source goes into `seen`, not into
+        self.watermarks, which only moves once the merge has committed.
+        """
+        existing = self._existing_candidates(source, {row[4] for row in rows}) if self.incremental else set()
+        payments = []
+        for payment in rows:
+            ref_id = f"{payment[5]}:{payment[4]}"
+            if payment[4] in existing or ref_id in self.existing_refs:
+                self.stats[f'{source}_skipped'] += 1
+            else:
+                payments.append(payment[:6])
+                self.existing_refs.add(ref_id)
+            if self.incremental:
+                seen[source] = max(seen[source], payment[6])
+        return payments
+
+    def _stream_new_payments(self, seen):
+        """Yield batches of new payments while Xendit and PaperID are fetched concurrently
+
+        `seen` collects the highest ingest_seq fetched per source.
+
+        If the consumer stops early, e.g. a merge failed, the fetchers are told
+        to stop and the queue is drained so every thread exits and releases its
+        cursor before the connections are reused.
+        """
+        batches = queue.Queue(maxsize=FETCH_QUEUE_DEPTH)
+        stop = threading.Event()
+        threads = [threading.Thread(target=self._fetch_payments, args=(source, batches, stop), daemon=True)
+                   for source in SOURCE_ID_COLUMNS]
+        for thread in threads:
+            thread.start()
+        remaining = len(threads)
+        try:
+            while remaining:
+                source, rows = batches.get()
+                if rows is None:
+                    remaining -= 1
+                elif isinstance(rows, Exception):
+                    print(f"🔴 Error processing {source} payments: {str(rows)}")
+                    self.stats['errors'] += 1
+                else:
+                    with self.metrics.stage('dedup', rows_in=len(rows)):
+                        payments = self._new_payments(source, rows, seen)
+                    self.metrics.add('dedup', rows_out=len(payments))
+                    if payments:
+                        yield payments
+        finally:
+            stop.set()
+            while remaining:
+                if batches.get()[1] is None:
+                    remaining -= 1
+            for thread in threads:
+                thread.join()
+
+    def _create_staging_table(self, cur):
+        """Temp table the payment batches are copied into before the merge"""
+        cur.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS staging_integrator_payments (
+                id_student VARCHAR(50),
+                tanggal DATE,
+                nomor_invoice VARCHAR(50),
+                jumlah DECIMAL(15,2),
+                nomor_penerimaan VARCHAR(50),
+                metode_pembayaran VARCHAR(50)
+            ) ON COMMIT DROP
+        """)
+
+    def _merge_payments(self, cur, payments):
+        """COPY a batch into staging and merge it, recording which rows were new and which conflicted"""
+        buf = io.StringIO()
+        csv.writer(buf).writerows((p[3], p[0], p[2], p[1], p[4], p[5]) for p in payments)
+        buf.seek(0)
+        cur.execute("TRUNCATE staging_integrator_payments")
+        cur.copy_expert("""
+            COPY staging_integrator_payments
+            (id_student, tanggal, nomor_invoice, jumlah, nomor_penerimaan, metode_pembayaran)
+            FROM STDIN WITH (FORMAT csv)
+        """, buf)
+        cur.execute("""
+            INSERT INTO penerimaan_penjualan
+            (id_student, tanggal, nomor_invoice, jumlah,
+             nomor_penerimaan, metode_pembayaran, tanggal_update)
+            SELECT id_student, tanggal, nomor_invoice, jumlah,
+                   nomor_penerimaan, metode_pembayaran, NOW()
+            FROM staging_integrator_payments
+            ON CONFLICT (nomor_penerimaan) DO NOTHING
+            RETURNING nomor_penerimaan, metode_pembayaran, nomor_invoice, id_student
+        """)
+        inserted = cur.fetchall()
+        new_ids = {row[0] for row in inserted}
+        self.inserted.extend(inserted)
+        self.conflicts.extend((p[5], p[4]) for p in payments if p[4] not in new_ids)
+        return len(inserted)
+
+    def _load_recompute_mark(self):
+        """Return (time, highest invoice id) covered by the last completed recompute, or (None, 0) before the first one"""
+        with self.connections['accurate'].cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS integrator_recompute (
+                    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+                    last_run TIMESTAMP NOT NULL
+                )
+            """)
+            cur.execute("ALTER TABLE integrator_recompute ADD COLUMN IF NOT EXISTS last_invoice_id INTEGER NOT NULL DEFAULT 0")
+            cur.execute("SELECT last_run, last_invoice_id FROM integrator_recompute")
+            row = cur.fetchone()
+        self.connections['accurate'].commit()
+        return row if row else (None, 0)
+
+    def _save_recompute_mark(self, started, last_invoice_id):
+        with self.connections['accurate'].cursor() as cur:
+            cur.execute("""
+                INSERT INTO integrator_recompute (id, last_run, last_invoice_id) VALUES (TRUE, %s, %s)
+                ON CONFLICT (id) DO UPDATE SET last_run = EXCLUDED.last_run, last_invoice_id = EXCLUDED.last_invoice_id
+            """, (started, last_invoice_id))
+        self.connections['accurate'].commit()
 
-    def _calculate_total_payments(self):
-        """Update jumlah_pembayaran in penerimaan_penjualan"""
+    def _touched_since(self, since, last_invoice_id):
+        """Invoices and students of receipts written since `since`, e.g. by the Accurate loader,
+        plus invoices loaded after `last_invoice_id` and their students"""
+        with self.connections['accurate'].cursor() as cur:
+            cur.execute("""
+                SELECT DISTINCT nomor_invoice, id_student FROM penerimaan_penjualan
+                WHERE tanggal_update >= %s::timestamp - %s::interval
+                UNION
+                SELECT nomor_invoice, id_student FROM piutang_tagihan WHERE id > %s
+            """, (since, RECOMPUTE_OVERLAP, last_invoice_id))
+            rows = cur.fetchall()
+        self.connections['accurate'].commit()
+        return {row[0] for row in rows if row[0]}, {row[1] for row in rows}
+
+    def _invoice_students(self, invoices):
+        """Students owning `invoices`"""
+        with self.connections['accurate'].cursor() as cur:
+            cur.execute("SELECT DISTINCT id_student FROM piutang_tagihan WHERE nomor_invoice = ANY(%s)",
+                        (list(invoices),))
+            students = {row[0] for row in cur.fetchall()}
+        self.connections['accurate'].commit()
+        return students
+
+    def _update_student_balances(self, students=None):
+        """Update student total_tagihan from the oldest-invoice-first allocation
+
+        Only `students` are updated, or every allocated student when it is None.
+        Runs after _allocate().
+        """
         try:
             with self.connections['accurate'].cursor() as cur:
-                cur.execute("""
-                    UPDATE piutang_tagihan pp
-                    SET jumlah_pembayaran = (
-                        SELECT SUM(jumlah) 
-                        FROM penerimaan_penjualan 
-                        WHERE nomor_invoice = pp.nomor_invoice
-                    )
-                    WHERE pp.tanggal_update = CURRENT_DATE
-                """)
+                query, params = balance_update(STUDENT_BALANCES, students)
+                if self.explain:
+                    self.metrics.explain(cur, 'update_student_balances', query, params)
+                cur.execute(query, params)
+                self.stats['students_updated'] = cur.rowcount
                 self.connections['accurate'].commit()
         except Exception as e:
             self.connections['accurate'].rollback()
-            print(f"🔴 Failed calculating payments: {str(e)}")
+            print(f"🔴 Failed updating student balances: {str(e)}")
             self.stats['errors'] += 1
 
-    def _update_piutang_status(self):
-        """Update status in piutang_tagihan"""
+    def _allocate(self, students=None):
+        """Re-run the oldest-invoice-first allocation for `students`, or for everyone when None,
+        and copy the allocated paid amounts and statuses to piutang_tagihan
+
+        This is the only place invoice paid amounts and statuses are written.
+        """
         try:
-            with self.connections['accurate'].cursor() as cur:
-                cur.execute("""
-                    WITH payment_data AS (
-                        SELECT 
-                            pt.nomor_invoice,
-                            SUM(pp.jumlah) AS total_bayar,
-                            MAX(pp.tanggal) AS tanggal
-                        FROM piutang_tagihan pt
-                        JOIN penerimaan_penjualan pp ON pt.nomor_invoice = pp.nomor_invoice
-                        GROUP BY pt.nomor_invoice
-                    )
-                    UPDATE piutang_tagihan pt
-                    SET 
-                        status = CASE 
-                            WHEN (pt.total - pd.total_bayar) = 0 THEN 'Lunas'
-                            WHEN (pt.total - pd.total_bayar) < 0 THEN 'Over Paid' -- Perhatikan perubahan ini untuk "Over Paid"
-                            ELSE 'Belum Lunas'
-                        END,
-                        tanggal_update = pd.tanggal,
-                        jumlah_pembayaran = pd.total_bayar
-                    FROM payment_data pd
-                    WHERE pt.nomor_invoice = pd.nomor_invoice
-                """)
-                self.connections['accurate'].commit()
+            _, _, self.stats['students_allocated'], self.stats['invoices_updated'] = allocate_students(
+                self.connections['accurate'], students)
         except Exception as e:
             self.connections['accurate'].rollback()
-            print(f"🔴 Failed updating piutang status: {str(e)}")
+            print(f"🔴 Failed allocating payments: {str(e)}")
             self.stats['errors'] += 1
 
-    def _update_student_balances(self):
-        """Update student total_tagihan"""
+    def _refresh_summaries(self, invoices=None, students=None):
+        """Update the dashboard's summary tables for what this run touched (everything when None)"""
         try:
-            with self.connections['accurate'].cursor() as cur:
-                cur.execute("""
-                    UPDATE students s
-                    SET 
-                        total_tagihan = pt.total - pt.jumlah_pembayaran,
-                        tanggal_update = NOW()
-                    FROM piutang_tagihan pt
-                    WHERE s.id_student = pt.id_student
-                    
-                """)
-                self.connections['accurate'].commit()
+            with self.metrics.stage('summaries'):
+                refreshed = refresh_summaries(self.connections['accurate'], self.last_recompute, invoices, students,
+                                              RECOMPUTE_OVERLAP)
+            self.stats['summary_days'] = max(refreshed['payment_days'], refreshed['invoice_days'])
+            self.stats['summary_students'] = refreshed['students'] + max(refreshed['rolled'], 0)
+            self.metrics.add('summaries', rows_out=self.stats['summary_days'] + self.stats['summary_students'])
         except Exception as e:
             self.connections['accurate'].rollback()
-            print(f"🔴 Failed updating student balances: {str(e)}")
+            print(f"🔴 Failed refreshing summary tables: {str(e)}")
+            self.stats['errors'] += 1
+
+    def _match_unmatched(self, payment_ids):
+        """Store candidate invoices for `payment_ids` (all receipts when None) that match no invoice"""
+        try:
+            with self.metrics.stage('match', rows_in=len(payment_ids) if payment_ids is not None else 0):
+                unmatched, found, _ = match_payments(self.connections['accurate'], payment_ids)
+            self.metrics.add('match', rows_out=found)
+            self.stats['unmatched'] = unmatched
+            self.stats['match_candidates'] = found
+        except Exception as e:
+            self.connections['accurate'].rollback()
+            print(f"🔴 Failed to match unmatched payments: {str(e)}")
             self.stats['errors'] += 1
 
     def integrate_payments(self):
         """Main integration workflow"""
+        self._reset_run()
         try:
-            # Process both payment sources
-            xendit_payments = self._process_payments('xendit')
-            paperid_payments = self._process_payments('paperid')
-            all_payments = xendit_payments + paperid_payments
+            # Fetch both payment sources concurrently and merge batch by batch
+            inserted = 0
+            seen = dict(self.watermarks)
+            with self.connections['accurate'].cursor() as cur:
+                self._create_staging_table(cur)
+                with closing(self._stream_new_payments(seen)) as stream:
+                    for payments in stream:
+                        with self.metrics.stage('merge', rows_in=len(payments)):
+                            merged = self._merge_payments(cur, payments)
+                        self.metrics.add('merge', rows_out=merged)
+                        inserted += merged
+                if self.incremental:
+                    self._save_watermarks(cur, seen)
 
-            if not all_payments:
-                print("🟡 No new payments to integrate")
-                return False
+            self.connections['accurate'].commit()
+            self.watermarks = seen
+            self.stats['total_processed'] = inserted
+            self.stats['conflicts'] = len(self.conflicts)
 
-            # Transform and insert payments
-            transformed = [
-                (p[3], p[0], p[2], p[1], p[4], p[5], datetime.now())
-                for p in all_payments
-            ]
+            # Recompute only the invoices and students touched since the last run:
+            # this run's payments plus receipts and invoices imported from Accurate meanwhile
+            with self.metrics.stage('recompute_scope'), self.connections['accurate'].cursor() as cur:
+                cur.execute("SELECT NOW()::timestamp, COALESCE(MAX(id), 0) FROM piutang_tagihan")
+                recompute_started, last_invoice_id = cur.fetchone()
+                if self.full_rebuild or self.last_recompute is None:
+                    invoices = students = None
+                else:
+                    invoices, students = self._touched_since(self.last_recompute, self.last_invoice_id)
+                    invoices |= {row[2] for row in self.inserted if row[2]}
+                    students |= {row[3] for row in self.inserted}
+                    if invoices:
+                        # A receipt may reference an invoice of another student
+                        students |= self._invoice_students(invoices)
+            if invoices is not None:
+                self.metrics.add('recompute_scope', rows_out=len(invoices))
+                if not invoices and not students:
+                    # Still roll aging forward and pick up newly loaded invoices
+                    self._refresh_summaries(invoices, students)
+                    print("🟡 No new payments to integrate")
+                    return False
+
+            errors_before = self.stats['errors']
+            with self.metrics.stage('allocate', rows_in=len(students) if students is not None else 0):
+                self._allocate(students)
+            self.metrics.add('allocate', rows_out=self.stats['students_allocated'])
+            with self.metrics.stage('update_student_balances'):
+                self._update_student_balances(students)
+            self.metrics.add('update_student_balances', rows_out=self.stats['students_updated'])
+            self._refresh_summaries(invoices, students)
+            if self.stats['errors'] == errors_before:
+                self._save_recompute_mark(recompute_started, last_invoice_id)
+                self.last_recompute, self.last_invoice_id = recompute_started, last_invoice_id
+
+            # Suggest invoices for this run's payments whose reference matches none
+            if self.match:
+                payment_ids = None if self.full_rebuild else [row[0] for row in self.inserted]
+                if payment_ids is None or payment_ids:
+                    self._match_unmatched(payment_ids)
 
-            with self.connections['accurate'].cursor() as cur:
-                cur.executemany("""
-                    INSERT INTO penerimaan_penjualan 
-                    (id_student, tanggal, nomor_invoice, jumlah, 
-                     nomor_penerimaan, metode_pembayaran, tanggal_update)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, transformed)
-                
-            self.connections['accurate'].commit()
-            self.stats['total_processed'] = len(transformed)
-            
-            # Execute post-processing steps
-            self._calculate_total_payments()
-            self._update_piutang_status()
-            self._update_student_balances()
-            
             print("✅ Integration succeeded!")
             self._show_stats()
             return True
@@ -175,15 +464,20 @@ class PaymentIntegrator:
         except errors.UniqueViolation:
             self.connections['accurate'].rollback()
             print("🔴 Failed: Duplicate entries detected")
+            self.stats['errors'] += 1
             return False
         except Exception as e:
-            self.connections['accurate'].rollback()
+            if not self.connections['accurate'].closed:
+                self.connections['accurate'].rollback()
             print(f"🔴 Critical failure: {str(e)}")
+            self.stats['errors'] += 1
             return False
         finally:
-            for conn in self.connections.values():
-                if conn and not conn.closed:
-                    conn.close()
+            self.metrics.emit(stats=self.stats, incremental=self.incremental, full_rebuild=self.full_rebuild)
+            if self.owns_connections:
+                for conn in self.connections.values():
+                    if conn and not conn.closed:
+                        conn.close()
 
     def _show_stats(self):
         """Display integration statistics"""
@@ -191,10 +485,37 @@ class PaymentIntegrator:
         print(f"• Successfully processed: {self.stats['total_processed']}")
         print(f"• Xendit duplicates skipped: {self.stats['xendit_skipped']}")
         print(f"• PaperID duplicates skipped: {self.stats['paperid_skipped']}")
+        print(f"• Conflicts with existing receipts: {self.stats['conflicts']}")
+        for source, payment_id in self.conflicts[:SHOWN_CONFLICTS]:
+            print(f"  - {source}:{payment_id}")
+        if len(self.conflicts) > SHOWN_CONFLICTS:
+            print(f"  - ... and {len(self.conflicts) - SHOWN_CONFLICTS} more")
+        print(f"• Invoices recomputed: {self.stats['invoices_updated']}")
+        print(f"• Student balances recomputed: {self.stats['students_updated']}")
+        print(f"• Students re-allocated oldest invoice first: {self.stats['students_allocated']}")
+        print(f"• Summary tables refreshed: {self.stats['summary_days']} days, {self.stats['summary_students']} students")
+        if self.stats['unmatched']:
+            print(f"• Payments matching no invoice: {self.stats['unmatched']} "
+                  f"({self.stats['match_candidates']} candidates in payment_match_candidates)")
         print(f"• Total errors encountered: {self.stats['errors']}")
 
 if __name__ == "__main__":
-    integrator = PaymentIntegrator()
+    parser = argparse.ArgumentParser(description="Integrate gateway payments into Accurate receivables.")
+    parser.add_argument('command', nargs='?', default='run-integeration', help=argparse.SUPPRESS)
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only fetch gateway payments past the last stored watermark')
+    parser.add_argument('--itersize', type=int, default=FETCH_ITERSIZE,
+                        help=f'Rows fetched per server-side cursor round trip (default {FETCH_ITERSIZE})')
+    parser.add_argument('--full-rebuild', action='store_true',
+                        help='Recompute every invoice status and student balance, not only those touched by this run')
+    parser.add_argument('--explain', action='store_true',
+                        help='Also capture EXPLAIN (ANALYZE, BUFFERS) of the status and balance UPDATEs')
+    parser.add_argument('--no-match', action='store_true',
+                        help='Skip suggesting invoices for payments whose reference matches none')
+    args = parser.parse_args()
+
+    integrator = PaymentIntegrator(incremental=args.incremental, itersize=args.itersize,
+                                   full_rebuild=args.full_rebuild, explain=args.explain, match=not args.no_match)
     success = integrator.integrate_payments()
     
     if not success:
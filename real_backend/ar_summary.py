@@ -0,0 +1,192 @@
+import argparse
+import time
+from datetime import date
+
+from dashboard_queries import AGING_BUCKETS, OUTSTANDING, PAYMENT_STATE, aging_bucket
+from ingest import get_connection
+
+
+def ensure_summary_schema(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ar_payment_daily (
+            tanggal DATE NOT NULL,
+            metode_pembayaran VARCHAR(50) NOT NULL,
+            payments INTEGER NOT NULL,
+            jumlah NUMERIC(15,2) NOT NULL,
+            PRIMARY KEY (tanggal, metode_pembayaran)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ar_invoice_daily (
+            tanggal DATE NOT NULL,
+            status VARCHAR(20) NOT NULL,
+            payment_state VARCHAR(20) NOT NULL,
+            invoices INTEGER NOT NULL,
+            total NUMERIC(15,2) NOT NULL,
+            paid NUMERIC(15,2) NOT NULL,
+            outstanding NUMERIC(15,2) NOT NULL,
+            overpaid NUMERIC(15,2) NOT NULL,
+            PRIMARY KEY (tanggal, status, payment_state)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ar_student_aging (
+            id_student VARCHAR(50) NOT NULL,
+            aging_bucket VARCHAR(10) NOT NULL,
+            invoices INTEGER NOT NULL,
+            outstanding NUMERIC(15,2) NOT NULL,
+            PRIMARY KEY (id_student, aging_bucket)
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS ar_summary_state (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            last_invoice_id INTEGER NOT NULL,
+            aging_as_of DATE NOT NULL
+        )
+    """)
+
+
+def _refresh_payment_days(cur, days):
+    """Re-aggregate ar_payment_daily for `days`, or for every day when None"""
+    where = "WHERE tanggal = ANY(%(days)s)" if days is not None else ""
+    cur.execute(f"DELETE FROM ar_payment_daily {where}", {'days': days})
+    cur.execute(f"""
+        INSERT INTO ar_payment_daily (tanggal, metode_pembayaran, payments, jumlah)
+        SELECT tanggal, metode_pembayaran, COUNT(*), SUM(jumlah)
+        FROM penerimaan_penjualan {where}
+        GROUP BY tanggal, metode_pembayaran
+    """, {'days': days})
+
+
+def _refresh_invoice_days(cur, days):
+    """Re-aggregate ar_invoice_daily for `days`, or for every day when None"""
+    where = "WHERE pt.tanggal = ANY(%(days)s)" if days is not None else ""
+    cur.execute(f"DELETE FROM ar_invoice_daily {where.replace('pt.', '')}", {'days': days})
+    cur.execute(f"""
+        INSERT INTO ar_invoice_daily (tanggal, status, payment_state, invoices, total, paid, outstanding, overpaid)
+        SELECT pt.tanggal, COALESCE(pt.status, ''), {PAYMENT_STATE}, COUNT(*), SUM(pt.total),
+               SUM(COALESCE(pt.jumlah_pembayaran, 0)), SUM(GREATEST({OUTSTANDING}, 0)),
+               SUM(GREATEST(-{OUTSTANDING}, 0))
+        FROM piutang_tagihan pt {where}
+        GROUP BY 1, 2, 3
+    """, {'days': days})
+
+
+def _refresh_aging(cur, students, today):
+    """Re-bucket the open invoices of `students` (everyone when None) as of `today`"""
+    where = "AND pt.id_student = ANY(%(students)s)" if students is not None else ""
+    cur.execute(f"DELETE FROM ar_student_aging {'WHERE id_student = ANY(%(students)s)' if students is not None else ''}",
+                {'students': students})
+    cur.execute(f"""
+        INSERT INTO ar_student_aging (id_student, aging_bucket, invoices, outstanding)
+        SELECT pt.id_student, {aging_bucket('%(today)s::date')}, COUNT(*), SUM({OUTSTANDING})
+        FROM piutang_tagihan pt
+        WHERE {OUTSTANDING} > 0 AND {aging_bucket('%(today)s::date')} IS NOT NULL {where}
+        GROUP BY 1, 2
+    """, {'students': students, 'today': today})
+
+
+def _crossing_students(cur, as_of, today):
+    """Students with an open invoice that moved into another aging bucket between `as_of` and `today`"""
+    bounds = [0] + [upper for _, _, upper in AGING_BUCKETS]
+    crossing = ' OR '.join(f"(pt.tanggal > %(as_of)s::date - {b} AND pt.tanggal <= %(today)s::date - {b})" for b in bounds)
+    cur.execute(f"""
+        SELECT DISTINCT pt.id_student FROM piutang_tagihan pt
+        WHERE ({crossing}) AND {OUTSTANDING} > 0
+    """, {'as_of': as_of, 'today': today})
+    return {row[0] for row in cur.fetchall()}
+
+
+def refresh_summaries(conn, since=None, invoices=None, students=None, overlap='0', today=None):
+    """Bring the dashboard summary tables up to date; returns what was refreshed
+
+    `invoices` and `students` are those whose payments or allocation changed;
+    every invoice of `students` is re-aggregated. Receipts written since
+    `since` (minus `overlap`) mark their days as changed. New invoices are
+    found by id past the last refresh. Aging first rolls forward
+    to `today`, re-bucketing only the students with an invoice that crossed a
+    bucket boundary since the last roll. With `invoices` None everything is
+    rebuilt.
+    """
+    today = today or date.today()
+    with conn.cursor() as cur:
+        ensure_summary_schema(cur)
+        cur.execute("SELECT last_invoice_id, aging_as_of FROM ar_summary_state FOR UPDATE")
+        state = cur.fetchone()
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM piutang_tagihan")
+        last_invoice_id = cur.fetchone()[0]
+        full = invoices is None or state is None or since is None
+        refreshed = {'payment_days': 0, 'invoice_days': 0, 'students': 0, 'rolled': 0}
+
+        if full:
+            _refresh_payment_days(cur, None)
+            _refresh_invoice_days(cur, None)
+            _refresh_aging(cur, None, today)
+            cur.execute("""
+                SELECT (SELECT COUNT(DISTINCT tanggal) FROM ar_payment_daily),
+                       (SELECT COUNT(DISTINCT tanggal) FROM ar_invoice_daily),
+                       (SELECT COUNT(DISTINCT id_student) FROM ar_student_aging)
+            """)
+            refreshed['payment_days'], refreshed['invoice_days'], refreshed['students'] = cur.fetchone()
+        else:
+            last_id, as_of = state
+            if as_of != today:
+                rolled = _crossing_students(cur, as_of, today) if as_of < today else None
+                _refresh_aging(cur, list(rolled) if rolled is not None else None, today)
+                refreshed['rolled'] = len(rolled) if rolled is not None else -1
+            cur.execute("""
+                SELECT DISTINCT tanggal FROM penerimaan_penjualan
+                WHERE tanggal_update >= %s::timestamp - %s::interval
+            """, (since, overlap))
+            payment_days = [row[0] for row in cur.fetchall()]
+            # The allocation rewrites every invoice of a touched student, not only the referenced ones
+            cur.execute("""
+                SELECT DISTINCT tanggal, id_student FROM piutang_tagihan
+                WHERE nomor_invoice = ANY(%s) OR id_student = ANY(%s) OR id > %s
+            """, (list(invoices), list(students or ()), last_id))
+            rows = cur.fetchall()
+            invoice_days = sorted({row[0] for row in rows})
+            students = set(students or ()) | {row[1] for row in rows}
+            if payment_days:
+                _refresh_payment_days(cur, payment_days)
+            if invoice_days:
+                _refresh_invoice_days(cur, invoice_days)
+            if students:
+                _refresh_aging(cur, list(students), today)
+            refreshed.update(payment_days=len(payment_days), invoice_days=len(invoice_days), students=len(students))
+
+        cur.execute("""
+            INSERT INTO ar_summary_state (id, last_invoice_id, aging_as_of) VALUES (TRUE, %s, %s)
+            ON CONFLICT (id) DO UPDATE SET last_invoice_id = EXCLUDED.last_invoice_id, aging_as_of = EXCLUDED.aging_as_of
+        """, (last_invoice_id, today))
+    conn.commit()
+    return refreshed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Roll the dashboard's aging summary forward to today, e.g. nightly from cron.")
+    parser.add_argument('--rebuild', action='store_true', help='Rebuild every summary table from scratch')
+    args = parser.parse_args()
+
+    conn = get_connection('accurate')
+    try:
+        started = time.perf_counter()
+        # Nothing changed since now: only the aging roll-forward and new invoices are picked up
+        with conn.cursor() as cur:
+            cur.execute("SELECT NOW()::timestamp")
+            now = cur.fetchone()[0]
+        refreshed = refresh_summaries(conn, None if args.rebuild else now, None if args.rebuild else set())
+    finally:
+        conn.close()
+    print("\n📊 AR summary tables:")
+    if args.rebuild:
+        print(f"• Rebuilt: {refreshed['payment_days']} payment days, {refreshed['invoice_days']} invoice days, "
+              f"{refreshed['students']} students with open invoices")
+    elif refreshed['rolled'] < 0:
+        print("• Aging rebuilt for every student (the last roll was dated after today)")
+    else:
+        print(f"• Aging rolled forward for {refreshed['rolled']} students")
+        print(f"• New invoices: {refreshed['invoice_days']} days and {refreshed['students']} students refreshed")
+    print(f"⏱️ Done in {time.perf_counter() - started:.2f}s")
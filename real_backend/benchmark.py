@@ -0,0 +1,203 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import subprocess
+import time
+from datetime import datetime
+
+from psycopg2 import sql
+
+import config
+from app import PaymentIntegrator
+from dashboard_queries import PANELS, SUMMARIZED, Filters, invoice_rows, summaries_ready
+from ingest import get_connection
+from metrics import METRICS_DIR
+from pipeline import run_pipeline
+from sources import ADAPTERS
+from synthetic_data import FILES, generate
+
+RESULTS_FILE = os.path.join(METRICS_DIR, 'benchmarks.jsonl')
+
+# Loader runs in load order: (stage, adapter, synthetic file key)
+LOADS = [
+    ('ingest_students', 'students', 'students'),
+    ('ingest_invoices', 'piutang_tagihan', 'invoices'),
+    ('ingest_accurate', 'penerimaan_penjualan', 'accurate'),
+    ('ingest_xendit', 'xendit', 'xendit'),
+    ('ingest_paperid', 'paperid', 'paperid'),
+]
+
+# --reset refuses to run unless every database name matches this pattern;
+# BENCHMARK_DB_PATTERN in config.py overrides it
+SCRATCH_DB_PATTERN = getattr(config, 'BENCHMARK_DB_PATTERN', r'bench|scratch|test')
+
+# Tables emptied by --reset, per database; missing ones are skipped
+RESET_TABLES = {
+    'accurate': ['students', 'piutang_tagihan', 'penerimaan_penjualan', 'ingest_checkpoint', 'import_manifest',
+                 'import_manifest_block', 'integrator_watermark', 'integrator_recompute',
+                 'payment_match_candidates', 'payment_allocation', 'invoice_allocation', 'student_allocation',
+                 'ar_payment_daily', 'ar_invoice_daily', 'ar_student_aging', 'ar_summary_state'],
+    'xendit': ['payments', 'ingest_checkpoint', 'import_manifest', 'import_manifest_block'],
+    'paperid': ['payments', 'ingest_checkpoint', 'import_manifest', 'import_manifest_block'],
+}
+
+
+def reset_databases():
+    """Empty every table the benchmark loads into, in all three databases
+
+    Refuses, without touching anything, unless every database is named like
+    a scratch database (SCRATCH_DB_PATTERN). Returns False when it refused.
+    """
+    connections = {db_key: get_connection(db_key) for db_key in RESET_TABLES}
+    try:
+        names = {}
+        for db_key, conn in connections.items():
+            with conn.cursor() as cur:
+                cur.execute("SELECT current_database()")
+                names[db_key] = cur.fetchone()[0]
+        refused = {db_key: name for db_key, name in names.items()
+                   if not re.search(SCRATCH_DB_PATTERN, name, re.IGNORECASE)}
+        if refused:
+            print(f"🔴 --reset refused: {', '.join(f'{k}={v}' for k, v in refused.items())} "
+                  f"does not match {SCRATCH_DB_PATTERN!r}. Point config.py at scratch databases, "
+                  f"or set BENCHMARK_DB_PATTERN.")
+            return False
+        for db_key, tables in RESET_TABLES.items():
+            conn = connections[db_key]
+            with conn.cursor() as cur:
+                cur.execute("SELECT name FROM unnest(%s::text[]) AS name WHERE to_regclass(name) IS NOT NULL",
+                            (tables,))
+                existing = [row[0] for row in cur.fetchall()]
+                if existing:
+                    cur.execute(sql.SQL("TRUNCATE {} CASCADE").format(
+                        sql.SQL(', ').join(sql.Identifier(name) for name in existing)))
+            conn.commit()
+        return True
+    finally:
+        for conn in connections.values():
+            conn.close()
+
+
+def _git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return result.stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Benchmark:
+    """Times each stage of a run and records the results next to the metrics"""
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.stages = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a block; the block sets self.rows to what it processed"""
+        self.rows = 0
+        output = contextlib.nullcontext() if self.verbose else contextlib.redirect_stdout(io.StringIO())
+        started = time.perf_counter()
+        with output:
+            yield
+        seconds = time.perf_counter() - started
+        self.stages[name] = {'seconds': round(seconds, 3), 'rows': self.rows,
+                             'rows_per_second': round(self.rows / seconds, 1) if seconds else 0.0}
+        print(f"• {name}: {self.rows:,} rows in {seconds:.2f}s ({self.stages[name]['rows_per_second']:,.0f} rows/s)")
+
+    def record(self, **extra):
+        """Append this run to RESULTS_FILE and return the previous run with the same parameters"""
+        line = {'time': datetime.now().isoformat(timespec='seconds'), 'commit': _git_commit(), **extra,
+                'stages': self.stages}
+        previous = None
+        if os.path.exists(RESULTS_FILE):
+            with open(RESULTS_FILE, encoding='utf-8') as f:
+                for old in map(json.loads, f):
+                    if all(old.get(k) == v for k, v in extra.items()):
+                        previous = old
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(RESULTS_FILE, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(line) + '\n')
+        return previous
+
+
+def run_loads(bench, data_dir):
+    for stage, adapter_name, file_key in LOADS:
+        adapter = ADAPTERS[adapter_name]
+        conn = get_connection(adapter.db_key)
+        try:
+            with bench.stage(stage):
+                stats = run_pipeline(adapter, os.path.join(data_dir, FILES[file_key]), conn, resume=False)
+                bench.rows = stats['read']
+        finally:
+            conn.close()
+
+
+def run_integration(bench):
+    # The first run integrates the freshly loaded gateways; the second finds nothing
+    # new, which is what most scheduled runs cost
+    for stage in ('integrate', 'integrate_noop'):
+        with bench.stage(stage):
+            integrator = PaymentIntegrator(incremental=True)
+            integrator.integrate_payments()
+            bench.rows = integrator.stats['total_processed'] + integrator.stats['xendit_skipped'] + \
+                integrator.stats['paperid_skipped']
+
+
+def run_dashboard(bench):
+    """What the dashboard asks the database for on first load: every aggregate panel, unfiltered"""
+    conn = get_connection('accurate')
+    try:
+        summaries = bool(summaries_ready(conn)['ready'].iloc[0])
+        with bench.stage('dashboard'):
+            bench.rows = sum(len(panel(conn, Filters(), summaries=True) if summaries and panel in SUMMARIZED
+                                 else panel(conn, Filters())) for panel in PANELS)
+        # The detail tables' frame at full size: int64 cents, categoricals, NumPy-derived columns
+        with bench.stage('dashboard_frames'):
+            bench.rows = len(invoice_rows(conn, Filters(), limit=None))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time synthetic-data ingest, integration and dashboard queries against local PostgreSQL.")
+    parser.add_argument('--invoices', type=int, default=10000, help='Invoices to generate (default 10,000)')
+    parser.add_argument('--data', default='synthetic', help='Directory for the generated CSV files')
+    parser.add_argument('--keep-data', action='store_true', help='Reuse the files already in --data')
+    parser.add_argument('--reset', action='store_true',
+                        help='Empty the target tables first. Refused unless every database name '
+                             'matches BENCHMARK_DB_PATTERN (default: bench, scratch or test)')
+    parser.add_argument('--skip', action='append', default=[], choices=['ingest', 'integrate', 'dashboard'],
+                        help='Leave a part out (repeatable)')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the loaders and the integrator')
+    args = parser.parse_args()
+
+    bench = Benchmark(verbose=args.verbose)
+    print(f"\n⏱️ Benchmark with {args.invoices:,} invoices:")
+    if not args.keep_data:
+        with bench.stage('generate'):
+            bench.rows = sum(generate(args.data, args.invoices).values())
+    if args.reset and not reset_databases():
+        exit(1)
+    if 'ingest' not in args.skip:
+        run_loads(bench, args.data)
+    if 'integrate' not in args.skip:
+        run_integration(bench)
+    if 'dashboard' not in args.skip:
+        run_dashboard(bench)
+
+    previous = bench.record(invoices=args.invoices, reset=args.reset, skip=sorted(args.skip))
+    if previous:
+        print(f"\n📊 Compared with {previous['time']} ({previous.get('commit') or 'unknown commit'}):")
+        for name, stage in bench.stages.items():
+            before = previous['stages'].get(name)
+            if before and before['seconds']:
+                change = (stage['seconds'] - before['seconds']) / before['seconds'] * 100
+                print(f"• {name}: {before['seconds']:.2f}s → {stage['seconds']:.2f}s ({change:+.0f}%)")
+    print(f"• Results appended to {RESULTS_FILE}")
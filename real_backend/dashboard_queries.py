@@ -0,0 +1,403 @@
+import argparse
+import re
+import time
+import warnings
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from normalize import MINOR_UNITS
+
+try:
+    import duckdb
+except ImportError:     # only needed for the embedded backend
+    duckdb = None
+
+# Aging buckets as [lower, upper) days since the invoice date, as in the dashboard's chart
+AGING_BUCKETS = [('0-30', 0, 30), ('31-60', 30, 60), ('61-90', 60, 90), ('91-120', 90, 120), ('120+', 120, 9999)]
+
+# Unpaid invoices have no jumlah_pembayaran yet, which counts as nothing paid
+OUTSTANDING = "(pt.total - COALESCE(pt.jumlah_pembayaran, 0))"
+
+# Paid / Unpaid / Partially Paid / Overpaid from the amounts, without due dates
+PAYMENT_STATE = f"""CASE
+                   WHEN {OUTSTANDING} = 0 THEN 'Paid'
+                   WHEN {OUTSTANDING} = pt.total THEN 'Unpaid'
+                   WHEN {OUTSTANDING} > 0 AND {OUTSTANDING} < pt.total THEN 'Partially Paid'
+                   ELSE 'Overpaid'
+               END"""
+
+# Categories of payment_state in the compact invoice frame, in PAYMENT_STATE's order
+PAYMENT_STATES = ['Paid', 'Unpaid', 'Partially Paid', 'Overpaid']
+
+# int64 cents in the compact frames
+MONEY_COLUMNS = {'total', 'jumlah_pembayaran', 'outstanding', 'overpayment', 'jumlah'}
+
+# Rows returned by the detail tables at most
+DETAIL_LIMIT = 5000
+
+
+@dataclass(frozen=True)
+class Filters:
+    """The dashboard's sidebar selection; None or empty means no filter"""
+    student: Optional[str] = None
+    invoice_dates: Optional[tuple] = None   # (first, last) day, both included
+    payment_dates: Optional[tuple] = None
+    methods: tuple = ()
+
+
+def _invoice_where(filters):
+    conditions, params = ["TRUE"], {}
+    if filters.student:
+        conditions.append("pt.id_student = %(student)s")
+        params['student'] = filters.student
+    if filters.invoice_dates:
+        conditions.append("pt.tanggal BETWEEN %(invoice_from)s AND %(invoice_to)s")
+        params['invoice_from'], params['invoice_to'] = filters.invoice_dates
+    return ' AND '.join(conditions), params
+
+
+def _payment_where(filters):
+    conditions, params = ["TRUE"], {}
+    if filters.student:
+        conditions.append("pp.id_student = %(student)s")
+        params['student'] = filters.student
+    if filters.payment_dates:
+        conditions.append("pp.tanggal BETWEEN %(payment_from)s AND %(payment_to)s")
+        params['payment_from'], params['payment_to'] = filters.payment_dates
+    if filters.methods:
+        names = [f"method_{i}" for i in range(len(filters.methods))]
+        conditions.append(f"pp.metode_pembayaran IN ({', '.join(f'%({name})s' for name in names)})")
+        params.update(zip(names, filters.methods))
+    return ' AND '.join(conditions), params
+
+
+def _payment_table(filters, summaries):
+    """ar_payment_daily answers every payment panel that is not filtered by student"""
+    return "ar_payment_daily" if summaries and not filters.student else "penerimaan_penjualan"
+
+
+def _frame(conn, query, params=None):
+    """Run `query` (psycopg2 %(name)s parameters) on PostgreSQL or DuckDB and return a DataFrame"""
+    params = params or {}
+    if duckdb is not None and isinstance(conn, duckdb.DuckDBPyConnection):
+        return conn.execute(re.sub(r'%\((\w+)\)s', r'$\1', query), params).df()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)    # pandas prefers SQLAlchemy, psycopg2 works too
+        return pd.read_sql(query, conn, params=params)
+
+
+def summaries_ready(conn):
+    """One row, ready: True once ar_summary.py or the integrator has filled the summary tables"""
+    ready = _frame(conn, "SELECT to_regclass('ar_summary_state') IS NOT NULL AS ready")
+    if ready['ready'].iloc[0]:
+        ready = _frame(conn, "SELECT EXISTS (SELECT 1 FROM ar_summary_state) AS ready")
+    return ready
+
+
+def filter_options(conn):
+    """Date bounds of invoices and payments for the sidebar, as one row"""
+    return _frame(conn, """
+        SELECT (SELECT MIN(tanggal) FROM piutang_tagihan) AS invoice_from,
+               (SELECT MAX(tanggal) FROM piutang_tagihan) AS invoice_to,
+               (SELECT MIN(tanggal) FROM penerimaan_penjualan) AS payment_from,
+               (SELECT MAX(tanggal) FROM penerimaan_penjualan) AS payment_to
+    """)
+
+
+def student_ids(conn):
+    return _frame(conn, "SELECT id_student FROM students ORDER BY id_student")
+
+
+def payment_methods(conn):
+    return _frame(conn, "SELECT DISTINCT metode_pembayaran FROM penerimaan_penjualan ORDER BY metode_pembayaran")
+
+
+def status_summary(conn, filters, summaries=False):
+    """Invoice count per stored status"""
+    where, params = _invoice_where(filters)
+    if summaries and not filters.student:
+        return _frame(conn, f"""
+            SELECT NULLIF(pt.status, '') AS "Status", SUM(pt.invoices) AS "Count"
+            FROM ar_invoice_daily pt WHERE {where}
+            GROUP BY pt.status ORDER BY 2 DESC
+        """, params)
+    return _frame(conn, f"""
+        SELECT pt.status AS "Status", COUNT(*) AS "Count"
+        FROM piutang_tagihan pt WHERE {where}
+        GROUP BY pt.status ORDER BY COUNT(*) DESC
+    """, params)
+
+
+def kpis(conn, filters, summaries=False):
+    """Total invoiced, paid, outstanding and overpaid, as one row"""
+    where, params = _invoice_where(filters)
+    if summaries and not filters.student:
+        return _frame(conn, f"""
+            SELECT COALESCE(SUM(pt.total), 0) AS total_invoiced, COALESCE(SUM(pt.paid), 0) AS total_paid,
+                   COALESCE(SUM(pt.outstanding), 0) AS total_outstanding,
+                   COALESCE(SUM(pt.overpaid), 0) AS total_overpaid
+            FROM ar_invoice_daily pt WHERE {where}
+        """, params)
+    return _frame(conn, f"""
+        SELECT COALESCE(SUM(pt.total), 0) AS total_invoiced,
+               COALESCE(SUM(pt.jumlah_pembayaran), 0) AS total_paid,
+               COALESCE(SUM(GREATEST({OUTSTANDING}, 0)), 0) AS total_outstanding,
+               COALESCE(SUM(GREATEST(-{OUTSTANDING}, 0)), 0) AS total_overpaid
+        FROM piutang_tagihan pt WHERE {where}
+    """, params)
+
+
+def overpaid_students(conn, filters):
+    where, params = _invoice_where(filters)
+    return _frame(conn, f"""
+        SELECT pt.id_student, s.name, SUM(GREATEST(-{OUTSTANDING}, 0)) AS overpayment
+        FROM piutang_tagihan pt LEFT JOIN students s ON s.id_student = pt.id_student
+        WHERE {where} AND {OUTSTANDING} < 0
+        GROUP BY pt.id_student, s.name
+        ORDER BY overpayment DESC, pt.id_student
+    """, params)
+
+
+def aging_bucket(day):
+    """SQL for the aging bucket of invoice pt on `day`, NULL when dated after it or too old"""
+    buckets = ' '.join(f"WHEN {day} - pt.tanggal < {upper} THEN '{label}'" for label, _, upper in AGING_BUCKETS)
+    return f"CASE WHEN {day} - pt.tanggal < 0 THEN NULL {buckets} END"
+
+
+def aging(conn, filters, summaries=False):
+    """Outstanding amount per aging bucket, counting days since the invoice date"""
+    where, params = _invoice_where(filters)
+    if summaries and not filters.invoice_dates:
+        frame = _frame(conn, f"""
+            SELECT pt.aging_bucket, SUM(pt.outstanding) AS outstanding
+            FROM ar_student_aging pt WHERE {where}
+            GROUP BY pt.aging_bucket
+        """, params)
+    else:
+        frame = _frame(conn, f"""
+            SELECT {aging_bucket('CURRENT_DATE')} AS aging_bucket, SUM({OUTSTANDING}) AS outstanding
+            FROM piutang_tagihan pt
+            WHERE {where} AND {OUTSTANDING} > 0 AND {aging_bucket('CURRENT_DATE')} IS NOT NULL
+            GROUP BY 1
+        """, params)
+    labels = [label for label, _, _ in AGING_BUCKETS]
+    return frame.set_index('aging_bucket').reindex(labels, fill_value=0).reset_index()
+
+
+def top_customers(conn, filters, limit=10):
+    where, params = _invoice_where(filters)
+    return _frame(conn, f"""
+        SELECT pt.id_student, s.name, SUM({OUTSTANDING}) AS outstanding
+        FROM piutang_tagihan pt LEFT JOIN students s ON s.id_student = pt.id_student
+        WHERE {where}
+        GROUP BY pt.id_student, s.name
+        ORDER BY outstanding DESC, pt.id_student
+        LIMIT {int(limit)}
+    """, params)
+
+
+def status_breakdown(conn, filters, summaries=False):
+    """Invoice count per Paid / Unpaid / Partially Paid / Overpaid, from the amounts"""
+    where, params = _invoice_where(filters)
+    if summaries and not filters.student:
+        return _frame(conn, f"""
+            SELECT pt.payment_state AS "Status", SUM(pt.invoices) AS "Count"
+            FROM ar_invoice_daily pt WHERE {where}
+            GROUP BY 1 ORDER BY 2 DESC
+        """, params)
+    return _frame(conn, f"""
+        SELECT {PAYMENT_STATE} AS "Status",
+               COUNT(*) AS "Count"
+        FROM piutang_tagihan pt WHERE {where}
+        GROUP BY 1 ORDER BY 2 DESC
+    """, params)
+
+
+def payments_by_method(conn, filters, summaries=False):
+    where, params = _payment_where(filters)
+    return _frame(conn, f"""
+        SELECT pp.metode_pembayaran, SUM(pp.jumlah) AS jumlah
+        FROM {_payment_table(filters, summaries)} pp WHERE {where}
+        GROUP BY pp.metode_pembayaran ORDER BY jumlah DESC
+    """, params)
+
+
+def daily_payments_by_method(conn, filters, summaries=False):
+    where, params = _payment_where(filters)
+    return _frame(conn, f"""
+        SELECT pp.tanggal, pp.metode_pembayaran, SUM(pp.jumlah) AS jumlah
+        FROM {_payment_table(filters, summaries)} pp WHERE {where}
+        GROUP BY pp.tanggal, pp.metode_pembayaran
+        ORDER BY pp.tanggal, pp.metode_pembayaran
+    """, params)
+
+
+def daily_invoices(conn, filters, summaries=False):
+    where, params = _invoice_where(filters)
+    table = "ar_invoice_daily" if summaries and not filters.student else "piutang_tagihan"
+    return _frame(conn, f"""
+        SELECT pt.tanggal, SUM(pt.total) AS total
+        FROM {table} pt WHERE {where}
+        GROUP BY pt.tanggal ORDER BY pt.tanggal
+    """, params)
+
+
+def daily_payments(conn, filters, summaries=False):
+    where, params = _payment_where(filters)
+    return _frame(conn, f"""
+        SELECT pp.tanggal, SUM(pp.jumlah) AS jumlah
+        FROM {_payment_table(filters, summaries)} pp WHERE {where}
+        GROUP BY pp.tanggal ORDER BY pp.tanggal
+    """, params)
+
+
+def _limit(limit):
+    return f"LIMIT {int(limit)}" if limit else ""
+
+
+def _category(values):
+    """Categorical in first-seen order; sorting a million labels costs more than the rest together"""
+    codes, uniques = pd.factorize(values)
+    return pd.Categorical.from_codes(codes, uniques)
+
+
+def _cents(values):
+    """int64 minor units of a NUMERIC column as read back from the database; NULL is 0"""
+    amounts = pd.to_numeric(values).fillna(0).to_numpy(dtype=np.float64)
+    return np.rint(amounts * MINOR_UNITS).astype(np.int64)
+
+
+def compact_invoices(frame, today=None):
+    """Invoice rows with int64 cents, categorical ids and statuses, and the derived columns in NumPy
+
+    outstanding, overpayment, payment_state and aging_bucket are computed
+    column-wise; aging_bucket is only set for invoices with something
+    outstanding, like the aging panel.
+    """
+    total = _cents(frame['total'])
+    paid = _cents(frame['jumlah_pembayaran'])     # NULL: nothing paid yet
+    outstanding = total - paid
+    tanggal = pd.to_datetime(frame['tanggal']).to_numpy().astype('datetime64[D]')
+    days = (np.datetime64(today or date.today(), 'D') - tanggal).astype(np.int64)
+    uppers = np.array([upper for _, _, upper in AGING_BUCKETS])
+    bucket = np.searchsorted(uppers, days, side='right')
+    bucket[np.isnat(tanggal) | (days < 0) | (bucket == len(uppers)) | (outstanding <= 0)] = -1
+    state = np.select([outstanding == 0, outstanding == total, (outstanding > 0) & (outstanding < total)],
+                      [0, 1, 2], 3)
+    return pd.DataFrame({
+        'nomor_invoice': frame['nomor_invoice'].to_numpy(),
+        'id_student': _category(frame['id_student']),
+        'name': frame['name'].to_numpy(),
+        'email': frame['email'].to_numpy(),
+        'tanggal': pd.to_datetime(frame['tanggal']).to_numpy(),
+        'total': total,
+        'jumlah_pembayaran': paid,
+        'outstanding': outstanding,
+        'overpayment': np.maximum(-outstanding, 0),
+        'status': _category(frame['status']),
+        'payment_state': pd.Categorical.from_codes(state, PAYMENT_STATES),
+        'aging_bucket': pd.Categorical.from_codes(bucket, [label for label, _, _ in AGING_BUCKETS], ordered=True),
+    })
+
+
+def compact_payments(frame):
+    """Payment rows with int64 cents and categorical student and method"""
+    jumlah = _cents(frame['jumlah'])
+    return pd.DataFrame({
+        'nomor_penerimaan': frame['nomor_penerimaan'].to_numpy(),
+        'nomor_invoice': frame['nomor_invoice'].to_numpy(),
+        'id_student': _category(frame['id_student']),
+        'tanggal': pd.to_datetime(frame['tanggal']).to_numpy(),
+        'metode_pembayaran': _category(frame['metode_pembayaran']),
+        'jumlah': jumlah,
+    })
+
+
+def in_rupiah(frame):
+    """Copy of a compact frame with the cents columns back in rupiah, for display"""
+    frame = frame.copy()
+    for col in MONEY_COLUMNS & set(frame.columns):
+        frame[col] = frame[col] / MINOR_UNITS
+    return frame
+
+
+def invoice_rows(conn, filters, limit=DETAIL_LIMIT, compact=True):
+    """Filtered invoices with student name and email, newest first; `limit` None reads them all"""
+    where, params = _invoice_where(filters)
+    frame = _frame(conn, f"""
+        SELECT pt.nomor_invoice, pt.id_student, s.name, s.email, pt.tanggal, pt.total, pt.jumlah_pembayaran,
+               pt.status
+        FROM piutang_tagihan pt LEFT JOIN students s ON s.id_student = pt.id_student
+        WHERE {where}
+        ORDER BY pt.tanggal DESC, pt.nomor_invoice
+        {_limit(limit)}
+    """, params)
+    return compact_invoices(frame) if compact else frame
+
+
+def payment_rows(conn, filters, limit=DETAIL_LIMIT, compact=True):
+    """Filtered payments, newest first; `limit` None reads them all"""
+    where, params = _payment_where(filters)
+    frame = _frame(conn, f"""
+        SELECT pp.nomor_penerimaan, pp.nomor_invoice, pp.id_student, pp.tanggal, pp.metode_pembayaran, pp.jumlah
+        FROM penerimaan_penjualan pp WHERE {where}
+        ORDER BY pp.tanggal DESC, pp.nomor_penerimaan
+        {_limit(limit)}
+    """, params)
+    return compact_payments(frame) if compact else frame
+
+
+def frame_report(conn, filters=Filters(), limit=None):
+    """Time and memory of reading the invoice rows and of making them compact, per column"""
+    started = time.perf_counter()
+    raw = invoice_rows(conn, filters, limit, compact=False)
+    read = time.perf_counter() - started
+    started = time.perf_counter()
+    compact = compact_invoices(raw)
+    preprocess = time.perf_counter() - started
+    raw_bytes, compact_bytes = raw.memory_usage(deep=True), compact.memory_usage(deep=True)
+    return {
+        'rows': len(raw),
+        'read_seconds': read,
+        'preprocess_seconds': preprocess,
+        'raw_bytes': int(raw_bytes.sum()),
+        'compact_bytes': int(compact_bytes.sum()),
+        'columns': {col: (int(raw_bytes.get(col, 0)), int(compact_bytes[col])) for col in compact.columns},
+    }
+
+
+# Every aggregate panel of the dashboard, in the order it draws them
+PANELS = [status_summary, kpis, overpaid_students, aging, top_customers, status_breakdown,
+          payments_by_method, daily_payments_by_method, daily_invoices, daily_payments]
+
+# Panels that can read the summary tables kept by ar_summary.py instead
+SUMMARIZED = {status_summary, kpis, aging, status_breakdown, payments_by_method, daily_payments_by_method,
+              daily_invoices, daily_payments}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report time and memory of the dashboard's invoice frame.")
+    parser.add_argument('--duckdb', help='Read this DuckDB file instead of the Accurate PostgreSQL database')
+    parser.add_argument('--limit', type=int, help='Read at most this many invoices (default all)')
+    args = parser.parse_args()
+
+    if args.duckdb:
+        conn = duckdb.connect(args.duckdb, read_only=True)
+    else:
+        from ingest import get_connection
+        conn = get_connection('accurate')
+    try:
+        report = frame_report(conn, limit=args.limit)
+    finally:
+        conn.close()
+
+    print(f"\n📊 Invoice frame: {report['rows']:,} rows")
+    print(f"⏱️ Read in {report['read_seconds']:.2f}s, made compact in {report['preprocess_seconds']:.3f}s")
+    print(f"• Memory: {report['raw_bytes'] / 2**20:,.1f} MB as read, {report['compact_bytes'] / 2**20:,.1f} MB compact")
+    for col, (raw, compact) in report['columns'].items():
+        print(f"  - {col}: {raw / 2**20:,.1f} MB → {compact / 2**20:,.1f} MB" if raw else
+              f"  - {col}: {compact / 2**20:,.1f} MB (derived)")
@@ -1,96 +1,33 @@
-import csv
-import psycopg2
 import argparse
+from ingest import DEFAULT_BATCH_SIZE, get_connection
+from pipeline import run_pipeline
+from sources import ADAPTERS
+from validate import validate_file
 
 def get_db_connection():
-    conn = psycopg2.connect(
-        host="localhost",
-        port=5432,
-        database="dummy_accurate",
-        user="postgres",
-        password="1234"
-    )
-    return conn
+    return get_connection('accurate')
 
-def insert_student(data, conn):
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT COUNT(*) FROM students WHERE id_student = %s", (data['id_student'],))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute("INSERT INTO students (id_student, name, email) VALUES (%s, %s, %s)",
-                           (data['id_student'], data['name'], data['email']))
-            conn.commit()
-            print(f"Inserted student: {data['id_student']}")
-        else:
-            print(f"Student already exists: {data['id_student']}")
-    except Exception as e:
-        print(f"Error inserting student: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
+def process_csv(file_path, table_name, conn, batch_size=DEFAULT_BATCH_SIZE, resume=True):
+    return run_pipeline(ADAPTERS[table_name], file_path, conn, batch_size=batch_size, resume=resume)
 
-def insert_invoice(data, conn):
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT COUNT(*) FROM piutang_tagihan WHERE nomor_invoice = %s", (data['nomor_invoice'],))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute("""INSERT INTO piutang_tagihan (nomor_invoice, id_student, tanggal, total, status)
-                              VALUES (%s, %s, %s, %s, %s)""",
-                           (data['nomor_invoice'], data['id_student'], data['tanggal'], data['total'], data['status']))
-            conn.commit()
-            print(f"Inserted invoice: {data['nomor_invoice']}")
-        else:
-            print(f"Invoice already exists: {data['nomor_invoice']}")
-    except Exception as e:
-        print(f"Error inserting invoice: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-
-def insert_payment(data, conn):
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT COUNT(*) FROM penerimaan_penjualan WHERE nomor_penerimaan = %s AND tanggal = %s",
-                       (data['nomor_penerimaan'], data['tanggal']))
-        if cursor.fetchone()[0] == 0:
-            cursor.execute("""INSERT INTO penerimaan_penjualan 
-                              (nomor_penerimaan, id_student, tanggal, jumlah, metode_pembayaran, nomor_invoice, tanggal_update)
-                              VALUES (%s, %s, %s, %s, %s, %s, NOW())""",
-                           (data['nomor_penerimaan'], data['id_student'], data['tanggal'], data['jumlah'],
-                            data['metode_pembayaran'], data['nomor_invoice']))
-            conn.commit()
-            print(f"Inserted payment: {data['nomor_penerimaan']}")
-        else:
-            print(f"Payment already exists: {data['nomor_penerimaan']}")
-    except Exception as e:
-        print(f"Error inserting payment: {e}")
-        conn.rollback()
-    finally:
-        cursor.close()
-
-def process_csv(file_path, table_name, conn):
-    with open(file_path, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f, delimiter=';')
-        print(f"Processing {table_name} CSV: {file_path}")
-        print(f"CSV headers: {reader.fieldnames}")
-        for row in reader:
-            try:
-                if table_name == 'students':
-                    insert_student(row, conn)
-                elif table_name == 'piutang_tagihan':
-                    insert_invoice(row, conn)
-                elif table_name == 'penerimaan_penjualan' and row.get('metode_pembayaran') in ['BCA 1111', 'Kas Sementara']:
-                    insert_payment(row, conn)
-            except KeyError as e:
-                print(f"Missing column {e} in row: {row}")
-            except Exception as e:
-                print(f"Error processing row {row}: {e}")
+def bulk_load_csv(file_path, table_name, conn, batch_size=DEFAULT_BATCH_SIZE, resume=True):
+    """Load each batch with COPY into a staging table and one set-based merge"""
+    return run_pipeline(ADAPTERS[table_name], file_path, conn, batch_size=batch_size, method='copy',
+                        resume=resume)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Import CSV data into database.")
     parser.add_argument('--students', help='Path to students CSV file')
     parser.add_argument('--invoice', help='Path to invoice CSV file')
     parser.add_argument('--payment', help='Path to payment CSV file')
+    parser.add_argument('--bulk', action='store_true',
+                        help='Load each file with COPY and one set-based merge instead of row by row')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Rows written and committed per batch')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='Ignore saved checkpoints and read each file from the start')
+    parser.add_argument('--validate', action='store_true',
+                        help='Only check the files and write a rejection report; nothing is loaded')
 
     args = parser.parse_args()
 
@@ -98,14 +35,24 @@ if __name__ == "__main__":
         print("Please provide at least one CSV file with --students, --invoice, or --payment")
         exit(1)
 
+    if args.validate:
+        parents = {}
+        failed = False
+        for path, table_name in [(args.students, 'students'), (args.invoice, 'piutang_tagihan'),
+                                 (args.payment, 'penerimaan_penjualan')]:
+            if path:
+                failed |= validate_file(ADAPTERS[table_name], path, parents)['errors'] > 0
+        exit(1 if failed else 0)
+
+    load = bulk_load_csv if args.bulk else process_csv
     conn = get_db_connection()
     try:
         if args.students:
-            process_csv(args.students, 'students', conn)
+            load(args.students, 'students', conn, args.batch_size, not args.no_resume)
         if args.invoice:
-            process_csv(args.invoice, 'piutang_tagihan', conn)
+            load(args.invoice, 'piutang_tagihan', conn, args.batch_size, not args.no_resume)
         if args.payment:
-            process_csv(args.payment, 'penerimaan_penjualan', conn)
+            load(args.payment, 'penerimaan_penjualan', conn, args.batch_size, not args.no_resume)
     finally:
         conn.close()
         print("Database connection closed.")
@@ -0,0 +1,266 @@
+import argparse
+import os
+
+from allocation import INVOICE_BALANCES, STUDENT_BALANCES, allocate, balance_update
+from metrics import METRICS_DIR, Metrics
+from normalize import AMOUNT_PATTERN, detect_date_format
+from sources import ADAPTERS, SOURCE_ID_COLUMNS
+from synthetic_data import FILES
+
+try:
+    import duckdb
+except ImportError:     # the embedded backend is optional; PostgreSQL stays the default
+    duckdb = None
+
+# Database file used when none is given; ARRECON_DUCKDB overrides it
+DEFAULT_PATH = os.environ.get('ARRECON_DUCKDB', 'recon.duckdb')
+
+# Same tables as the PostgreSQL DDL, with each gateway's payments in a schema named after it.
+# No foreign keys: DuckDB cannot update rows that other rows reference.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS students (
+        id_student VARCHAR PRIMARY KEY, name VARCHAR, email VARCHAR,
+        total_tagihan DECIMAL(15,2), tanggal_update TIMESTAMP);
+    CREATE TABLE IF NOT EXISTS piutang_tagihan (
+        nomor_invoice VARCHAR PRIMARY KEY, id_student VARCHAR NOT NULL, tanggal DATE NOT NULL,
+        total DECIMAL(15,2) NOT NULL, status VARCHAR DEFAULT 'Belum Lunas', jumlah_pembayaran DECIMAL(15,2),
+        tanggal_update TIMESTAMP);
+    CREATE TABLE IF NOT EXISTS penerimaan_penjualan (
+        nomor_penerimaan VARCHAR PRIMARY KEY, nomor_invoice VARCHAR, id_student VARCHAR NOT NULL,
+        tanggal DATE NOT NULL, metode_pembayaran VARCHAR NOT NULL, jumlah DECIMAL(15,2) NOT NULL,
+        status VARCHAR, tanggal_update TIMESTAMP);
+    CREATE SCHEMA IF NOT EXISTS xendit;
+    CREATE TABLE IF NOT EXISTS xendit.payments (
+        id_xendit_payment VARCHAR PRIMARY KEY, nomor_invoice VARCHAR NOT NULL, tanggal DATE NOT NULL,
+        jumlah DECIMAL(15,2) NOT NULL, id_student VARCHAR);
+    CREATE SCHEMA IF NOT EXISTS paperid;
+    CREATE TABLE IF NOT EXISTS paperid.payments (
+        id_paper_payment VARCHAR PRIMARY KEY, nomor_invoice VARCHAR NOT NULL, tanggal DATE NOT NULL,
+        jumlah DECIMAL(15,2) NOT NULL, id_student VARCHAR);
+"""
+
+# Loaders in load order, as (adapter, file key in synthetic_data.FILES)
+LOAD_ORDER = [('students', 'students'), ('piutang_tagihan', 'invoices'), ('penerimaan_penjualan', 'accurate'),
+              ('xendit', 'xendit'), ('paperid', 'paperid')]
+
+
+def _quote(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+class DuckDBBackend:
+    """The reconciliation core (load, integrate, allocate) on one embedded DuckDB file
+
+    Reads the CSV exports directly and runs every step as set-based SQL in
+    one process, without the three PostgreSQL databases. Loading goes
+    through the same sources.ADAPTERS descriptions as the PostgreSQL loaders,
+    and amounts are validated with the same pattern as normalize.to_minor_units.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, read_only=False, metrics_dir=None):
+        if duckdb is None:
+            raise RuntimeError("The DuckDB backend needs duckdb (pip install duckdb)")
+        self.path = path
+        self.conn = duckdb.connect(path, read_only=read_only)
+        if not read_only:
+            self.conn.execute(SCHEMA)
+        self.stats = {}
+        self.metrics = Metrics('duckdb', {'db': os.path.basename(path)}, metrics_dir)
+
+    def close(self):
+        self.conn.close()
+
+    @staticmethod
+    def _table(adapter):
+        return adapter.table if adapter.db_key == 'accurate' else f"{adapter.db_key}.{adapter.table}"
+
+    def _detect_dates(self, adapter, source):
+        formats = {}
+        for col, cast in adapter.casts.items():
+            if cast == 'date':
+                csv_col = adapter.columns[col]
+                sample = self.conn.execute(f"SELECT {_ident(csv_col)} FROM {source} LIMIT 500").df()[csv_col]
+                formats[col] = detect_date_format(sample)
+                if formats[col] is None:
+                    raise ValueError(f"No known date format fits column {csv_col!r}")
+        return formats
+
+    def load_csv(self, adapter_name, path):
+        """Load one CSV export through its adapter, skipping keys already loaded; returns the load stats"""
+        adapter = ADAPTERS[adapter_name]
+        source = f"read_csv({_quote(path)}, delim=';', header=true, all_varchar=true)"
+        formats = self._detect_dates(adapter, source)
+
+        typed, checks = [], []
+        for col, csv_col in adapter.columns.items():
+            value = f"NULLIF(trim(c.{_ident(csv_col)}), '')"
+            if col in formats:
+                expr = f"try_strptime({value}, {_quote(formats[col])})::DATE"
+                checks.append(f"{_ident(col)} IS NULL")
+            elif adapter.casts.get(col) == 'numeric':
+                expr = f"CASE WHEN regexp_full_match({value}, {_quote(AMOUNT_PATTERN)}) THEN {value}::DECIMAL(15,2) END"
+                checks.append(f"{_ident(col)} IS NULL")
+            else:
+                expr = value
+            typed.append(f"{expr} AS {_ident(col)}")
+        keep = "TRUE"
+        if adapter.row_filter:
+            csv_col, allowed = adapter.row_filter
+            keep = f"c.{_ident(csv_col)} IN ({', '.join(map(_quote, allowed))})"
+        self.conn.execute(f"""
+            CREATE OR REPLACE TEMP TABLE staging AS
+            SELECT {', '.join(typed)}, {keep} AS kept FROM {source} c
+        """)
+
+        table = self._table(adapter)
+        columns = list(adapter.columns)
+        key = ', '.join(_ident(col) for col in adapter.key_columns)
+        rejected = ' OR '.join(checks) or 'FALSE'
+        where = [f"kept AND NOT ({rejected})",
+                 f"NOT EXISTS (SELECT 1 FROM {table} t WHERE ({', '.join('t.' + _ident(c) for c in adapter.key_columns)})"
+                 f" = ({', '.join('s.' + _ident(c) for c in adapter.key_columns)}))"]
+        if adapter.reference:
+            ref_table, ref_col = adapter.reference
+            where.append(f"EXISTS (SELECT 1 FROM {ref_table} r WHERE r.{_ident(ref_col)} = s.{_ident(ref_col)})")
+        targets = columns + list(adapter.defaults)
+        values = [f"s.{_ident(col)}" for col in columns] + [expr for expr in adapter.defaults.values()]
+        read, filtered, bad = self.conn.execute(f"""
+            SELECT count(*), count(*) FILTER (WHERE NOT kept), count(*) FILTER (WHERE kept AND ({rejected}))
+            FROM staging
+        """).fetchone()
+        inserted = self.conn.execute(f"""
+            INSERT INTO {table} ({', '.join(map(_ident, targets))})
+            SELECT {', '.join(values)} FROM staging s
+            WHERE {' AND '.join(where)}
+            QUALIFY row_number() OVER (PARTITION BY {key}) = 1
+        """).fetchone()[0]
+        stats = {'read': read, 'filtered': filtered, 'rejected': bad, 'inserted': inserted,
+                 'skipped': read - filtered - bad - inserted}
+        self.metrics.add(f"load_{adapter_name}", rows_in=read, rows_out=inserted)
+        self.stats[adapter_name] = stats
+        return stats
+
+    def integrate(self):
+        """Copy gateway payments that are not in penerimaan_penjualan yet; returns integration stats"""
+        stats = {'total_processed': 0, 'already_integrated': 0, 'conflicts': 0}
+        for source, id_column in SOURCE_ID_COLUMNS.items():
+            already, conflicts = self.conn.execute(f"""
+                SELECT count(*) FILTER (WHERE p.metode_pembayaran = ?), count(*) FILTER (WHERE p.metode_pembayaran <> ?)
+                FROM {source}.payments g JOIN penerimaan_penjualan p ON p.nomor_penerimaan = g.{id_column}
+            """, [source, source]).fetchone()
+            inserted = self.conn.execute(f"""
+                INSERT INTO penerimaan_penjualan
+                (id_student, tanggal, nomor_invoice, jumlah, nomor_penerimaan, metode_pembayaran, tanggal_update)
+                SELECT id_student, tanggal, nomor_invoice, jumlah, {id_column}, ?, now()
+                FROM {source}.payments g
+                WHERE id_student IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM penerimaan_penjualan p WHERE p.nomor_penerimaan = g.{id_column})
+            """, [source]).fetchone()[0]
+            stats['total_processed'] += inserted
+            stats['already_integrated'] += already
+            stats['conflicts'] += conflicts
+        self.stats['integrate'] = stats
+        return stats
+
+    def allocate(self):
+        """Oldest-invoice-first allocation (allocation.allocate) into the same three tables as in PostgreSQL,
+        with the allocated balances copied to piutang_tagihan and students"""
+        invoices = self.conn.execute("""
+            SELECT nomor_invoice, id_student, strftime(tanggal, '%Y-%m-%d') AS tanggal, total
+            FROM piutang_tagihan ORDER BY tanggal, nomor_invoice
+        """).df()
+        payments = self.conn.execute("""
+            SELECT nomor_penerimaan, id_student, strftime(tanggal, '%Y-%m-%d') AS tanggal, jumlah
+            FROM penerimaan_penjualan ORDER BY tanggal, nomor_penerimaan
+        """).df()
+        allocations, invoice_balances, student_balances = allocate(invoices, payments)
+        self.conn.register('allocations_df', allocations)
+        self.conn.register('invoice_balances_df', invoice_balances)
+        self.conn.register('student_balances_df', student_balances)
+        self.conn.execute("""
+            CREATE OR REPLACE TABLE payment_allocation AS
+            SELECT nomor_penerimaan, nomor_invoice, id_student, cents::DECIMAL(18,2) / 100 AS jumlah
+            FROM allocations_df;
+            CREATE OR REPLACE TABLE invoice_allocation AS
+            SELECT nomor_invoice, id_student, tanggal::DATE AS tanggal, total::DECIMAL(18,2) / 100 AS total,
+                   paid::DECIMAL(18,2) / 100 AS jumlah_pembayaran, sisa::DECIMAL(18,2) / 100 AS sisa, status
+            FROM invoice_balances_df;
+            CREATE OR REPLACE TABLE student_allocation AS
+            SELECT id_student, total_invoice::DECIMAL(18,2) / 100 AS total_invoice,
+                   total_pembayaran::DECIMAL(18,2) / 100 AS total_pembayaran,
+                   total_tagihan::DECIMAL(18,2) / 100 AS total_tagihan, kredit::DECIMAL(18,2) / 100 AS kredit
+            FROM student_balances_df;
+        """)
+        for name in ('allocations_df', 'invoice_balances_df', 'student_balances_df'):
+            self.conn.unregister(name)
+        invoices = self.conn.execute(balance_update(INVOICE_BALANCES)[0]).fetchone()[0]
+        students = self.conn.execute(balance_update(STUDENT_BALANCES)[0]).fetchone()[0]
+        self.stats['allocate'] = {'allocations': len(allocations), 'students': len(student_balances),
+                                  'invoices_updated': invoices, 'students_updated': students}
+        return self.stats['allocate']
+
+    def run(self, files):
+        """Load `files` ({adapter name: path}) in load order, then integrate and allocate"""
+        for adapter_name, _ in LOAD_ORDER:
+            if files.get(adapter_name):
+                with self.metrics.stage(f"load_{adapter_name}"):
+                    self.load_csv(adapter_name, files[adapter_name])
+        for step in ('integrate', 'allocate'):
+            with self.metrics.stage(step):
+                getattr(self, step)()
+        self.metrics.emit(stats=self.stats)
+        return self.stats
+
+
+def _show_stats(stats, metrics):
+    seconds = {name: m['seconds'] for name, m in metrics.snapshot().items()}
+    print("\n📊 DuckDB reconciliation report:")
+    for adapter_name, _ in LOAD_ORDER:
+        if adapter_name in stats:
+            s = stats[adapter_name]
+            print(f"• {adapter_name}: {s['inserted']:,} inserted of {s['read']:,} read "
+                  f"({s['filtered']:,} filtered, {s['rejected']:,} rejected, {s['skipped']:,} skipped) "
+                  f"in {seconds[f'load_{adapter_name}']:.2f}s")
+    s = stats['integrate']
+    print(f"• Gateway payments integrated: {s['total_processed']:,} "
+          f"({s['already_integrated']:,} already in, {s['conflicts']:,} conflicts) in {seconds['integrate']:.2f}s")
+    s = stats['allocate']
+    print(f"• Allocation rows: {s['allocations']:,} over {s['students']:,} students, "
+          f"{s['invoices_updated']:,} invoices and {s['students_updated']:,} student balances updated "
+          f"in {seconds['allocate']:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run load, integration and recompute on an embedded DuckDB file.")
+    parser.add_argument('--db', default=DEFAULT_PATH, help=f'DuckDB database file (default {DEFAULT_PATH})')
+    parser.add_argument('--dir', help='Directory holding all five exports under their usual names')
+    parser.add_argument('--students', help='Path to students CSV file')
+    parser.add_argument('--invoice', help='Path to invoice CSV file')
+    parser.add_argument('--payment', help='Path to Accurate payment CSV file')
+    parser.add_argument('--xendit', help='Path to Xendit payments CSV file')
+    parser.add_argument('--paperid', help='Path to PaperID payments CSV file')
+    parser.add_argument('--metrics-dir', default=METRICS_DIR,
+                        help=f'Where metrics.jsonl and the .prom file are written (default {METRICS_DIR})')
+    args = parser.parse_args()
+
+    files = {}
+    if args.dir:
+        files = {adapter_name: os.path.join(args.dir, FILES[key]) for adapter_name, key in LOAD_ORDER}
+    files.update({adapter_name: path for adapter_name, path in [
+        ('students', args.students), ('piutang_tagihan', args.invoice), ('penerimaan_penjualan', args.payment),
+        ('xendit', args.xendit), ('paperid', args.paperid)] if path})
+
+    try:
+        backend = DuckDBBackend(args.db, metrics_dir=args.metrics_dir)
+    except RuntimeError as e:
+        print(f"🔴 {str(e)}")
+        raise SystemExit(1)
+    try:
+        stats = backend.run(files)
+        _show_stats(stats, backend.metrics)
+    finally:
+        backend.close()
@@ -0,0 +1,498 @@
+import csv
+import hashlib
+import io
+import os
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+try:
+    import config
+except ImportError:     # the tests import this module without database settings
+    config = None
+
+from key_index import KeyIndex
+from metrics import Metrics, instrument
+from manifest import (already_imported, ensure_manifest_tables, hash_blocks, imported_unchanged, matched_blocks,
+                      note_reupload, prefix_digest, record_import)
+from normalize import MINOR_UNITS, NormalizationError, Normalizer
+
+DEFAULT_BATCH_SIZE = 10000
+FINGERPRINT_BYTES = 1 << 20
+
+def get_connection(db_key):
+    """Open a connection to one of the databases in config.DATABASES"""
+    try:
+        return instrument(psycopg2.connect(**config.DATABASES[db_key]))
+    except psycopg2.OperationalError as e:
+        print(f"🚨 Connection failed to {db_key.upper()}: {str(e)}")
+        raise
+
+
+def _select_column(adapter, col):
+    cast = adapter.casts.get(col, 'text')
+    if cast == 'numeric':
+        # Normalized amounts arrive as integer minor units
+        return sql.SQL("v.{}::bigint::numeric / {}").format(sql.Identifier(col), sql.Literal(MINOR_UNITS))
+    return sql.SQL("v.{}::{}").format(sql.Identifier(col), sql.SQL(cast))
+
+
+def _merge_statement(adapter, source):
+    """INSERT ... SELECT from `source` (aliased v) that skips existing keys
+
+    For an adapter with a `reference` the statement returns one row
+    (inserted, orphaned): rows whose parent is missing are left out and
+    counted instead of being mistaken for existing keys.
+    """
+    targets = list(adapter.columns)
+    select_cols = [_select_column(adapter, col) for col in targets]
+    for col, expr in adapter.defaults.items():
+        targets.append(col)
+        select_cols.append(sql.SQL(expr))
+
+    conditions = []
+    if adapter.reference:
+        ref_table, ref_col = adapter.reference
+        # Rows pointing at unknown parents would abort the whole batch on the FK
+        has_parent = sql.SQL("EXISTS (SELECT 1 FROM {} r WHERE r.{} = v.{})").format(
+            sql.Identifier(ref_table), sql.Identifier(ref_col), sql.Identifier(ref_col))
+        conditions.append(has_parent)
+    where = sql.SQL("WHERE ") + sql.SQL(' AND ').join(conditions) if conditions else sql.SQL("")
+
+    insert = sql.SQL("""
+        INSERT INTO {table} ({targets})
+        SELECT {select_cols} FROM {source} {where}
+        ON CONFLICT DO NOTHING
+    """).format(
+        table=sql.Identifier(adapter.table),
+        targets=sql.SQL(', ').join(sql.Identifier(col) for col in targets),
+        select_cols=sql.SQL(', ').join(select_cols),
+        source=sql.Identifier('v') if adapter.reference else source,
+        where=where)
+    if not adapter.reference:
+        return insert
+    return sql.SQL("""
+        WITH v AS (SELECT * FROM {source}),
+             inserted AS ({insert} RETURNING 1)
+        SELECT (SELECT count(*) FROM inserted), (SELECT count(*) FROM v WHERE NOT {has_parent})
+    """).format(source=source, insert=insert, has_parent=has_parent)
+
+
+class _ValuesWriter:
+    """Writes a batch as one multi-row VALUES statement"""
+
+    def __init__(self, adapter, conn):
+        self.conn = conn
+        values = sql.SQL("(VALUES %s) AS v ({})").format(
+            sql.SQL(', ').join(sql.Identifier(col) for col in adapter.columns))
+        self.statement = _merge_statement(adapter, values).as_string(conn)
+        self.counts_orphans = bool(adapter.reference)
+
+    def write(self, rows):
+        """Return (inserted, orphaned) for the batch"""
+        if not rows:
+            return 0, 0
+        with self.conn.cursor() as cur:
+            execute_values(cur, self.statement, rows, page_size=max(len(rows), 1))
+            return _merge_counts(cur, self.counts_orphans)
+
+
+class _CopyWriter:
+    """Streams a batch into a temp staging table with COPY, then merges it"""
+
+    def __init__(self, adapter, conn):
+        self.conn = conn
+        columns = sql.SQL(', ').join(sql.Identifier(col) for col in adapter.columns)
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("CREATE TEMP TABLE IF NOT EXISTS {} ({}) ON COMMIT DELETE ROWS").format(
+                sql.Identifier(f"staging_{adapter.name}"),
+                sql.SQL(', ').join(sql.SQL("{} text").format(sql.Identifier(col)) for col in adapter.columns)))
+        conn.commit()
+        self.copy = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(f"staging_{adapter.name}"), columns).as_string(conn)
+        self.statement = _merge_statement(
+            adapter, sql.SQL("{} AS v").format(sql.Identifier(f"staging_{adapter.name}"))).as_string(conn)
+        self.counts_orphans = bool(adapter.reference)
+
+    def write(self, rows):
+        """Return (inserted, orphaned) for the batch"""
+        if not rows:
+            return 0, 0
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        buf.seek(0)
+        with self.conn.cursor() as cur:
+            cur.copy_expert(self.copy, buf)
+            cur.execute(self.statement)
+            return _merge_counts(cur, self.counts_orphans)
+
+
+def _merge_counts(cur, counts_orphans):
+    """(inserted, orphaned) of the merge statement just executed on `cur`"""
+    if counts_orphans:
+        inserted, orphaned = cur.fetchone()
+        return inserted, orphaned
+    return cur.rowcount, 0
+
+
+WRITERS = {'values': _ValuesWriter, 'copy': _CopyWriter}
+
+
+def file_fingerprint(file_path):
+    """sha256 of the first MiB, the key checkpoints are looked up by
+
+    Exports can share their first MiB, so a checkpoint found by fingerprint
+    is only trusted once prefix_digest() confirms the bytes before its offset.
+    """
+    with open(file_path, 'rb') as f:
+        return hashlib.sha256(f.read(FINGERPRINT_BYTES)).hexdigest()
+
+
+def read_header(file_path):
+    """Return (CSV header, byte offset of the first data row)"""
+    with open(file_path, 'rb') as f:
+        line = f.readline()
+        return next(csv.reader([line.decode('utf-8-sig')], delimiter=';'), []), f.tell()
+
+
+def read_chunks(file_path, batch_size=DEFAULT_BATCH_SIZE, start_offset=None, end_offset=None):
+    """Stream the CSV as (rows, end_offset, rows_in_chunk), holding at most one chunk in memory
+
+    `end_offset` is the byte position just after the chunk's last row, so a
+    reader can seek straight to it to continue with the next chunk. When an
+    `end_offset` argument is given, only rows starting before it are read.
+    """
+    header, data_offset = read_header(file_path)
+    with open(file_path, 'rb') as f:
+        f.seek(max(start_offset or 0, data_offset))
+        reader = csv.reader((raw.decode('utf-8') for raw in iter(f.readline, b'')), delimiter=';')
+        chunk = []
+        # csv.reader pulls lines lazily, so tell() is always the end of the last row read
+        while end_offset is None or f.tell() < end_offset:
+            values = next(reader, None)
+            if values is None:
+                break
+            if not values:
+                continue
+            chunk.append(dict(zip(header, values)))
+            if len(chunk) >= batch_size:
+                yield chunk, f.tell(), len(chunk)
+                chunk = []
+        if chunk:
+            yield chunk, f.tell(), len(chunk)
+
+
+def split_ranges(file_path, parts):
+    """Split the data rows into up to `parts` (start, end) byte ranges cut at line starts
+
+    Assumes no quoted field spans lines, which holds for Accurate and gateway exports.
+    """
+    _, data_offset = read_header(file_path)
+    size = os.path.getsize(file_path)
+    bounds = [data_offset]
+    with open(file_path, 'rb') as f:
+        for i in range(1, parts):
+            f.seek(max(data_offset + (size - data_offset) * i // parts - 1, data_offset))
+            f.readline()
+            if f.tell() > bounds[-1] and f.tell() < size:
+                bounds.append(f.tell())
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _ensure_checkpoint_table(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+                source_name VARCHAR(50) NOT NULL,
+                fingerprint CHAR(64) NOT NULL,
+                file_name TEXT,
+                byte_offset BIGINT NOT NULL,
+                row_number BIGINT NOT NULL,
+                updated_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (source_name, fingerprint)
+            )
+        """)
+        cur.execute("ALTER TABLE ingest_checkpoint ADD COLUMN IF NOT EXISTS prefix_sha256 CHAR(64)")
+    conn.commit()
+
+
+def load_checkpoint(conn, adapter, fingerprint):
+    """Return (byte_offset, row_number, prefix_sha256) of the last committed chunk, or None"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT byte_offset, row_number, prefix_sha256 FROM ingest_checkpoint
+            WHERE source_name = %s AND fingerprint = %s
+        """, (adapter.name, fingerprint))
+        return cur.fetchone()
+
+
+def _save_checkpoint(cur, run, byte_offset, row_number):
+    cur.execute("""
+        INSERT INTO ingest_checkpoint
+            (source_name, fingerprint, file_name, byte_offset, row_number, prefix_sha256, updated_at)
+        VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        ON CONFLICT (source_name, fingerprint) DO UPDATE
+        SET file_name = EXCLUDED.file_name, byte_offset = EXCLUDED.byte_offset,
+            row_number = EXCLUDED.row_number, prefix_sha256 = EXCLUDED.prefix_sha256, updated_at = NOW()
+    """, (run.adapter.name, run.fingerprint, os.path.basename(run.file_path), byte_offset, row_number,
+          prefix_digest(run.blocks, byte_offset)))
+
+
+def _write_batch(writer, rows, stats, checkpoint=None):
+    """Write and commit one batch; fall back to single rows to isolate a bad one
+
+    `checkpoint(cur)`, passed by ingest_file(), runs in the same transaction
+    as the batch. The pipeline's writers pass none: pipeline._Progress saves
+    the position in its own transaction after the batch has committed. In
+    both cases the saved position never runs ahead of the committed rows.
+    """
+    conn = writer.conn
+    try:
+        inserted, orphaned = writer.write(rows)
+        # Orphans are loaded by a later run, so the position must not move past them
+        if checkpoint and not orphaned:
+            with conn.cursor() as cur:
+                checkpoint(cur)
+        conn.commit()
+        stats['inserted'] += inserted
+        stats['orphaned'] += orphaned
+        stats['skipped'] += len(rows) - inserted - orphaned
+        return
+    except Exception as e:
+        conn.rollback()
+        if len(rows) == 1 and not checkpoint:
+            print(f"🔴 Error inserting row {rows[0]}: {str(e).strip()}")
+            stats['errors'] += 1
+            return
+        print(f"🟡 Batch of {len(rows)} rows failed ({str(e).strip()}); retrying row by row")
+
+    orphaned = stats['orphaned']
+    for row in rows:
+        _write_batch(writer, [row], stats)
+    if checkpoint and stats['orphaned'] == orphaned:
+        with conn.cursor() as cur:
+            checkpoint(cur)
+        conn.commit()
+
+
+class IngestRun:
+    """State of one file load shared by ingest_file() and the asyncio pipeline"""
+
+    def __init__(self, adapter, file_path, byte_range=None):
+        self.adapter = adapter
+        self.file_path = file_path
+        self.byte_range = byte_range
+        self.stats = {'read': 0, 'filtered': 0, 'rejected': 0, 'inserted': 0, 'skipped': 0, 'orphaned': 0,
+                      'errors': 0, 'resumed_at_row': 0, 'unchanged': False}
+        self.start_offset, self.end_offset = byte_range or (0, None)
+        self.row_number = 0
+        self.fingerprint = None
+        self.file_sha256 = None
+        self.blocks = None
+        self.normalizer = None
+        self.index = None
+        self.key_of = adapter.key_getter()
+        self.metrics = Metrics(f"ingest_{adapter.name}",
+                               {'range': f"{byte_range[0]}-{byte_range[1]}"} if byte_range else None)
+
+    def chunks(self, batch_size):
+        """Yield (raw rows, chunk end offset, row number after the chunk)"""
+        reader = read_chunks(self.file_path, batch_size, self.start_offset, self.end_offset)
+        position = self.start_offset
+        while True:
+            with self.metrics.stage('read'):
+                item = next(reader, None)
+            if item is None:
+                return
+            chunk, chunk_end, n_rows = item
+            self.metrics.add('read', rows_out=n_rows, bytes=chunk_end - position)
+            position = chunk_end
+            self.stats['read'] += n_rows
+            self.row_number += n_rows
+            yield chunk, chunk_end, self.row_number
+
+    def checkpoint_for(self, chunk_end, row_number):
+        """Return the callable that saves this chunk's position, or None without checkpoints
+
+        Once a batch had orphaned rows the position stays before it, so
+        resuming reaches those rows again.
+        """
+        if not self.fingerprint or self.stats['orphaned']:
+            return None
+
+        def checkpoint(cur):
+            _save_checkpoint(cur, self, chunk_end, row_number)
+        return checkpoint
+
+
+def start_run(adapter, file_path, conn, resume=True, byte_range=None, key_index=True):
+    """Check the header, consult manifest and checkpoints, and prepare a run
+
+    Returns (run, has_work). has_work is False when there is nothing to load;
+    the reason is printed.
+    """
+    run = IngestRun(adapter, file_path, byte_range)
+    header, _ = read_header(file_path)
+    print(f"Processing {adapter.name} CSV: {file_path}")
+    print(f"CSV headers: {header}")
+    missing = [col for col in adapter.csv_columns() if col not in header]
+    if missing:
+        print(f"🔴 Missing column(s) {missing} in {file_path}")
+        run.stats['errors'] += 1
+        return run, False
+
+    if byte_range is None:
+        _ensure_checkpoint_table(conn)
+        ensure_manifest_tables(conn)
+        imported_at = imported_unchanged(conn, adapter.name, file_path) if resume else None
+        if imported_at:
+            print(f"⏭️ {os.path.basename(file_path)} is unchanged since its import on {imported_at:%Y-%m-%d %H:%M}; "
+                  f"nothing to do")
+            run.stats['unchanged'] = True
+            return run, False
+        run.fingerprint = file_fingerprint(file_path)
+        with run.metrics.stage('hash'):
+            run.file_sha256, run.blocks = hash_blocks(file_path)
+        run.metrics.add('hash', bytes=os.path.getsize(file_path))
+        if resume:
+            imported_at = already_imported(conn, adapter.name, run.file_sha256)
+            if imported_at:
+                print(f"⏭️ Identical file already imported on {imported_at:%Y-%m-%d %H:%M}; nothing to do")
+                note_reupload(conn, adapter.name, file_path, run.file_sha256)
+                run.stats['unchanged'] = True
+                return run, False
+            matched = matched_blocks(conn, adapter.name, run.blocks)
+            if matched:
+                run.start_offset = run.blocks[matched - 1][1]
+                run.row_number = sum(block[3] for block in run.blocks[:matched]) - 1  # minus the header line
+                print(f"⏩ First {matched} block(s) match an earlier import; loading from row {run.row_number}")
+            saved = load_checkpoint(conn, adapter, run.fingerprint)
+            if saved and run.start_offset < saved[0] <= os.path.getsize(file_path):
+                if saved[2] == prefix_digest(run.blocks, saved[0]):
+                    run.start_offset, run.row_number = saved[:2]
+                    print(f"⏩ Resuming {adapter.name} at row {run.row_number} (byte {run.start_offset})")
+                else:
+                    print(f"🟡 Checkpoint at byte {saved[0]} belongs to a different {adapter.name} file; not resuming")
+            run.stats['resumed_at_row'] = run.row_number
+
+    rejected_path = os.path.splitext(file_path)[0] + (
+        f".rejected.{run.start_offset}.csv" if byte_range else ".rejected.csv")
+    # Ranges never resume, so each starts its own file afresh
+    if (byte_range or not run.start_offset) and os.path.exists(rejected_path):
+        os.remove(rejected_path)
+    run.normalizer = Normalizer(adapter, rejected_path)
+    if key_index and byte_range is None:
+        with run.metrics.stage('key_index'):
+            run.index = KeyIndex.load(conn, adapter)
+        run.metrics.add('key_index', rows_out=len(run.index))
+        print(f"Loaded {len(run.index)} existing {adapter.table} keys"
+              f"{' (hashed)' if run.index.approximate else ''}")
+    return run, True
+
+
+def prepare_chunk(run, chunk, conn):
+    """Filter, normalize and locally deduplicate one chunk into rows ready to write
+
+    Returns None when the file has to be abandoned (no usable date format).
+    """
+    adapter = run.adapter
+    with run.metrics.stage('normalize', rows_in=len(chunk)):
+        if adapter.row_filter:
+            kept = [row for row in chunk if adapter.keeps(row)]
+            run.stats['filtered'] += len(chunk) - len(kept)
+            chunk = kept
+        try:
+            batch, rejected = run.normalizer.normalize(chunk)
+        except NormalizationError as e:
+            print(f"🔴 {e} in {run.file_path}; stopped before this chunk was loaded")
+            run.stats['errors'] += 1
+            return None
+    run.metrics.add('normalize', rows_out=len(batch))
+    run.stats['rejected'] += rejected
+    if run.index is not None:
+        with run.metrics.stage('dedup', rows_in=len(batch)):
+            batch, known = run.index.split_new(batch, run.key_of, conn)
+            run.index.add(run.key_of(row) for row in batch)
+        run.metrics.add('dedup', rows_out=len(batch))
+        run.stats['skipped'] += known
+    return batch
+
+
+def write_chunk(run, writer, batch, stats, checkpoint=None):
+    """_write_batch() timed as the run's write stage; `stats` may be a writer's own counters"""
+    inserted = stats['inserted']
+    with run.metrics.stage('write', rows_in=len(batch)):
+        _write_batch(writer, batch, stats, checkpoint)
+    run.metrics.add('write', rows_out=stats['inserted'] - inserted)
+
+
+def finish_run(run, conn, **metrics_extra):
+    """Record a clean whole-file load in the manifest, emit the run's metrics and print the report
+
+    A load that left orphaned rows is not recorded, so uploading the file
+    again once their students exist loads them instead of being a no-op.
+    """
+    if run.fingerprint and not run.stats['errors'] and not run.stats['orphaned']:
+        record_import(conn, run.adapter.name, run.file_path, run.file_sha256, run.blocks)
+    run.metrics.emit(file=run.file_path, stats=run.stats, **metrics_extra)
+    _show_stats(run.adapter, run.stats)
+    return run.stats
+
+
+def ingest_file(adapter, file_path, conn, batch_size=DEFAULT_BATCH_SIZE, method='values', resume=True,
+                byte_range=None, key_index=True):
+    """Stream a semicolon-delimited CSV through `adapter`, committing once per batch
+
+    After every committed batch the byte offset and row number are saved in
+    ingest_checkpoint, keyed by the file fingerprint. With `resume` a rerun on
+    the same file seeks past the rows that were already committed, provided
+    the file's blocks up to the saved offset are unchanged.
+
+    `byte_range` restricts the load to one (start, end) range from
+    split_ranges(). Ranges are loaded without checkpoints; rerunning one is
+    still safe because existing keys are skipped.
+
+    Every chunk goes through normalize.Normalizer first: dates and amounts
+    are parsed column-wise and rows that fail are written to
+    `<file>.rejected.csv` instead of reaching the database.
+
+    With `key_index` the table's existing keys are loaded once into a
+    KeyIndex and rows are deduplicated locally instead of being sent to the
+    database. Range workers skip it; the unique constraint covers them.
+
+    Whole-file loads are recorded in import_manifest with a hash per file and
+    per block. A re-upload with the same name, size and mtime returns without
+    reading the file; an identical file under another name or mtime costs
+    one hashing pass. A file that only has rows appended is loaded from its
+    first new block. `resume=False`
+    ignores both the manifest and the checkpoints.
+    """
+    run, has_work = start_run(adapter, file_path, conn, resume, byte_range, key_index)
+    if not has_work:
+        return run.stats
+
+    writer = WRITERS[method](adapter, conn)
+    for chunk, chunk_end, row_number in run.chunks(batch_size):
+        batch = prepare_chunk(run, chunk, conn)
+        if batch is None:
+            return run.stats
+        write_chunk(run, writer, batch, run.stats, run.checkpoint_for(chunk_end, row_number))
+
+    return finish_run(run, conn)
+
+
+def _show_stats(adapter, stats):
+    """Display ingestion statistics"""
+    print(f"\n📊 {adapter.name} import report:")
+    if stats['resumed_at_row']:
+        print(f"• Resumed after row: {stats['resumed_at_row']}")
+    print(f"• Rows read: {stats['read']}")
+    print(f"• Filtered out: {stats['filtered']}")
+    print(f"• Rejected (see .rejected.csv): {stats['rejected']}")
+    print(f"• Inserted: {stats['inserted']}")
+    print(f"• Already present / skipped: {stats['skipped']}")
+    if stats['orphaned']:
+        print(f"• Waiting for their student (upload again after the students file): {stats['orphaned']}")
+    print(f"• Errors: {stats['errors']}")
@@ -0,0 +1,283 @@
+import argparse
+import json
+import select
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+import config
+from app import FETCH_ITERSIZE, PaymentIntegrator
+from config import DATABASES
+from metrics import instrument
+from sources import SOURCE_ID_COLUMNS
+
+# Seconds between scheduled runs and the localhost port of the control socket;
+# INTEGRATOR_INTERVAL / INTEGRATOR_PORT in config.py override them
+DEFAULT_INTERVAL = getattr(config, 'INTEGRATOR_INTERVAL', 300)
+CONTROL_PORT = getattr(config, 'INTEGRATOR_PORT', 8765)
+
+# How long a `run` request waits for its cycle before answering
+RUN_TIMEOUT = 600
+
+# With --listen, a cycle starts once notifications have been quiet for
+# NOTIFY_DEBOUNCE seconds, or NOTIFY_MAX_DELAY seconds after the first one
+NOTIFY_CHANNEL = 'gateway_payments'
+NOTIFY_DEBOUNCE = 1.0
+NOTIFY_MAX_DELAY = 5.0
+LISTEN_RETRY = 10
+
+
+def ensure_notify_trigger(conn, source):
+    """Install a statement-level trigger that notifies NOTIFY_CHANNEL on inserts into payments
+
+    Statement-level, so a bulk COPY of a whole export sends one notification.
+    """
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE OR REPLACE FUNCTION notify_gateway_payment() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('{NOTIFY_CHANNEL}', TG_ARGV[0]);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        cur.execute("DROP TRIGGER IF EXISTS payments_notify ON payments")
+        cur.execute("""
+            CREATE TRIGGER payments_notify AFTER INSERT ON payments
+            FOR EACH STATEMENT EXECUTE PROCEDURE notify_gateway_payment(%s)
+        """, (source,))
+    conn.commit()
+
+
+class IntegratorDaemon:
+    """Runs PaymentIntegrator on a schedule inside one long-lived process
+
+    Keeps one connection pool per database and one PaymentIntegrator whose
+    known refs, watermarks and recompute mark stay warm between cycles. A
+    cycle runs every `interval` seconds, or sooner when a `run` command
+    arrives on the control socket. With `listen`, inserts into the gateway
+    payments tables also start a cycle within seconds, and the interval
+    becomes the fallback for missed notifications.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, port=CONTROL_PORT, incremental=True, itersize=FETCH_ITERSIZE,
+                 listen=False):
+        self.interval = interval
+        self.listen = listen
+        self.notifications = 0
+        self.last_notification = None
+        self.port = port
+        self.incremental = incremental
+        self.itersize = itersize
+        self.pools = {db_key: ThreadedConnectionPool(1, 2, **DATABASES[db_key])
+                      for db_key in ('accurate', 'xendit', 'paperid')}
+        self.integrator = None
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.cycle_done = threading.Condition()
+        self.cycles_started = 0
+        self.cycles_finished = 0
+        self.last = {}
+        self.next_run = None
+
+    def _borrow(self):
+        return {db_key: instrument(pool.getconn()) for db_key, pool in self.pools.items()}
+
+    def _give_back(self, connections):
+        for db_key, conn in connections.items():
+            # A connection that broke during the cycle is dropped; the pool opens a new one
+            self.pools[db_key].putconn(conn, close=bool(conn.closed))
+
+    def run_cycle(self):
+        """Run one integration over pooled connections and record its outcome"""
+        with self.cycle_done:
+            self.cycles_started += 1
+        started = time.perf_counter()
+        connections = self._borrow()
+        try:
+            if self.integrator is None:
+                self.integrator = PaymentIntegrator(incremental=self.incremental, itersize=self.itersize,
+                                                    connections=connections)
+            else:
+                self.integrator.connections = connections
+            integrated = self.integrator.integrate_payments()
+            ok = self.integrator.stats['errors'] == 0
+            if not ok:
+                # Watermarks and known refs may be ahead of what was committed
+                self.integrator.load_state()
+            result = {'ok': ok, 'integrated': integrated, 'stats': dict(self.integrator.stats)}
+        except Exception as e:
+            print(f"🔴 Integration cycle failed: {str(e)}")
+            self.integrator = None
+            result = {'ok': False, 'integrated': False, 'error': str(e)}
+        finally:
+            self._give_back(connections)
+        result.update({'finished_at': datetime.now().isoformat(timespec='seconds'),
+                       'seconds': round(time.perf_counter() - started, 3)})
+        with self.cycle_done:
+            self.cycles_finished += 1
+            self.last = result
+            self.cycle_done.notify_all()
+        return result
+
+    def request_run(self, timeout=RUN_TIMEOUT):
+        """Wake the loop and wait for a cycle that started after this request"""
+        with self.cycle_done:
+            target = self.cycles_started + 1
+            self.wake.set()
+            if not self.cycle_done.wait_for(lambda: self.cycles_finished >= target or self.stopping.is_set(),
+                                            timeout):
+                return {'ok': False, 'error': 'timed out waiting for the integration cycle'}
+            return self.last
+
+    def status(self):
+        return {
+            'cycles': self.cycles_finished,
+            'running': self.cycles_started > self.cycles_finished,
+            'interval': self.interval,
+            'incremental': self.incremental,
+            'listening': self.listen,
+            'notifications': self.notifications,
+            'last_notification': self.last_notification,
+            'next_run': self.next_run,
+            'watermarks': dict(self.integrator.watermarks) if self.integrator else {},
+            'last': self.last,
+        }
+
+    def stop(self):
+        self.stopping.set()
+        self.wake.set()
+        with self.cycle_done:
+            self.cycle_done.notify_all()
+
+    def _listen_connections(self, connections):
+        for source in SOURCE_ID_COLUMNS:
+            conn = psycopg2.connect(**DATABASES[source])
+            ensure_notify_trigger(conn, source)
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            connections[source] = conn
+
+    def _listen_loop(self):
+        """Turn gateway insert notifications into debounced wake-ups of the cycle loop"""
+        connections = {}
+        first = last = None
+        while not self.stopping.is_set():
+            try:
+                if not connections:
+                    self._listen_connections(connections)
+                    print(f"🟢 Listening for {NOTIFY_CHANNEL} on {', '.join(connections)}")
+                    self.wake.set()     # catch up on anything inserted while not listening
+                ready, _, _ = select.select(list(connections.values()), [], [], NOTIFY_DEBOUNCE / 4)
+                now = time.monotonic()
+                for conn in ready:
+                    conn.poll()
+                    while conn.notifies:
+                        conn.notifies.pop()
+                        self.notifications += 1
+                        self.last_notification = datetime.now().isoformat(timespec='seconds')
+                        first, last = first or now, now
+                if first and (now - last >= NOTIFY_DEBOUNCE or now - first >= NOTIFY_MAX_DELAY):
+                    first = last = None
+                    self.wake.set()
+            except (psycopg2.Error, OSError) as e:
+                print(f"🟡 Listener lost its connection, polling until it is back: {str(e).strip()}")
+                for conn in connections.values():
+                    if not conn.closed:
+                        conn.close()
+                connections = {}
+                self.stopping.wait(LISTEN_RETRY)
+        for conn in connections.values():
+            conn.close()
+
+    def serve_forever(self):
+        """Run cycles until stopped, answering the control socket on a background thread"""
+        server = _ControlServer(('127.0.0.1', self.port), _ControlHandler)
+        server.daemon_ref = self
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        if self.listen:
+            threading.Thread(target=self._listen_loop, daemon=True).start()
+        print(f"🟢 Integrator daemon listening on 127.0.0.1:{self.port}, every {self.interval}s")
+        try:
+            while not self.stopping.is_set():
+                # Cleared before the cycle, so a wake-up that arrives while it runs starts the next one
+                self.wake.clear()
+                result = self.run_cycle()
+                print(f"⏱️ Cycle {self.cycles_finished} done in {result['seconds']}s")
+                self.next_run = datetime.fromtimestamp(time.time() + self.interval).isoformat(timespec='seconds')
+                self.wake.wait(self.interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            server.server_close()
+            for pool in self.pools.values():
+                pool.closeall()
+            print("🛑 Integrator daemon stopped")
+
+
+class _ControlServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    """One command per line (run, status, stop), answered with one JSON line"""
+
+    def handle(self):
+        daemon = self.server.daemon_ref
+        command = self.rfile.readline().decode('utf-8').strip().lower()
+        if command == 'run':
+            reply = daemon.request_run()
+        elif command == 'status':
+            reply = daemon.status()
+        elif command == 'stop':
+            daemon.stop()
+            reply = {'ok': True, 'stopping': True}
+        else:
+            reply = {'ok': False, 'error': f"unknown command {command!r}"}
+        self.wfile.write((json.dumps(reply, default=str) + '\n').encode('utf-8'))
+
+
+def send_command(command, port=CONTROL_PORT, timeout=RUN_TIMEOUT):
+    """Send one command to a running daemon and return its JSON reply
+
+    Raises ConnectionRefusedError when no daemon is listening.
+    """
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+        sock.sendall((command + '\n').encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as reply:
+            return json.loads(reply.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the payment integrator as a long-lived daemon, or control one.")
+    parser.add_argument('command', nargs='?', default='serve', choices=['serve', 'run', 'status', 'stop'],
+                        help='serve starts the daemon; run, status and stop talk to a running one')
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL,
+                        help=f'Seconds between scheduled runs (default {DEFAULT_INTERVAL})')
+    parser.add_argument('--port', type=int, default=CONTROL_PORT,
+                        help=f'Localhost port of the control socket (default {CONTROL_PORT})')
+    parser.add_argument('--full', action='store_true',
+                        help='Compare against all known refs instead of fetching past the watermarks')
+    parser.add_argument('--itersize', type=int, default=FETCH_ITERSIZE,
+                        help=f'Rows fetched per server-side cursor round trip (default {FETCH_ITERSIZE})')
+    parser.add_argument('--listen', action='store_true',
+                        help='Install insert triggers on the gateway payments tables and integrate on NOTIFY')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        IntegratorDaemon(interval=args.interval, port=args.port, incremental=not args.full,
+                         itersize=args.itersize, listen=args.listen).serve_forever()
+    else:
+        try:
+            print(json.dumps(send_command(args.command, args.port), indent=2, default=str))
+        except ConnectionRefusedError:
+            print(f"🔴 No integrator daemon listening on 127.0.0.1:{args.port}")
+            raise SystemExit(1)
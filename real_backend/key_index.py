@@ -0,0 +1,125 @@
+import hashlib
+
+import numpy as np
+from psycopg2 import sql
+
+try:
+    import config
+except ImportError:     # the tests import this module without database settings
+    config = None
+
+# Above this many keys the index keeps 8-byte hashes in a sorted array instead of a set
+MAX_EXACT_KEYS = getattr(config, 'KEY_INDEX_MAX_EXACT', 1_000_000)
+FETCH_SIZE = 50000
+
+
+def _key_text(key):
+    return key if isinstance(key, str) else '\x1f'.join('' if k is None else str(k) for k in key)
+
+
+def _key_hash(key):
+    return int.from_bytes(hashlib.blake2b(_key_text(key).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class KeyIndex:
+    """In-memory index of the keys already present in one table
+
+    Small tables are held as an exact set. Once the index passes
+    `max_exact_keys` it switches to a sorted uint64 array of key hashes
+    (8 bytes per key). A hash hit only means "probably present", so those
+    keys are confirmed with one `= ANY(...)` query per batch. The table's
+    unique constraint still decides in the end, since inserts use
+    ON CONFLICT DO NOTHING.
+    """
+
+    def __init__(self, adapter, max_exact_keys=MAX_EXACT_KEYS):
+        self.adapter = adapter
+        self.max_exact_keys = max_exact_keys
+        self.exact = set()
+        self.hashes = None          # sorted np.uint64 array once exact mode is left
+        self.pending = []           # hashes added since the last merge into `hashes`
+
+    def __len__(self):
+        if self.hashes is None:
+            return len(self.exact)
+        return len(self.hashes) + len(self.pending)
+
+    @property
+    def approximate(self):
+        return self.hashes is not None
+
+    @classmethod
+    def load(cls, conn, adapter, max_exact_keys=MAX_EXACT_KEYS):
+        """Stream every existing key of the adapter's table through a server-side cursor"""
+        index = cls(adapter, max_exact_keys)
+        query = sql.SQL("SELECT {} FROM {}").format(
+            sql.SQL(', ').join(sql.Identifier(col) for col in adapter.key_columns),
+            sql.Identifier(adapter.table))
+        with conn.cursor(name=f"key_index_{adapter.name}") as cur:
+            cur.itersize = FETCH_SIZE
+            cur.execute(query)
+            while True:
+                rows = cur.fetchmany(FETCH_SIZE)
+                if not rows:
+                    break
+                index.add(row[0] if len(row) == 1 else row for row in rows)
+        conn.commit()
+        return index
+
+    def add(self, keys):
+        if self.hashes is None:
+            self.exact.update(keys)
+            if len(self.exact) > self.max_exact_keys:
+                self.hashes = np.unique(np.fromiter((_key_hash(k) for k in self.exact), dtype=np.uint64))
+                self.exact = set()
+            return
+        self.pending.extend(_key_hash(k) for k in keys)
+        if len(self.pending) >= FETCH_SIZE:
+            self._merge_pending()
+
+    def _merge_pending(self):
+        if self.pending:
+            self.hashes = np.union1d(self.hashes, np.array(self.pending, dtype=np.uint64))
+            self.pending = []
+
+    def _maybe_present(self, keys):
+        """Boolean array: True where the key is (probably, in hash mode) present"""
+        if self.hashes is None:
+            return np.fromiter((k in self.exact for k in keys), dtype=bool, count=len(keys))
+        self._merge_pending()
+        wanted = np.fromiter((_key_hash(k) for k in keys), dtype=np.uint64, count=len(keys))
+        pos = np.searchsorted(self.hashes, wanted)
+        pos[pos == len(self.hashes)] = 0
+        return self.hashes[pos] == wanted if len(self.hashes) else np.zeros(len(keys), dtype=bool)
+
+    def _confirm(self, conn, keys):
+        """Return the subset of `keys` that really exists in the table"""
+        cols = self.adapter.key_columns
+        if len(cols) == 1:
+            query = sql.SQL("SELECT {col} FROM {table} WHERE {col} = ANY(%s)").format(
+                col=sql.Identifier(cols[0]), table=sql.Identifier(self.adapter.table))
+            with conn.cursor() as cur:
+                cur.execute(query, (list(keys),))
+                return {row[0] for row in cur.fetchall()}
+        query = sql.SQL("SELECT {cols} FROM {table} WHERE ({cols}) IN %s").format(
+            cols=sql.SQL(', ').join(sql.Identifier(c) for c in cols), table=sql.Identifier(self.adapter.table))
+        with conn.cursor() as cur:
+            cur.execute(query, (tuple(keys),))
+            return {tuple(str(v) for v in row) for row in cur.fetchall()}
+
+    def split_new(self, rows, key_of, conn):
+        """Split rows into (new rows, number of rows already present or repeated in the batch)"""
+        keys = [key_of(row) for row in rows]
+        present = self._maybe_present(keys) if keys else np.zeros(0, dtype=bool)
+        if self.approximate and present.any():
+            maybe = [k for k, p in zip(keys, present) if p]
+            confirmed = self._confirm(conn, maybe)
+            present = np.fromiter((p and k in confirmed for k, p in zip(keys, present)),
+                                  dtype=bool, count=len(keys))
+        new_rows, seen = [], set()
+        for row, key, known in zip(rows, keys, present):
+            if known or key in seen:
+                continue
+            seen.add(key)
+            new_rows.append(row)
+        return new_rows, len(rows) - len(new_rows)
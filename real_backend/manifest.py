@@ -0,0 +1,157 @@
+import hashlib
+import os
+
+# Files are hashed in blocks of about this size, cut at the next line end
+BLOCK_BYTES = 4 << 20
+
+
+def hash_blocks(file_path, block_bytes=BLOCK_BYTES):
+    """Return (file sha256, [(byte_start, byte_end, block sha256, line count), ...]) in one pass
+
+    Blocks end on a line boundary, so a file with rows appended shares every
+    complete block of the original and only differs from the old last block on.
+    """
+    file_hash = hashlib.sha256()
+    blocks = []
+    with open(file_path, 'rb') as f:
+        start = 0
+        while True:
+            data = f.read(block_bytes)
+            if not data:
+                break
+            if not data.endswith(b'\n'):
+                data += f.readline()
+            file_hash.update(data)
+            blocks.append((start, start + len(data), hashlib.sha256(data).hexdigest(), data.count(b'\n')))
+            start += len(data)
+    return file_hash.hexdigest(), blocks
+
+
+def prefix_digest(blocks, byte_offset):
+    """sha256 over the hashes of the `blocks` that start before `byte_offset`
+
+    Two files with the same digest for an offset have identical bytes up to
+    it, and up to the end of the block it falls in.
+    """
+    digest = hashlib.sha256()
+    for start, _, block_hash, _ in blocks:
+        if start >= byte_offset:
+            break
+        digest.update(block_hash.encode())
+    return digest.hexdigest()
+
+
+def ensure_manifest_tables(conn):
+    with conn.cursor() as cur:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS import_manifest (
+                source_name VARCHAR(50) NOT NULL,
+                file_sha256 CHAR(64) NOT NULL,
+                file_name TEXT,
+                size_bytes BIGINT NOT NULL,
+                block_bytes INTEGER NOT NULL,
+                imported_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (source_name, file_sha256)
+            );
+            CREATE TABLE IF NOT EXISTS import_manifest_block (
+                source_name VARCHAR(50) NOT NULL,
+                file_sha256 CHAR(64) NOT NULL,
+                block_no INTEGER NOT NULL,
+                byte_start BIGINT NOT NULL,
+                byte_end BIGINT NOT NULL,
+                block_sha256 CHAR(64) NOT NULL,
+                PRIMARY KEY (source_name, file_sha256, block_no),
+                FOREIGN KEY (source_name, file_sha256)
+                    REFERENCES import_manifest (source_name, file_sha256) ON DELETE CASCADE
+            );
+            CREATE INDEX IF NOT EXISTS import_manifest_block_first
+                ON import_manifest_block (source_name, block_sha256) WHERE block_no = 0;
+            ALTER TABLE import_manifest ADD COLUMN IF NOT EXISTS mtime_ns BIGINT;
+        """)
+    conn.commit()
+
+
+def imported_unchanged(conn, source_name, file_path):
+    """imported_at of an earlier import with this file's name, size and mtime, or None
+
+    Lets an untouched re-upload be skipped without reading the file.
+    """
+    stat = os.stat(file_path)
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT MAX(imported_at) FROM import_manifest
+            WHERE source_name = %s AND file_name = %s AND size_bytes = %s AND mtime_ns = %s
+        """, (source_name, os.path.basename(file_path), stat.st_size, stat.st_mtime_ns))
+        row = cur.fetchone()
+    conn.commit()
+    return row[0]
+
+
+def already_imported(conn, source_name, file_sha256):
+    with conn.cursor() as cur:
+        cur.execute("SELECT imported_at FROM import_manifest WHERE source_name = %s AND file_sha256 = %s",
+                    (source_name, file_sha256))
+        row = cur.fetchone()
+    conn.commit()
+    return row[0] if row else None
+
+
+def note_reupload(conn, source_name, file_path, file_sha256):
+    """Point an identical file's manifest entry at this copy's name and mtime for imported_unchanged()"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE import_manifest SET file_name = %s, mtime_ns = %s
+            WHERE source_name = %s AND file_sha256 = %s
+        """, (os.path.basename(file_path), os.stat(file_path).st_mtime_ns, source_name, file_sha256))
+    conn.commit()
+
+
+def matched_blocks(conn, source_name, blocks, block_bytes=BLOCK_BYTES):
+    """Number of leading `blocks` identical to a file already imported for this source
+
+    Only earlier files that start with the same first block are compared, and
+    the longest run of identical leading blocks wins.
+    """
+    if not blocks:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT b.file_sha256, array_agg(b.block_sha256 ORDER BY b.block_no)
+            FROM import_manifest_block b
+            JOIN import_manifest m USING (source_name, file_sha256)
+            WHERE b.source_name = %s AND m.block_bytes = %s
+              AND b.file_sha256 IN (SELECT file_sha256 FROM import_manifest_block
+                                    WHERE source_name = %s AND block_no = 0 AND block_sha256 = %s)
+            GROUP BY b.file_sha256
+        """, (source_name, block_bytes, source_name, blocks[0][2]))
+        candidates = cur.fetchall()
+    conn.commit()
+
+    best = 0
+    for _, hashes in candidates:
+        matched = 0
+        for (_, _, ours, _), theirs in zip(blocks, hashes):
+            if ours != theirs:
+                break
+            matched += 1
+        best = max(best, matched)
+    return best
+
+
+def record_import(conn, source_name, file_path, file_sha256, blocks, block_bytes=BLOCK_BYTES):
+    with conn.cursor() as cur:
+        stat = os.stat(file_path)
+        cur.execute("""
+            INSERT INTO import_manifest (source_name, file_sha256, file_name, size_bytes, block_bytes, mtime_ns)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (source_name, file_sha256) DO UPDATE
+            SET imported_at = NOW(), file_name = EXCLUDED.file_name, mtime_ns = EXCLUDED.mtime_ns
+        """, (source_name, file_sha256, os.path.basename(file_path), stat.st_size, block_bytes, stat.st_mtime_ns))
+        cur.execute("DELETE FROM import_manifest_block WHERE source_name = %s AND file_sha256 = %s",
+                    (source_name, file_sha256))
+        cur.executemany("""
+            INSERT INTO import_manifest_block
+                (source_name, file_sha256, block_no, byte_start, byte_end, block_sha256)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, [(source_name, file_sha256, n, start, end, h) for n, (start, end, h, _) in enumerate(blocks)])
+    conn.commit()
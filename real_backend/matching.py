@@ -0,0 +1,259 @@
+import argparse
+import io
+
+import numpy as np
+import pandas as pd
+
+# Invoice references are compared upper-cased with everything but letters and digits removed
+NORMALIZED_REF = "regexp_replace(upper({}), '[^0-9A-Z]', '', 'g')"
+
+NGRAM = 3
+# Grams shared by more candidate invoices than this say nothing about a match and are skipped
+MAX_POSTINGS = 1000
+MIN_SCORE = 0.4
+MAX_CANDIDATES = 3
+
+# Score = reference similarity, plus same student, plus how well the amount fits what is still open
+WEIGHTS = {'reference': 0.6, 'student': 0.25, 'amount': 0.15}
+
+
+def normalize_refs(refs):
+    """Vectorized form of NORMALIZED_REF for a Series of references"""
+    return refs.fillna('').astype(str).str.upper().str.replace(r'[^0-9A-Z]', '', regex=True)
+
+
+def ensure_match_schema(conn):
+    """Indexes the candidate lookup uses, and the table candidates are written to"""
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE INDEX IF NOT EXISTS piutang_tagihan_ref_norm_idx "
+                    f"ON piutang_tagihan (({NORMALIZED_REF.format('nomor_invoice')}))")
+        # Candidates are no longer looked up by open amount
+        cur.execute("DROP INDEX IF EXISTS piutang_tagihan_open_amount_idx")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS payment_match_candidates (
+                nomor_penerimaan VARCHAR(50) NOT NULL,
+                metode_pembayaran VARCHAR(50) NOT NULL,
+                payment_ref VARCHAR(50),
+                nomor_invoice VARCHAR(50) NOT NULL,
+                rank SMALLINT NOT NULL,
+                score NUMERIC(4,3) NOT NULL,
+                match_type VARCHAR(20) NOT NULL,
+                same_student BOOLEAN NOT NULL,
+                jumlah DECIMAL(15,2),
+                sisa_tagihan DECIMAL(15,2),
+                created_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (nomor_penerimaan, nomor_invoice)
+            )
+        """)
+    conn.commit()
+
+
+def query_frame(conn, query, params, columns):
+    """Run a SELECT through COPY and read the result into a DataFrame of strings"""
+    with conn.cursor() as cur:
+        select = cur.mogrify(query, params).decode('utf-8')
+        buf = io.StringIO()
+        cur.copy_expert(f"COPY ({select}) TO STDOUT WITH (FORMAT csv)", buf)
+    buf.seek(0)
+    return pd.read_csv(buf, header=None, names=columns, dtype=str, keep_default_na=False)
+
+
+def unmatched_payments(conn, payment_ids=None):
+    """Receipts whose nomor_invoice does not join to piutang_tagihan, optionally only `payment_ids`"""
+    query = """
+        SELECT pp.nomor_penerimaan, pp.metode_pembayaran, pp.nomor_invoice, pp.id_student, pp.jumlah
+        FROM penerimaan_penjualan pp
+        WHERE NOT EXISTS (SELECT 1 FROM piutang_tagihan pt WHERE pt.nomor_invoice = pp.nomor_invoice)
+    """
+    params = None
+    if payment_ids is not None:
+        query += " AND pp.nomor_penerimaan = ANY(%s)"
+        params = (list(payment_ids),)
+    return query_frame(conn, query, params,
+                        ['nomor_penerimaan', 'metode_pembayaran', 'nomor_invoice', 'id_student', 'jumlah'])
+
+
+def candidate_invoices(conn, payments):
+    """Open invoices sharing a normalized reference or a student with `payments`
+
+    Both branches of the OR are served by an index (the normalized reference
+    from ensure_match_schema() and piutang_tagihan_student_idx), so only a
+    small block of invoices is read. Amounts repeat across thousands of
+    invoices, so they are never used to look candidates up.
+    """
+    query = f"""
+        SELECT nomor_invoice, id_student, total - COALESCE(jumlah_pembayaran, 0) AS sisa
+        FROM piutang_tagihan
+        WHERE status IS DISTINCT FROM 'Lunas'
+          AND ({NORMALIZED_REF.format('nomor_invoice')} = ANY(%s)
+               OR id_student = ANY(%s))
+    """
+    refs = [ref for ref in payments['ref_norm'].unique() if ref]
+    students = [s for s in payments['id_student'].unique() if s]
+    return query_frame(conn, query, (refs, students), ['nomor_invoice', 'id_student', 'sisa'])
+
+
+def _ngrams(refs):
+    """(position in `refs`, gram) for every distinct NGRAM-gram of each normalized reference"""
+    if refs.empty:
+        return pd.DataFrame({'pos': pd.Series(dtype=np.int64), 'gram': pd.Series(dtype=str)})
+    positions = np.arange(len(refs))
+    parts = []
+    for start in range(max(refs.str.len().max() - NGRAM + 1, 0)):
+        grams = refs.str[start:start + NGRAM]
+        full = (grams.str.len() == NGRAM).to_numpy()
+        parts.append(pd.DataFrame({'pos': positions[full], 'gram': grams.to_numpy()[full]}))
+    if not parts:
+        return pd.DataFrame({'pos': pd.Series(dtype=np.int64), 'gram': pd.Series(dtype=str)})
+    return pd.concat(parts, ignore_index=True).drop_duplicates()
+
+
+def _reference_similarity(payments, invoices):
+    """(payment pos, invoice pos, similarity) from an n-gram inverted index of the invoices
+
+    Exact normalized matches score 1.0. Other pairs share at least one gram
+    and score the Dice coefficient of their gram sets; grams posted on more
+    than MAX_POSTINGS invoices are left out of the index.
+    """
+    exact = payments[['ref_norm']].reset_index(names='pay').merge(
+        invoices[['ref_norm']].reset_index(names='inv'), on='ref_norm')
+    exact = exact[exact['ref_norm'] != ''][['pay', 'inv']].assign(similarity=1.0)
+
+    invoice_grams = _ngrams(invoices['ref_norm'])
+    postings = invoice_grams.groupby('gram')['pos'].transform('size')
+    index = invoice_grams[postings <= MAX_POSTINGS].rename(columns={'pos': 'inv'})
+    payment_grams = _ngrams(payments['ref_norm']).rename(columns={'pos': 'pay'})
+    shared = payment_grams.merge(index, on='gram').groupby(['pay', 'inv']).size().rename('shared').reset_index()
+    inv_counts = np.bincount(invoice_grams['pos'], minlength=len(invoices))
+    pay_counts = np.bincount(payment_grams['pay'], minlength=len(payments))
+    shared['similarity'] = 2 * shared['shared'] / (pay_counts[shared['pay']] + inv_counts[shared['inv']])
+    near = shared[['pay', 'inv', 'similarity']]
+    return pd.concat([exact, near]).groupby(['pay', 'inv'], as_index=False)['similarity'].max()
+
+
+def candidate_pairs(payments, invoices):
+    """(payment pos, invoice pos, similarity) for pairs sharing a reference gram or the student
+
+    The amount is never a join key: a payment and an invoice that only agree
+    on the amount are not paired at all.
+    """
+    by_ref = _reference_similarity(payments, invoices)
+    pay_students = payments[['id_student']].reset_index(names='pay')
+    by_student = pay_students[pay_students['id_student'] != ''].merge(
+        invoices[['id_student']].reset_index(names='inv'), on='id_student')[['pay', 'inv']]
+    pairs = pd.concat([by_ref[['pay', 'inv']], by_student]).drop_duplicates()
+    return pairs.merge(by_ref, on=['pay', 'inv'], how='left').fillna({'similarity': 0.0})
+
+
+def score_candidates(payments, invoices):
+    """Score payment/invoice pairs and keep the best MAX_CANDIDATES per payment
+
+    Pairs come from candidate_pairs(). The amount only adds to the score of
+    those pairs, so it breaks ties between them; a pair must still share the
+    student or the exact open amount.
+    """
+    columns = ['nomor_penerimaan', 'metode_pembayaran', 'payment_ref', 'nomor_invoice', 'rank', 'score',
+               'match_type', 'same_student', 'jumlah', 'sisa_tagihan']
+    if payments.empty or invoices.empty:
+        return pd.DataFrame(columns=columns)
+    payments = payments.reset_index(drop=True)
+    invoices = invoices.reset_index(drop=True)
+
+    pairs = candidate_pairs(payments, invoices)
+
+    pay, inv = pairs['pay'].to_numpy(), pairs['inv'].to_numpy()
+    same_student = (payments['id_student'].to_numpy()[pay] == invoices['id_student'].to_numpy()[inv]) & \
+                   (payments['id_student'].to_numpy()[pay] != '')
+    paid, still_open = payments['cents'].to_numpy()[pay], invoices['cents'].to_numpy()[inv]
+    amount_fit = np.select([paid == still_open, paid < still_open], [1.0, 0.5], 0.0)
+    pairs['same_student'] = same_student
+    pairs['score'] = (WEIGHTS['reference'] * pairs['similarity'] + WEIGHTS['student'] * same_student
+                      + WEIGHTS['amount'] * amount_fit).round(3)
+    pairs['match_type'] = np.select([pairs['similarity'] == 1.0, pairs['similarity'] > 0],
+                                    ['normalized', 'ngram'], 'student_amount')
+    pairs = pairs[(same_student | (amount_fit == 1.0)) & (pairs['score'] >= MIN_SCORE)]
+
+    pairs = pairs.sort_values(['pay', 'score'], ascending=[True, False], kind='stable')
+    pairs['rank'] = pairs.groupby('pay').cumcount() + 1
+    pairs = pairs[pairs['rank'] <= MAX_CANDIDATES]
+    pay, inv = pairs['pay'].to_numpy(), pairs['inv'].to_numpy()
+    return pd.DataFrame({
+        'nomor_penerimaan': payments['nomor_penerimaan'].to_numpy()[pay],
+        'metode_pembayaran': payments['metode_pembayaran'].to_numpy()[pay],
+        'payment_ref': payments['nomor_invoice'].to_numpy()[pay],
+        'nomor_invoice': invoices['nomor_invoice'].to_numpy()[inv],
+        'rank': pairs['rank'].to_numpy(),
+        'score': pairs['score'].to_numpy(),
+        'match_type': pairs['match_type'].to_numpy(),
+        'same_student': pairs['same_student'].to_numpy(),
+        'jumlah': payments['jumlah'].to_numpy()[pay],
+        'sisa_tagihan': invoices['sisa'].to_numpy()[inv],
+    }, columns=columns)
+
+
+def _with_keys(frame, ref_column, amount_column):
+    frame = frame.copy()
+    frame['ref_norm'] = normalize_refs(frame[ref_column])
+    frame['cents'] = np.rint(pd.to_numeric(frame[amount_column]).to_numpy() * 100).astype(np.int64)
+    return frame
+
+
+def save_candidates(conn, candidates, payment_ids):
+    """Replace the stored candidates of `payment_ids` with `candidates`"""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM payment_match_candidates WHERE nomor_penerimaan = ANY(%s)", (list(payment_ids),))
+        if not candidates.empty:
+            buf = io.StringIO()
+            candidates.to_csv(buf, index=False, header=False)
+            buf.seek(0)
+            cur.copy_expert("""
+                COPY payment_match_candidates (nomor_penerimaan, metode_pembayaran, payment_ref, nomor_invoice,
+                                               rank, score, match_type, same_student, jumlah, sisa_tagihan)
+                FROM STDIN WITH (FORMAT csv)
+            """, buf)
+    conn.commit()
+
+
+def match_payments(conn, payment_ids=None):
+    """Find candidate invoices for receipts whose nomor_invoice matches no invoice
+
+    Only `payment_ids` are looked at when given, otherwise every unmatched
+    receipt. Candidates are stored in payment_match_candidates; returns
+    (unmatched receipts, candidates found, receipts with a candidate).
+    """
+    ensure_match_schema(conn)
+    payments = unmatched_payments(conn, payment_ids)
+    if payments.empty:
+        return 0, 0, 0
+    payments = _with_keys(payments, 'nomor_invoice', 'jumlah')
+    invoices = _with_keys(candidate_invoices(conn, payments), 'nomor_invoice', 'sisa')
+    conn.commit()
+    candidates = score_candidates(payments, invoices)
+    save_candidates(conn, candidates, payments['nomor_penerimaan'])
+    return len(payments), len(candidates), candidates['nomor_penerimaan'].nunique()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Suggest invoices for receipts whose invoice reference matches none.")
+    parser.add_argument('--csv', help='Also write the candidates to this CSV file')
+    args = parser.parse_args()
+
+    from ingest import get_connection
+    from migrations import apply_migrations
+    conn = get_connection('accurate')
+    try:
+        apply_migrations(conn, 'accurate')
+        unmatched, found, matched = match_payments(conn)
+        print("\n📊 Invoice matching report:")
+        print(f"• Unmatched receipts: {unmatched}")
+        print(f"• Receipts with a candidate invoice: {matched}")
+        print(f"• Candidates stored in payment_match_candidates: {found}")
+        if args.csv:
+            with conn.cursor() as cur, open(args.csv, 'w', encoding='utf-8', newline='') as f:
+                cur.copy_expert("""
+                    COPY (SELECT * FROM payment_match_candidates ORDER BY nomor_penerimaan, rank)
+                    TO STDOUT WITH (FORMAT csv, HEADER, DELIMITER ';')
+                """, f)
+            print(f"• Written to {args.csv}")
+    finally:
+        conn.close()
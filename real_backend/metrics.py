@@ -0,0 +1,202 @@
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import psycopg2.extensions
+from psycopg2 import sql
+
+try:
+    import config
+except ImportError:     # the DuckDB backend runs without database settings
+    config = None
+
+# JSON lines (metrics.jsonl), one Prometheus text file per job (<job>.prom) and
+# EXPLAIN plans (explain/) go here unless a Metrics is given its own directory;
+# METRICS_DIR in config.py overrides it
+METRICS_DIR = getattr(config, 'METRICS_DIR',
+                      os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics'))
+
+STAGE_FIELDS = ('seconds', 'rows_in', 'rows_out', 'round_trips', 'bytes')
+
+# Stage of the current thread, which CountingCursor charges its round trips to
+_current = threading.local()
+
+
+def _charge_round_trips(n=1):
+    record = getattr(_current, 'record', None)
+    if record is not None:
+        record.add(_current.stage, round_trips=n)
+
+
+class CountingCursor(psycopg2.extensions.cursor):
+    """Cursor that counts database round trips for the stage running on its thread
+
+    execute/copy count one each, executemany one per parameter set, and a
+    named cursor one per FETCH it sends.
+    """
+
+    def execute(self, query, vars=None):
+        _charge_round_trips()
+        return super().execute(query, vars)
+
+    def executemany(self, query, vars_list):
+        vars_list = list(vars_list)
+        _charge_round_trips(len(vars_list))
+        return super().executemany(query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        _charge_round_trips()
+        return super().copy_expert(sql, file, size)
+
+    def fetchmany(self, size=None):
+        if self.name:
+            _charge_round_trips()
+        return super().fetchmany() if size is None else super().fetchmany(size)
+
+    def fetchall(self):
+        if self.name:
+            _charge_round_trips()
+        return super().fetchall()
+
+    def __iter__(self):
+        if not self.name:
+            return super().__iter__()
+        return self._iter_named()
+
+    def _iter_named(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+
+def instrument(conn):
+    """Make every cursor of `conn` count round trips; returns the connection"""
+    conn.cursor_factory = CountingCursor
+    return conn
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def approx_bytes(rows):
+    """Rough size of fetched rows as text, from the first row"""
+    if not rows:
+        return 0
+    return len(rows) * sum(len(str(value)) for value in rows[0] if value is not None)
+
+
+class Metrics:
+    """Per-stage wall time, rows in/out, round trips and bytes for one job run
+
+    Stages accumulate, so a stage entered once per batch reports the total.
+    Safe to use from several threads. Output goes to `directory`, METRICS_DIR
+    by default.
+    """
+
+    def __init__(self, job, labels=None, directory=None):
+        self.job = job
+        self.labels = labels or {}
+        self.directory = directory or METRICS_DIR
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.explained = {}
+
+    def add(self, stage, **counts):
+        with self.lock:
+            record = self.stages.setdefault(stage, dict.fromkeys(STAGE_FIELDS, 0))
+            for field, value in counts.items():
+                record[field] += value
+
+    @contextmanager
+    def stage(self, name, rows_in=0):
+        """Time a block as `name` and charge the round trips made in it on this thread"""
+        outer = getattr(_current, 'record', None), getattr(_current, 'stage', None)
+        _current.record, _current.stage = self, name
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, seconds=time.perf_counter() - started, rows_in=rows_in)
+            _current.record, _current.stage = outer
+
+    def explain(self, cur, stage, query, params=None):
+        """Run EXPLAIN (ANALYZE, BUFFERS) of a data-changing `query` and roll its effects back
+
+        The plan is written to the explain/ subdirectory and the file name is kept
+        for the JSON line. The caller still executes the statement itself.
+        """
+        if isinstance(query, str):
+            query = sql.SQL(query)
+        cur.execute("SAVEPOINT metrics_explain")
+        try:
+            cur.execute(sql.SQL("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ") + query, params)
+            plan = cur.fetchone()[0]
+        finally:
+            cur.execute("ROLLBACK TO SAVEPOINT metrics_explain")
+        os.makedirs(os.path.join(self.directory, 'explain'), exist_ok=True)
+        path = os.path.join(self.directory, 'explain', f"{self._slug()}.{stage}.{datetime.now():%Y%m%dT%H%M%S}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, indent=2)
+        self.explained[stage] = {'plan': path, 'execution_ms': plan[0].get('Execution Time')}
+        return plan
+
+    def snapshot(self):
+        with self.lock:
+            stages = {name: dict(record) for name, record in self.stages.items()}
+        for record in stages.values():
+            record['seconds'] = round(record['seconds'], 6)
+            record['rows_per_second'] = round(record['rows_out'] / record['seconds'], 1) if record['seconds'] else 0.0
+        return stages
+
+    def emit(self, **extra):
+        """Append one JSON line to metrics.jsonl and rewrite this job's Prometheus text file"""
+        stages = self.snapshot()
+        wall = time.perf_counter() - self.started
+        line = {'time': datetime.now().isoformat(timespec='seconds'), 'job': self.job, **self.labels,
+                'wall_seconds': round(wall, 6), 'stages': stages, **extra}
+        if self.explained:
+            line['explain'] = self.explained
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'metrics.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(line, default=str) + '\n')
+        self._write_prometheus(stages, wall)
+        return line
+
+    def _slug(self):
+        return '.'.join([self.job] + [re.sub(r'[^A-Za-z0-9_-]', '_', str(v)) for v in self.labels.values()])
+
+    def _write_prometheus(self, stages, wall):
+        base = {'job': self.job, **self.labels}
+
+        def labels(**more):
+            return ','.join(f'{k}="{_escape(v)}"' for k, v in {**base, **more}.items())
+
+        lines = []
+        for field, help_text in [('seconds', 'Wall time spent in the stage'),
+                                 ('rows_in', 'Rows entering the stage'),
+                                 ('rows_out', 'Rows leaving the stage'),
+                                 ('rows_per_second', 'Rows out per second of stage time'),
+                                 ('round_trips', 'Database round trips made by the stage'),
+                                 ('bytes', 'Bytes read or fetched by the stage (approximate for fetches)')]:
+            lines.append(f"# HELP arrecon_stage_{field} {help_text}")
+            lines.append(f"# TYPE arrecon_stage_{field} gauge")
+            lines += [f"arrecon_stage_{field}{{{labels(stage=name)}}} {record[field]}"
+                      for name, record in stages.items()]
+        lines.append("# HELP arrecon_run_wall_seconds Wall time of the whole run")
+        lines.append("# TYPE arrecon_run_wall_seconds gauge")
+        lines.append(f"arrecon_run_wall_seconds{{{labels()}}} {wall:.6f}")
+        lines.append("# HELP arrecon_run_timestamp_seconds Unix time the run finished")
+        lines.append("# TYPE arrecon_run_timestamp_seconds gauge")
+        lines.append(f"arrecon_run_timestamp_seconds{{{labels()}}} {time.time():.0f}")
+        path = os.path.join(self.directory, f"{self._slug()}.prom")
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,110 @@
+import argparse
+
+from psycopg2 import sql
+
+from ingest import get_connection
+
+def _core_indexes(cur):
+    """Indexes behind the integrator's recompute, the allocation, the reports and the dashboard"""
+    cur.execute("CREATE INDEX IF NOT EXISTS penerimaan_penjualan_invoice_idx ON penerimaan_penjualan (nomor_invoice)")
+    cur.execute("CREATE INDEX IF NOT EXISTS penerimaan_penjualan_student_idx ON penerimaan_penjualan (id_student)")
+    cur.execute("CREATE INDEX IF NOT EXISTS penerimaan_penjualan_update_idx ON penerimaan_penjualan (tanggal_update)")
+    cur.execute("CREATE INDEX IF NOT EXISTS penerimaan_penjualan_method_idx "
+                "ON penerimaan_penjualan (metode_pembayaran, nomor_penerimaan)")
+    cur.execute("CREATE INDEX IF NOT EXISTS piutang_tagihan_student_idx ON piutang_tagihan (id_student)")
+
+
+def _date_indexes(cur):
+    """Date ranges of the dashboard filters and the summary refresh"""
+    cur.execute("CREATE INDEX IF NOT EXISTS piutang_tagihan_tanggal_idx ON piutang_tagihan (tanggal)")
+    cur.execute("CREATE INDEX IF NOT EXISTS penerimaan_penjualan_tanggal_idx ON penerimaan_penjualan (tanggal)")
+
+
+def _gateway_table(source):
+    def migrate(cur):
+        """The DDL files named the table payments_<source>; the code reads and writes payments"""
+        cur.execute("SELECT to_regclass('payments') IS NOT NULL, to_regclass(%s) IS NOT NULL", (f'payments_{source}',))
+        current, legacy = cur.fetchone()
+        if legacy and not current:
+            cur.execute(sql.SQL("ALTER TABLE {} RENAME TO payments").format(sql.Identifier(f'payments_{source}')))
+    return migrate
+
+
+def _gateway_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS payments_invoice_idx ON payments (nomor_invoice)")
+
+
+# (version, name, function taking a cursor) per database, applied in version order
+MIGRATIONS = {
+    'accurate': [
+        (1, 'core indexes', _core_indexes),
+        (2, 'date indexes', _date_indexes),
+    ],
+    'xendit': [
+        (1, 'rename payments_xendit to payments', _gateway_table('xendit')),
+        (2, 'payments invoice index', _gateway_indexes),
+    ],
+    'paperid': [
+        (1, 'rename payments_paperid to payments', _gateway_table('paperid')),
+        (2, 'payments invoice index', _gateway_indexes),
+    ],
+}
+
+
+def _ensure_migrations_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP DEFAULT NOW()
+        )
+    """)
+
+
+def applied_versions(conn):
+    with conn.cursor() as cur:
+        _ensure_migrations_table(cur)
+        cur.execute("SELECT version FROM schema_migrations")
+        versions = {row[0] for row in cur.fetchall()}
+    conn.commit()
+    return versions
+
+
+def _record(cur, version, name):
+    cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+
+
+def apply_migrations(conn, db_key):
+    """Apply the pending migrations of `db_key`, each in its own transaction; returns their names"""
+    done = applied_versions(conn)
+    applied = []
+    for version, name, migrate in MIGRATIONS[db_key]:
+        if version in done:
+            continue
+        try:
+            with conn.cursor() as cur:
+                migrate(cur)
+                _record(cur, version, name)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            print(f"🔴 Migration {db_key} {version} ({name}) failed")
+            raise
+        applied.append(name)
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations to the Accurate and gateway databases.")
+    parser.parse_args()
+
+    for db_key in MIGRATIONS:
+        conn = get_connection(db_key)
+        try:
+            applied = apply_migrations(conn, db_key)
+            for name in applied:
+                print(f"✅ {db_key}: {name}")
+            if not applied:
+                print(f"🟡 {db_key}: schema is up to date")
+        finally:
+            conn.close()
@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+# Date formats seen in Accurate and gateway exports, tried in this order
+DATE_FORMATS = ['%Y-%m-%d', '%d %b %Y', '%d-%b-%y', '%d-%b-%Y', '%d/%m/%Y', '%d/%m/%y', '%d %B %Y']
+
+# Money is carried as integer minor units (sen), 100 per rupiah
+MINOR_UNITS = 100
+
+SAMPLE_SIZE = 500
+AMOUNT_PATTERN = r'-?\d{1,13}(?:\.\d{1,2})?'  # fits DECIMAL(15, 2)
+
+
+class NormalizationError(ValueError):
+    """Raised when a whole file cannot be normalized, e.g. no date format fits"""
+
+
+def detect_date_format(values, sample_size=SAMPLE_SIZE):
+    """Return the format in DATE_FORMATS that parses most of a sample of `values`"""
+    sample = pd.Series(values).dropna()
+    sample = sample[sample.str.strip() != ''].head(sample_size).str.strip()
+    if sample.empty:
+        return None
+    best, best_hits = None, 0
+    for fmt in DATE_FORMATS:
+        hits = pd.to_datetime(sample, format=fmt, errors='coerce').notna().sum()
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+    return best
+
+
+def parse_dates(series, fmt):
+    """Parse a whole column with one known format; unparseable values become NaT"""
+    return pd.to_datetime(series.str.strip(), format=fmt, errors='coerce')
+
+
+def to_minor_units(series):
+    """Convert decimal strings like '549900' or '1234.5' to int64 minor units
+
+    Returns (values, valid) where invalid entries hold 0 and valid is False.
+    Amounts with more than two decimals, in exponent notation or beyond
+    DECIMAL(15, 2) are invalid.
+    """
+    text = series.fillna('').str.strip()
+    valid = text.str.fullmatch(AMOUNT_PATTERN).fillna(False).to_numpy(dtype=bool)
+    parts = text.where(valid, '0').str.partition('.')
+    whole = parts[0].astype(np.int64).to_numpy()
+    fraction = parts[2].str.ljust(2, '0').astype(np.int64).to_numpy()
+    sign = np.where(parts[0].str.startswith('-').to_numpy(dtype=bool), -1, 1)
+    return whole * MINOR_UNITS + sign * fraction, valid
+
+
+class Normalizer:
+    """Column-wise normalization of one file's chunks for one adapter
+
+    Date formats are detected once from the first chunk and reused for the
+    rest of the file. Rows that fail are appended to `rejected_path` with a
+    reason instead of failing inside the insert.
+    """
+
+    def __init__(self, adapter, rejected_path=None):
+        self.adapter = adapter
+        self.rejected_path = rejected_path
+        self.date_formats = {}
+        self.date_columns = [col for col, cast in adapter.casts.items() if cast == 'date']
+        self.amount_columns = [col for col, cast in adapter.casts.items() if cast == 'numeric']
+        self._rejected_header_written = False
+
+    def _detect(self, frame):
+        for col in self.date_columns:
+            fmt = detect_date_format(frame[self.adapter.columns[col]])
+            if fmt is None:
+                raise NormalizationError(f"No known date format fits column {self.adapter.columns[col]!r}")
+            self.date_formats[col] = fmt
+
+    def normalize(self, rows):
+        """Turn a chunk of CSV dicts into (typed tuples in adapter column order, rejected count)"""
+        if not rows:
+            return [], 0
+        frame = pd.DataFrame.from_records(rows, columns=self.adapter.csv_columns())
+        if not self.date_formats and self.date_columns:
+            self._detect(frame)
+
+        reason = pd.Series('', index=frame.index, dtype=object)
+        out = {}
+        for col, csv_col in self.adapter.columns.items():
+            values = frame[csv_col].mask(frame[csv_col] == '')
+            if col in self.date_formats:
+                parsed = parse_dates(values.fillna(''), self.date_formats[col])
+                bad = parsed.isna().to_numpy()
+                reason = reason.mask(bad & (reason == ''), f"bad date in {csv_col}")
+                out[col] = parsed.dt.strftime('%Y-%m-%d')
+            elif col in self.amount_columns:
+                minor, valid = to_minor_units(values)
+                reason = reason.mask(~valid & (reason == ''), f"bad amount in {csv_col}")
+                out[col] = pd.Series(minor, index=frame.index)
+            else:
+                out[col] = values
+
+        rejected = (reason != '').to_numpy()
+        if rejected.any():
+            self._write_rejected(frame[rejected], reason[rejected])
+        typed = pd.DataFrame(out)[~rejected]
+        columns = [typed[col].astype(object).where(typed[col].notna(), None).tolist() for col in typed.columns]
+        return list(zip(*columns)), int(rejected.sum())
+
+    def _write_rejected(self, frame, reason):
+        if not self.rejected_path:
+            return
+        frame = frame.assign(reject_reason=reason.to_numpy())
+        header = not self._rejected_header_written and not os.path.exists(self.rejected_path)
+        frame.to_csv(self.rejected_path, sep=';', index=False, mode='a', header=header)
+        self._rejected_header_written = True
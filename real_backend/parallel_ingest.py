@@ -0,0 +1,158 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from ingest import DEFAULT_BATCH_SIZE, get_connection, ingest_file, split_ranges
+from sources import ADAPTERS
+
+# Smallest byte range worth a worker of its own
+MIN_RANGE_BYTES = 1 << 20
+
+
+def _ingest_range(adapter_name, file_path, byte_range, batch_size, method):
+    """Worker: load one byte range of one file over its own connection"""
+    adapter = ADAPTERS[adapter_name]
+    started = time.perf_counter()
+    conn = get_connection(adapter.db_key)
+    try:
+        stats = ingest_file(adapter, file_path, conn, batch_size=batch_size, method=method,
+                            byte_range=byte_range)
+    finally:
+        conn.close()
+    seconds = time.perf_counter() - started
+    return {
+        'adapter': adapter_name,
+        'range': byte_range,
+        'pid': os.getpid(),
+        'seconds': seconds,
+        'rows_per_sec': stats['read'] / seconds if seconds else 0.0,
+        **stats,
+    }
+
+
+def build_plan(files, chunks):
+    """Group work per source into phases that must finish in order
+
+    The three sources write to separate databases and run side by side.
+    Accurate loads students, then invoices, then payments, because of the
+    foreign keys on id_student. Every phase is split into byte ranges.
+    """
+    plan = {'accurate': [], 'xendit': [], 'paperid': []}
+    for adapter_name in ['students', 'piutang_tagihan', 'penerimaan_penjualan', 'xendit', 'paperid']:
+        file_path = files.get(adapter_name)
+        if not file_path:
+            continue
+        parts = max(1, min(chunks, os.path.getsize(file_path) // MIN_RANGE_BYTES))
+        tasks = [(adapter_name, file_path, byte_range) for byte_range in split_ranges(file_path, parts)]
+        plan[ADAPTERS[adapter_name].db_key].append(tasks)
+    return {source: phases for source, phases in plan.items() if phases}
+
+
+def _clear_rejected(files):
+    """Remove range reject files left by an earlier run, which may have split the file differently"""
+    for file_path in filter(None, files.values()):
+        for path in glob.glob(glob.escape(os.path.splitext(file_path)[0]) + '.rejected.*.csv'):
+            os.remove(path)
+
+
+def run_parallel(files, workers=None, chunks=None, batch_size=DEFAULT_BATCH_SIZE, method='copy'):
+    """Run every phase of every source on a process pool and return per-worker results
+
+    A source stops at the first phase with a failed worker: its later phases
+    are reported as skipped instead of loading rows whose parents may be missing.
+    """
+    workers = workers or os.cpu_count()
+    plan = build_plan(files, chunks or workers)
+    _clear_rejected(files)
+    results = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        failed_sources = set()
+
+        def submit_next_phase(source):
+            for adapter_name, file_path, byte_range in plan[source].pop(0):
+                future = pool.submit(_ingest_range, adapter_name, file_path, byte_range, batch_size, method)
+                running[future] = source
+
+        for source in plan:
+            submit_next_phase(source)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = running.pop(future)
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    print(f"🔴 Worker for {source} failed: {str(e)}")
+                    results.append({'adapter': source, 'failed': True})
+                    failed_sources.add(source)
+                if not plan[source] or source in running.values():
+                    continue
+                if source in failed_sources:
+                    for phase in plan[source]:
+                        print(f"⏭️ Skipping {phase[0][0]} because an earlier {source} phase failed")
+                        results.append({'adapter': phase[0][0], 'not_started': True})
+                    plan[source] = []
+                else:
+                    submit_next_phase(source)
+
+    _show_report(results, time.perf_counter() - started)
+    return results
+
+
+def _show_report(results, wall_seconds):
+    """Display per-worker throughput"""
+    print("\n📊 Parallel ingest report:")
+    finished = [r for r in results if not r.get('failed') and not r.get('not_started')]
+    for r in sorted(finished, key=lambda r: (r['adapter'], r['range'])):
+        print(f"• {r['adapter']:<22} bytes {r['range'][0]}-{r['range'][1]} pid {r['pid']}: "
+              f"{r['read']} rows, {r['inserted']} inserted, {r['seconds']:.1f}s, {r['rows_per_sec']:,.0f} rows/s")
+    busy = sum(r['seconds'] for r in finished)
+    print(f"• Wall time: {wall_seconds:.1f}s (sum of worker time {busy:.1f}s)")
+    orphaned = sum(r['orphaned'] for r in finished)
+    if orphaned:
+        print(f"• Rows waiting for their student (load students, then these files again): {orphaned}")
+    failed = sum(1 for r in results if r.get('failed'))
+    if failed:
+        print(f"• Failed workers: {failed}")
+    skipped = [r['adapter'] for r in results if r.get('not_started')]
+    if skipped:
+        print(f"• Skipped after a failure: {', '.join(skipped)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Import Accurate, Xendit and PaperID CSVs in parallel.",
+        epilog="Byte-range workers keep no manifest, checkpoint or key index, so an interrupted run "
+               "cannot resume where it stopped. Run the same command again: rows already loaded "
+               "are skipped by ON CONFLICT DO NOTHING.")
+    parser.add_argument('--students', help='Path to students CSV file')
+    parser.add_argument('--invoice', help='Path to invoice CSV file')
+    parser.add_argument('--payment', help='Path to Accurate payment CSV file')
+    parser.add_argument('--xendit', help='Path to Xendit payments CSV file')
+    parser.add_argument('--paperid', help='Path to PaperID payments CSV file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Worker processes')
+    parser.add_argument('--chunks', type=int, help='Byte ranges per file (default: --workers)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Rows written and committed per batch')
+    parser.add_argument('--method', choices=['copy', 'values'], default='copy',
+                        help='COPY into staging or multi-row VALUES')
+    args = parser.parse_args()
+
+    files = {
+        'students': args.students,
+        'piutang_tagihan': args.invoice,
+        'penerimaan_penjualan': args.payment,
+        'xendit': args.xendit,
+        'paperid': args.paperid,
+    }
+    if not any(files.values()):
+        print("Please provide at least one CSV file")
+        exit(1)
+
+    results = run_parallel(files, args.workers, args.chunks, args.batch_size, args.method)
+    if any(r.get('failed') or r.get('not_started') or r.get('errors') for r in results):
+        exit(1)
@@ -1,68 +1,36 @@
-import csv
-import psycopg2
+import argparse
 import sys
+from ingest import get_connection
+from pipeline import run_pipeline
+from sources import ADAPTERS
+from validate import validate_file
 
-# Koneksi ke database PostgreSQL
+# Koneksi ke database PostgreSQL (lihat config.DATABASES['xendit'])
 def get_db_connection():
-    conn = psycopg2.connect(
-        host="localhost",
-        port=5432,
-        database="dummy_xendit",  # Menggunakan database dummy_xendit
-        user="postgres",
-        password="1234"
-    )
-    return conn
+    return get_connection('xendit')
 
-# Fungsi untuk memasukkan data ke tabel payment
-def insert_payment(data, conn):
-    cursor = conn.cursor()
-    try:
-        # Cek apakah data dengan id_xendit_payment sudah ada
-        cursor.execute("""
-            SELECT COUNT(*) FROM payments WHERE id_xendit_payment = %s
-        """, (data['id_xendit_payment'],))
-        if cursor.fetchone()[0] == 0:  # Jika data belum ada, masukkan data
-            cursor.execute("""
-                INSERT INTO payments (id_xendit_payment, nomor_invoice, tanggal, jumlah, id_student)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (data['id_xendit_payment'], data['nomor_invoice'], data['tanggal'], data['jumlah'], data['id_student']))
-            conn.commit()
-            print(f"Data berhasil dimasukkan ke tabel payments: {data['id_xendit_payment']}")
-        else:
-            print(f"Data sudah ada di tabel payments: {data['id_xendit_payment']}")
-    except Exception as e:
-        print(f"Error saat memasukkan data ke tabel payments: {e}")
-        conn.rollback()  # Rollback jika terjadi kesalahan
-    finally:
-        cursor.close()
-
-# Fungsi utama untuk membaca CSV dan memasukkan data ke database
-def process_csv(file_path, conn):
-    with open(file_path, 'r') as file:
-        # Tambahkan delimiter jika file menggunakan titik koma
-        reader = csv.DictReader(file, delimiter=';')  # Sesuaikan delimiter jika diperlukan
-        print(f"Proses file: {file_path} untuk tabel: payments")
-        print(f"Header CSV: {reader.fieldnames}")  # Debug header CSV
-        for row in reader:
-            try:
-                insert_payment(row, conn)
-            except KeyError as e:
-                print(f"Kolom tidak ditemukan: {e}. Baris yang menyebabkan error: {row}")
-            except Exception as e:
-                print(f"Error saat memproses baris: {row}. Detail error: {e}")
+# Fungsi utama untuk membaca CSV dan memasukkan data ke database per batch
+def process_csv(file_path, conn, resume=True):
+    return run_pipeline(ADAPTERS['xendit'], file_path, conn, resume=resume)
 
 # Eksekusi program
 if __name__ == "__main__":
-    if len(sys.argv)!=2:
-        print("Usage: python payment_xendit.py <csv_file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Import Xendit payments CSV into database.")
+    parser.add_argument('csv_file', help='Path to payments CSV file')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='Ignore saved checkpoints and read the file from the start')
+    parser.add_argument('--validate', action='store_true',
+                        help='Only check the file and write a rejection report; nothing is loaded')
+    args = parser.parse_args()
 
-    csv_file = sys.argv[1]
+    if args.validate:
+        summary = validate_file(ADAPTERS['xendit'], args.csv_file)
+        sys.exit(1 if summary['errors'] else 0)
 
     conn = get_db_connection()
     try:
-        # Proses file CSV untuk tabel payment
-        process_csv(csv_file, conn)
+        # Proses file CSV untuk tabel payments
+        process_csv(args.csv_file, conn, resume=not args.no_resume)
     finally:
         conn.close()
         print("Koneksi database ditutup.")
@@ -0,0 +1,158 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.pool import ThreadedConnectionPool
+
+import config
+from config import DATABASES
+from ingest import DEFAULT_BATCH_SIZE, WRITERS, _save_checkpoint, finish_run, prepare_chunk, start_run, write_chunk
+from metrics import instrument
+
+# Writer connections per file; optional INGEST_WRITERS in config.py overrides it
+DEFAULT_WRITERS = getattr(config, 'INGEST_WRITERS', 4)
+
+
+class _Progress:
+    """Tracks committed chunks and saves the checkpoint of the contiguous committed prefix
+
+    Writers finish chunks out of order, so the saved position only moves
+    forward past chunks whose predecessors are all committed. It stops
+    moving at the first chunk with orphaned rows, as in ingest_file().
+    """
+
+    def __init__(self, run):
+        self.run = run
+        self.lock = threading.Lock()
+        self.next_seq = 0
+        self.done = {}
+        self.held = False
+
+    def committed(self, conn, seq, chunk_end, row_number, orphaned=False):
+        with self.lock:
+            self.held = self.held or orphaned
+            self.done[seq] = (chunk_end, row_number)
+            position = None
+            while self.next_seq in self.done:
+                position = self.done.pop(self.next_seq)
+                self.next_seq += 1
+            if position and self.run.fingerprint and not self.held:
+                with conn.cursor() as cur:
+                    _save_checkpoint(cur, self.run, *position)
+                conn.commit()
+
+
+async def _produce(run, conn, queue, executor, batch_size, metrics, writers):
+    """Parse and normalize chunks on one thread and feed them to the bounded queue
+
+    The read, normalize and dedup stages are timed by run.metrics.
+    """
+    loop = asyncio.get_running_loop()
+    chunks = run.chunks(batch_size)
+    seq = 0
+    while True:
+        def parse_next():
+            item = next(chunks, None)
+            if item is None:
+                return None
+            chunk, chunk_end, row_number = item
+            return prepare_chunk(run, chunk, conn), chunk_end, row_number
+
+        item = await loop.run_in_executor(executor, parse_next)
+        if item is None or item[0] is None:
+            break
+        batch, chunk_end, row_number = item
+
+        started = time.perf_counter()
+        await queue.put((seq, batch, chunk_end, row_number))   # blocks while writers are behind
+        metrics['queue']['put_wait_seconds'] += time.perf_counter() - started
+        metrics['queue']['depth_samples'].append(queue.qsize())
+        seq += 1
+    for _ in range(writers):
+        await queue.put(None)
+
+
+async def _write(run, pool, queue, executor, method, progress):
+    """Drain the queue over one pooled connection, committing once per batch
+
+    Returns this writer's own insert counts, merged by the caller once all
+    tasks are done so no two threads update run.stats at the same time.
+    """
+    loop = asyncio.get_running_loop()
+    stats = {'inserted': 0, 'skipped': 0, 'orphaned': 0, 'errors': 0}
+    conn = instrument(pool.getconn())
+    try:
+        writer = await loop.run_in_executor(executor, WRITERS[method], run.adapter, conn)
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            seq, batch, chunk_end, row_number = item
+
+            def write():
+                orphaned = stats['orphaned']
+                write_chunk(run, writer, batch, stats)
+                progress.committed(conn, seq, chunk_end, row_number, stats['orphaned'] > orphaned)
+
+            await loop.run_in_executor(executor, write)
+    finally:
+        pool.putconn(conn)
+    return stats
+
+
+async def _run_pipeline(run, conn, batch_size, method, writers):
+    metrics = {'queue': {'maxsize': writers * 2, 'put_wait_seconds': 0.0, 'depth_samples': []}}
+    queue = asyncio.Queue(maxsize=writers * 2)
+    progress = _Progress(run)
+    pool = ThreadedConnectionPool(writers, writers, **DATABASES[run.adapter.db_key])
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=writers + 1) as executor:
+            tasks = [asyncio.ensure_future(_produce(run, conn, queue, executor, batch_size, metrics, writers))]
+            tasks += [asyncio.ensure_future(_write(run, pool, queue, executor, method, progress))
+                      for _ in range(writers)]
+            try:
+                results = await asyncio.gather(*tasks)
+            except Exception:
+                for task in tasks:
+                    task.cancel()
+                raise
+    finally:
+        pool.closeall()
+    for writer_stats in results[1:]:
+        for key, value in writer_stats.items():
+            run.stats[key] += value
+    metrics['wall_seconds'] = time.perf_counter() - started
+    return metrics
+
+
+def run_pipeline(adapter, file_path, conn, batch_size=DEFAULT_BATCH_SIZE, method='values', resume=True,
+                 writers=DEFAULT_WRITERS):
+    """Load a file like ingest.ingest_file(), overlapping parsing with database writes
+
+    One thread parses and normalizes chunks into a bounded asyncio queue, and
+    `writers` tasks each drain it over their own pooled connection. When the
+    writers fall behind, the full queue makes the parser wait.
+    """
+    run, has_work = start_run(adapter, file_path, conn, resume)
+    if not has_work:
+        return run.stats
+    metrics = asyncio.run(_run_pipeline(run, conn, batch_size, method, writers))
+    depths = metrics['queue']['depth_samples'] or [0]
+    _show_metrics(run, metrics, depths)
+    return finish_run(run, conn, writers=writers, queue={
+        'maxsize': metrics['queue']['maxsize'], 'max_depth': max(depths),
+        'avg_depth': round(sum(depths) / len(depths), 2),
+        'put_wait_seconds': round(metrics['queue']['put_wait_seconds'], 6)})
+
+
+def _show_metrics(run, metrics, depths):
+    """Display per-stage pipeline metrics"""
+    print(f"\n⏱️ {run.adapter.name} pipeline stages:")
+    for stage, m in run.metrics.snapshot().items():
+        print(f"• {stage}: {m['rows_in']} rows in, {m['rows_out']} out, {m['seconds']:.2f}s busy, "
+              f"{m['rows_per_second']:,.0f} rows/s, {m['round_trips']} round trips, {m['bytes']:,} bytes")
+    print(f"• queue depth: max {max(depths)}/{metrics['queue']['maxsize']}, "
+          f"avg {sum(depths) / len(depths):.1f}, parser waited {metrics['queue']['put_wait_seconds']:.2f}s")
+    print(f"• wall time: {metrics['wall_seconds']:.2f}s")
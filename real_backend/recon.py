@@ -1,5 +1,6 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, font
+import socket
 import subprocess
 import threading
 
@@ -7,10 +8,10 @@ class FrontendApp:
     def __init__(self, root):
         self.root = root
         root.title("Backend Control Panel")
-        root.geometry("450x750")
+        root.geometry("450x800")
         root.configure(bg="#f5f7fa")
         root.resizable(False, False)
-        self.center_window(450, 750)
+        self.center_window(450, 800)
 
         # Fonts
         self.title_font = font.Font(family="Segoe UI", size=16, weight="bold")
@@ -47,6 +48,11 @@ class FrontendApp:
                                           font=self.btn_font, bg="#27ae60", fg="white", activebackground="#1e8449", relief="flat", padx=10, pady=8)
         run_data_accurate_btn.pack(pady=(15, 0), fill="x")
 
+        # Run every source at once through parallel_ingest.py
+        run_parallel_btn = tk.Button(accurate_frame, text="Run Parallel Import (All Sources)", command=self.run_parallel_import,
+                                     font=self.btn_font, bg="#16a085", fg="white", activebackground="#117864", relief="flat", padx=10, pady=8)
+        run_parallel_btn.pack(pady=(10, 0), fill="x")
+
         # Frame for other CSV uploads
         other_frame = tk.LabelFrame(root, text="Other CSV Uploads", padx=15, pady=15, bg="#ffffff", fg="#444", font=self.label_font)
         other_frame.pack(padx=20, pady=10, fill="x")
@@ -156,6 +162,35 @@ class FrontendApp:
 
         threading.Thread(target=target, daemon=True).start()
 
+    def run_parallel_import(self):
+        # Load the selected Accurate CSVs together with optional Xendit and PaperID files
+        args = ['python', 'parallel_ingest.py']
+        if self.students_csv:
+            args.extend(['--students', self.students_csv])
+        if self.invoice_csv:
+            args.extend(['--invoice', self.invoice_csv])
+        if self.payment_csv:
+            args.extend(['--payment', self.payment_csv])
+        xendit_csv = filedialog.askopenfilename(title="Select Xendit CSV (cancel to skip)", filetypes=[("CSV files", "*.csv")])
+        if xendit_csv:
+            args.extend(['--xendit', xendit_csv])
+        paperid_csv = filedialog.askopenfilename(title="Select Paper.ID CSV (cancel to skip)", filetypes=[("CSV files", "*.csv")])
+        if paperid_csv:
+            args.extend(['--paperid', paperid_csv])
+
+        if len(args) == 2:
+            messagebox.showwarning("No files", "Please select at least one CSV file before running.")
+            return
+
+        def target():
+            try:
+                subprocess.run(args, check=True)
+                messagebox.showinfo("Success", "Parallel import completed successfully.")
+            except subprocess.CalledProcessError:
+                messagebox.showerror("Error", "Parallel import finished with failed or skipped files. Run it again to continue.")
+
+        threading.Thread(target=target, daemon=True).start()
+
     def upload_xendit(self):
         self.upload_file('xendit')
 
@@ -178,11 +213,35 @@ class FrontendApp:
                 messagebox.showerror("Error", f"Failed to import CSV for {db_name}.")
 
     def run_integeration(self):
+        # Hand the run to integrator_daemon.py when one is running, otherwise integrate in this process
         try:
-            subprocess.run(['python', 'app.py', 'run-integeration'], check=True)
+            from integrator_daemon import send_command
+            reply = send_command('run')
+        except (ImportError, ConnectionRefusedError):
+            reply = None
+        except socket.timeout:
+            # The daemon is still integrating; starting app.py now would run a second integration
+            messagebox.showwarning("Busy", "The PaymentIntegrator daemon is still running an integration. Try again later.")
+            return
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not reach the PaymentIntegrator daemon: {e}")
+            return
+        if reply is not None:
+            if reply.get('ok'):
+                messagebox.showinfo("Success", "Payment integration completed")
+            else:
+                messagebox.showerror("Error", f"PaymentIntegrator daemon run failed: {reply.get('error', reply.get('stats'))}")
+            return
+        try:
+            from app import PaymentIntegrator
+            success = PaymentIntegrator().integrate_payments()
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to run PaymentIntegrator: {e}")
+            return
+        if success:
             messagebox.showinfo("Success", "Payment integration completed")
-        except subprocess.CalledProcessError:
-            messagebox.showerror("Error", "Failed to run PaymentIntegrator")
+        else:
+            messagebox.showerror("Error", "PaymentIntegrator finished with errors. Check the log and retry.")
 
     def launch_dashboard(self):
         try:
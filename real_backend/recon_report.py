@@ -0,0 +1,228 @@
+import argparse
+import csv
+import heapq
+import os
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+
+import psycopg2
+
+from app import FETCH_ITERSIZE
+from ingest import get_connection
+from sources import SOURCE_ID_COLUMNS
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:     # Parquet output is optional
+    pa = pq = None
+
+# Accurate is the left side of the diff, the gateways together the right side. A gateway
+# payment booked in Accurate under another method (e.g. BCA 1111) is a method_mismatch;
+# receipts of other methods without a gateway payment are accurate_only, not a difference.
+STATUSES = ['matched', 'missing_in_accurate', 'missing_in_gateway', 'amount_mismatch', 'date_mismatch',
+            'method_mismatch', 'accurate_only']
+
+# Statuses --differences leaves out of the report file
+EXPECTED = {'matched', 'accurate_only'}
+
+COLUMNS = ['source', 'metode_pembayaran', 'nomor_penerimaan', 'status', 'nomor_invoice', 'id_student',
+           'tanggal_accurate', 'tanggal_gateway', 'jumlah_accurate', 'jumlah_gateway', 'selisih']
+
+# Rows per Parquet row group
+PARQUET_BATCH = 50000
+
+
+def _stream(conn, name, query, params=None, itersize=FETCH_ITERSIZE):
+    """Yield the rows of `query` through a server-side cursor, `itersize` rows per round trip"""
+    with conn.cursor(name=name) as cur:
+        cur.itersize = itersize
+        cur.execute(query, params)
+        yield from cur
+
+
+def accurate_receipts(conn, itersize=FETCH_ITERSIZE):
+    """Accurate receipts of every method as (method, id, invoice, student, date, amount), by receipt number"""
+    # COLLATE "C" sorts by byte, which for UTF-8 is the order Python compares strings in
+    return _stream(conn, 'recon_accurate', """
+        SELECT metode_pembayaran, nomor_penerimaan, nomor_invoice, id_student, tanggal, jumlah
+        FROM penerimaan_penjualan
+        ORDER BY nomor_penerimaan COLLATE "C"
+    """, None, itersize)
+
+
+def gateway_payments(connections, itersize=FETCH_ITERSIZE):
+    """Payments of every gateway as (source, id, invoice, student, date, amount), merged by payment id"""
+    streams = []
+    for source, id_column in SOURCE_ID_COLUMNS.items():
+        rows = _stream(connections[source], f'recon_{source}', f"""
+            SELECT %s, {id_column}, nomor_invoice, id_student, tanggal, jumlah
+            FROM payments
+            ORDER BY {id_column} COLLATE "C"
+        """, (source,), itersize)
+        streams.append(rows)
+    return heapq.merge(*streams, key=lambda row: row[1])
+
+
+def classify(left, right):
+    """Sort-merge join of two streams ordered by receipt number; yields one result row per key
+
+    The key is nomor_penerimaan alone, so a gateway payment is found whatever
+    method it was booked under in Accurate. Only the current row of each
+    stream is held, so memory does not grow with the number of payments.
+    """
+    left, right = iter(left), iter(right)
+    a, b = next(left, None), next(right, None)
+    while a is not None or b is not None:
+        if b is None or (a is not None and a[1] < b[1]):
+            yield _row(a, None, 'missing_in_gateway' if a[0] in SOURCE_ID_COLUMNS else 'accurate_only')
+            a = next(left, None)
+        elif a is None or b[1] < a[1]:
+            yield _row(None, b, 'missing_in_accurate')
+            b = next(right, None)
+        else:
+            if a[5] != b[5]:
+                status = 'amount_mismatch'
+            elif a[4] != b[4]:
+                status = 'date_mismatch'
+            elif a[0] != b[0]:
+                status = 'method_mismatch'
+            else:
+                status = 'matched'
+            yield _row(a, b, status)
+            a, b = next(left, None), next(right, None)
+
+
+def _row(a, b, status):
+    either = a or b
+    left_amount = a[5] if a else None
+    right_amount = b[5] if b else None
+    return {
+        'source': b[0] if b else 'accurate',
+        'metode_pembayaran': a[0] if a else None,
+        'nomor_penerimaan': either[1],
+        'status': status,
+        'nomor_invoice': either[2],
+        'id_student': either[3],
+        'tanggal_accurate': a[4] if a else None,
+        'tanggal_gateway': b[4] if b else None,
+        'jumlah_accurate': left_amount,
+        'jumlah_gateway': right_amount,
+        'selisih': (left_amount or Decimal(0)) - (right_amount or Decimal(0)),
+    }
+
+
+class _CsvSink:
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.DictWriter(self.file, fieldnames=COLUMNS, delimiter=';')
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetSink:
+    def __init__(self, path):
+        schema = pa.schema([('source', pa.string()), ('metode_pembayaran', pa.string()),
+                            ('nomor_penerimaan', pa.string()), ('status', pa.string()),
+                            ('nomor_invoice', pa.string()), ('id_student', pa.string()),
+                            ('tanggal_accurate', pa.date32()), ('tanggal_gateway', pa.date32()),
+                            ('jumlah_accurate', pa.decimal128(15, 2)), ('jumlah_gateway', pa.decimal128(15, 2)),
+                            ('selisih', pa.decimal128(15, 2))])
+        self.writer = pq.ParquetWriter(path, schema)
+        self.schema = schema
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= PARQUET_BATCH:
+            self._flush()
+
+    def _flush(self):
+        if self.batch:
+            self.writer.write_table(pa.Table.from_pylist(self.batch, schema=self.schema))
+            self.batch = []
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+
+def run_report(output, differences_only=False, itersize=FETCH_ITERSIZE):
+    """Write the three-way diff to `output` (.csv or .parquet)
+
+    Returns totals per (source, Accurate method, status); the method is ''
+    for payments missing in Accurate.
+    """
+    if output.endswith('.parquet') and pq is None:
+        raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+    connections = {'accurate': get_connection('accurate')}
+    try:
+        for source in SOURCE_ID_COLUMNS:
+            connections[source] = get_connection(source)
+        sink = _ParquetSink(output) if output.endswith('.parquet') else _CsvSink(output)
+        totals = defaultdict(lambda: {'count': 0, 'jumlah_accurate': Decimal('0.00'), 'jumlah_gateway': Decimal('0.00')})
+        try:
+            for row in classify(accurate_receipts(connections['accurate'], itersize),
+                                gateway_payments(connections, itersize)):
+                total = totals[(row['source'], row['metode_pembayaran'] or '', row['status'])]
+                total['count'] += 1
+                total['jumlah_accurate'] += row['jumlah_accurate'] or 0
+                total['jumlah_gateway'] += row['jumlah_gateway'] or 0
+                if not (differences_only and row['status'] in EXPECTED):
+                    sink.write(row)
+        finally:
+            sink.close()
+        return dict(totals)
+    finally:
+        for conn in connections.values():
+            conn.close()
+
+
+def _summary_key(item):
+    (source, method, status), _ = item
+    return source, method, STATUSES.index(status)
+
+
+def write_summary(totals, path):
+    """Counts and amounts per source, Accurate method and status"""
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, delimiter=';')
+        writer.writerow(['source', 'metode_pembayaran', 'status', 'count', 'jumlah_accurate', 'jumlah_gateway',
+                         'selisih'])
+        for (source, method, status), total in sorted(totals.items(), key=_summary_key):
+            writer.writerow([source, method, status, total['count'], total['jumlah_accurate'],
+                             total['jumlah_gateway'], total['jumlah_accurate'] - total['jumlah_gateway']])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile Accurate receipts against Xendit and PaperID payments.")
+    parser.add_argument('--output', default=f"recon_{datetime.now():%Y%m%d}.csv",
+                        help='Report file; .parquet writes Parquet (needs pyarrow), anything else CSV')
+    parser.add_argument('--differences', action='store_true',
+                        help='Leave matched payments and receipts of other methods out of the report file')
+    parser.add_argument('--itersize', type=int, default=FETCH_ITERSIZE,
+                        help=f'Rows fetched per server-side cursor round trip (default {FETCH_ITERSIZE})')
+    args = parser.parse_args()
+
+    try:
+        totals = run_report(args.output, args.differences, args.itersize)
+    except (RuntimeError, psycopg2.Error) as e:
+        print(f"🔴 Reconciliation failed: {str(e)}")
+        raise SystemExit(1)
+    summary = os.path.splitext(args.output)[0] + '.summary.csv'
+    write_summary(totals, summary)
+
+    print("\n📊 Reconciliation report:")
+    for source in sorted({source for source, _, _ in totals}):
+        print(f"• {source}:")
+        for (_, method, status), total in sorted(
+                ((key, total) for key, total in totals.items() if key[0] == source), key=_summary_key):
+            print(f"  - {method or 'not in Accurate'} / {status}: {total['count']} "
+                  f"(Accurate {total['jumlah_accurate']:,.2f}, gateway {total['jumlah_gateway']:,.2f})")
+    print(f"• Written to {args.output} and {summary}")
@@ -0,0 +1,80 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+import pandas as pd
+
+# Payment id column per gateway database
+SOURCE_ID_COLUMNS = {'xendit': 'id_xendit_payment', 'paperid': 'id_paper_payment'}
+
+# Payment methods imported from Accurate; gateway payments come in through app.py
+PAYMENT_METHODS = ['BCA 1111', 'Kas Sementara']
+
+
+@dataclass
+class SourceAdapter:
+    """Declarative description of one CSV source and the table it loads into"""
+    name: str
+    db_key: str
+    table: str
+    columns: dict                      # target column -> CSV column
+    key_columns: tuple
+    casts: dict = field(default_factory=dict)    # target column -> SQL type, text if absent
+    defaults: dict = field(default_factory=dict)  # target column -> SQL expression filled on insert
+    row_filter: Optional[tuple] = None  # (CSV column, allowed values); other rows are ignored
+    reference: Optional[tuple] = None  # (table, column) the row's column must already exist in
+
+    def csv_columns(self):
+        return list(self.columns.values())
+
+    def keeps(self, row):
+        """True if the CSV row passes the row filter"""
+        return self.row_filter is None or row.get(self.row_filter[0]) in self.row_filter[1]
+
+    def keep_mask(self, frame):
+        """Row filter applied to a whole DataFrame of CSV columns"""
+        if self.row_filter is None:
+            return pd.Series(True, index=frame.index)
+        return frame[self.row_filter[0]].isin(self.row_filter[1])
+
+    def key_getter(self):
+        """Return a function extracting the key from a row in `columns` order"""
+        positions = [list(self.columns).index(col) for col in self.key_columns]
+        if len(positions) == 1:
+            return lambda row: row[positions[0]]
+        return lambda row: tuple(row[p] for p in positions)
+
+
+ADAPTERS = {a.name: a for a in [
+    SourceAdapter(
+        name='students', db_key='accurate', table='students',
+        columns={'id_student': 'id_student', 'name': 'name', 'email': 'email'},
+        key_columns=('id_student',)),
+    SourceAdapter(
+        name='piutang_tagihan', db_key='accurate', table='piutang_tagihan',
+        columns={'nomor_invoice': 'nomor_invoice', 'id_student': 'id_student', 'tanggal': 'tanggal',
+                 'total': 'total', 'status': 'status'},
+        key_columns=('nomor_invoice',),
+        casts={'tanggal': 'date', 'total': 'numeric'},
+        reference=('students', 'id_student')),
+    SourceAdapter(
+        name='penerimaan_penjualan', db_key='accurate', table='penerimaan_penjualan',
+        columns={'nomor_penerimaan': 'nomor_penerimaan', 'id_student': 'id_student', 'tanggal': 'tanggal',
+                 'jumlah': 'jumlah', 'metode_pembayaran': 'metode_pembayaran', 'nomor_invoice': 'nomor_invoice'},
+        key_columns=('nomor_penerimaan',),
+        casts={'tanggal': 'date', 'jumlah': 'numeric'},
+        defaults={'tanggal_update': 'NOW()'},
+        row_filter=('metode_pembayaran', PAYMENT_METHODS),
+        reference=('students', 'id_student')),
+    SourceAdapter(
+        name='xendit', db_key='xendit', table='payments',
+        columns={'id_xendit_payment': 'id_xendit_payment', 'nomor_invoice': 'nomor_invoice',
+                 'tanggal': 'tanggal', 'jumlah': 'jumlah', 'id_student': 'id_student'},
+        key_columns=('id_xendit_payment',),
+        casts={'tanggal': 'date', 'jumlah': 'numeric'}),
+    SourceAdapter(
+        name='paperid', db_key='paperid', table='payments',
+        columns={'id_paper_payment': 'id_paper_payment', 'nomor_invoice': 'nomor_invoice',
+                 'tanggal': 'tanggal', 'jumlah': 'jumlah', 'id_student': 'id_student'},
+        key_columns=('id_paper_payment',),
+        casts={'tanggal': 'date', 'jumlah': 'numeric'}),
+]}
@@ -0,0 +1,175 @@
+import argparse
+import os
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+# File names match the sample exports in the repository root
+FILES = {
+    'students': 'idsiswa.csv',
+    'invoices': 'invoice.csv',
+    'accurate': 'payment_aacur.csv',
+    'xendit': 'payment_xendit.csv',
+    'paperid': 'payment_paperID.csv',
+}
+
+COLUMNS = {
+    'students': ['id_student', 'name', 'email', 'total_tagihan'],
+    'invoices': ['nomor_invoice', 'id_student', 'tanggal', 'total', 'status'],
+    'accurate': ['nomor_penerimaan', 'id_student', 'tanggal', 'metode_pembayaran', 'jumlah', 'nomor_invoice'],
+    'xendit': ['id_xendit_payment', 'id_student', 'tanggal', 'jumlah', 'nomor_invoice'],
+    'paperid': ['id_paper_payment', 'id_student', 'tanggal', 'jumlah', 'nomor_invoice'],
+}
+
+# Invoice amounts seen in the sample data, in rupiah
+PRICES = np.array([99000, 150000, 284400, 299900, 450000, 549900, 1659000])
+
+# Share of payments per channel: Accurate-only methods, then the two gateways
+CHANNELS = ['BCA 1111', 'Kas Sementara', 'xendit', 'paperid']
+CHANNEL_SHARE = [0.2, 0.05, 0.25, 0.5]
+
+# Receipt number prefixes per channel, as in the sample exports
+RECEIPT_PREFIX = {'BCA 1111': '110101', 'Kas Sementara': '110103', 'xendit': '110102', 'paperid': '110104'}
+
+DEFAULT_RATES = {
+    'unpaid': 0.15,       # invoices with no payment at all
+    'partial': 0.15,      # paid in two instalments, the second sometimes missing
+    'overpaid': 0.03,     # paid more than the invoice total
+    'duplicate': 0.01,    # payment rows repeated in the same export
+    'bad_ref': 0.02,      # gateway rows whose invoice reference is mangled
+}
+
+CHUNK_ROWS = 1_000_000
+START_DATE = date(2024, 1, 1)
+DAYS = 730
+
+
+def _day_strings(fmt):
+    """Formatted date for every day offset from START_DATE, looked up instead of formatting each row"""
+    return np.array([(START_DATE + timedelta(days=d)).strftime(fmt) for d in range(DAYS + 120)], dtype=object)
+
+
+_MONTHS = _day_strings('%Y.%m')
+
+
+def _numbers(prefix, days, seq):
+    """prefix.YYYY.MM.sequence receipt or invoice numbers"""
+    width = max(5, len(str(int(seq.max()) if len(seq) else 0)))
+    return prefix + '.' + _MONTHS[days] + '.' + pd.Series(seq).astype(str).str.zfill(width).to_numpy()
+
+
+def _mangle(refs, rng):
+    """Break invoice references the way the gateway exports do: stray spaces, lower case, a wrong digit"""
+    refs = pd.Series(refs, dtype=object)
+    kind = rng.integers(0, 3, len(refs))
+    cut = rng.integers(3, 12, len(refs))
+    spaced = [r[:c] + ' ' + r[c:] for r, c in zip(refs, cut)]
+    lowered = refs.str.lower()
+    typo = refs.str[:-1] + pd.Series((rng.integers(0, 10, len(refs))).astype(str))
+    return np.select([kind == 0, kind == 1], [np.array(spaced, dtype=object), lowered.to_numpy()], typo.to_numpy())
+
+
+def _append(frame, path):
+    frame.to_csv(path, sep=';', index=False, header=False, mode='a')
+
+
+def generate(out_dir, invoices, students=None, seed=0, rates=None):
+    """Write students, invoices and Accurate/Xendit/PaperID payment exports with `invoices` invoices
+
+    Invoices are generated in chunks of CHUNK_ROWS so memory stays flat at
+    any scale. Existing files of the same names are overwritten. Returns the
+    number of rows written per file.
+    """
+    rates = {**DEFAULT_RATES, **(rates or {})}
+    students = students or max(1, invoices // 3)
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {key: os.path.join(out_dir, name) for key, name in FILES.items()}
+    counts = dict.fromkeys(FILES, 0)
+    for key, path in paths.items():
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(';'.join(COLUMNS[key]) + '\n')
+    invoice_dates, payment_dates = _day_strings('%d %b %Y'), _day_strings('%d-%b-%y')
+
+    for start in range(0, students, CHUNK_ROWS):
+        n = min(CHUNK_ROWS, students - start)
+        ids = 'A' + pd.Series(np.arange(start + 1, start + n + 1)).astype(str)
+        letters = rng.integers(0, 26, (n, 5)).astype(np.uint8) + ord('a')
+        names = pd.Series(letters.view('S5').ravel()).str.decode('ascii').str.capitalize()
+        _append(pd.DataFrame({'id_student': ids, 'name': names, 'email': names + ids.str.lower() + '@something.com',
+                              'total_tagihan': ''}), paths['students'])
+        counts['students'] += n
+
+    receipt_seq = dict.fromkeys(CHANNELS, 0)
+    for start in range(0, invoices, CHUNK_ROWS):
+        n = min(CHUNK_ROWS, invoices - start)
+        inv_day = rng.integers(0, DAYS, n)
+        inv_no = _numbers('SI', inv_day, np.arange(start + 1, start + n + 1))
+        student = 'A' + pd.Series(rng.integers(1, students + 1, n)).astype(str).to_numpy()
+        total = rng.choice(PRICES, n)
+        _append(pd.DataFrame({'nomor_invoice': inv_no, 'id_student': student, 'tanggal': invoice_dates[inv_day],
+                              'total': total, 'status': 'Belum Lunas'}), paths['invoices'])
+        counts['invoices'] += n
+
+        # One payment per paid invoice, a second instalment for some partial ones
+        outcome = rng.random(n)
+        paid = outcome >= rates['unpaid']
+        partial = paid & (outcome < rates['unpaid'] + rates['partial'])
+        overpaid = paid & ~partial & (outcome < rates['unpaid'] + rates['partial'] + rates['overpaid'])
+        first_amount = np.where(partial, total // 2, np.where(overpaid, total + rng.choice([1000, 50000], n), total))
+        second = partial & (rng.random(n) < 0.7)
+        inv_idx = np.concatenate([np.flatnonzero(paid), np.flatnonzero(second)])
+        amount = np.concatenate([first_amount[paid], (total - total // 2)[second]])
+        pay_day = inv_day[inv_idx] + rng.integers(0, 60, len(inv_idx)) + \
+            np.r_[np.zeros(paid.sum(), dtype=np.int64), np.full(second.sum(), 30)]
+        channel = rng.choice(len(CHANNELS), len(inv_idx), p=CHANNEL_SHARE)
+
+        for c, name in enumerate(CHANNELS):
+            rows = np.flatnonzero(channel == c)
+            if not len(rows):
+                continue
+            seq = receipt_seq[name] + np.arange(1, len(rows) + 1)
+            receipt_seq[name] += len(rows)
+            refs = inv_no[inv_idx[rows]]
+            frame = pd.DataFrame({
+                'nomor_penerimaan': _numbers(RECEIPT_PREFIX[name], pay_day[rows], seq),
+                'id_student': student[inv_idx[rows]],
+                'tanggal': payment_dates[pay_day[rows]],
+                'metode_pembayaran': name,
+                'jumlah': amount[rows],
+                'nomor_invoice': refs,
+            })
+            if name in ('xendit', 'paperid'):
+                bad = rng.random(len(rows)) < rates['bad_ref']
+                frame.loc[bad, 'nomor_invoice'] = _mangle(refs[bad], rng)
+                key = name
+                frame = frame.rename(columns={'nomor_penerimaan': COLUMNS[key][0]})[COLUMNS[key]]
+            else:
+                key = 'accurate'
+            duplicates = frame[rng.random(len(frame)) < rates['duplicate']]
+            frame = pd.concat([frame, duplicates]).sample(frac=1, random_state=int(rng.integers(1 << 31)))
+            _append(frame, paths[key])
+            counts[key] += len(frame)
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate realistic student, invoice and payment CSV exports.")
+    parser.add_argument('--invoices', type=int, default=10000, help='Number of invoices (default 10,000)')
+    parser.add_argument('--students', type=int, help='Number of students (default a third of the invoices)')
+    parser.add_argument('--out', default='synthetic', help='Directory the CSV files are written to')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same files')
+    for rate, default in DEFAULT_RATES.items():
+        parser.add_argument(f"--{rate.replace('_', '-')}-rate", type=float, default=default,
+                            help=f'Share of {rate.replace("_", " ")} rows (default {default})')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    counts = generate(args.out, args.invoices, args.students, args.seed,
+                      {rate: getattr(args, f'{rate}_rate') for rate in DEFAULT_RATES})
+    print("\n📊 Synthetic data:")
+    for key, n in counts.items():
+        print(f"• {FILES[key]}: {n:,} rows")
+    print(f"• Written to {args.out} in {time.perf_counter() - started:.1f}s")
@@ -0,0 +1,219 @@
+import csv
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+
+import config
+from ingest import get_connection, read_header
+from normalize import detect_date_format, parse_dates, to_minor_units
+
+VALIDATE_CHUNK_ROWS = 500000
+
+# Snapshots of parent keys are cached here and reused for this many seconds
+SNAPSHOT_DIR = getattr(config, 'VALIDATE_CACHE_DIR',
+                       os.path.join(tempfile.gettempdir(), 'ar_recon_validate_cache'))
+SNAPSHOT_TTL = 600
+
+# (CSV column, parent table, parent column, severity) per adapter. Errors are
+# rows the loader would drop; warnings are rows that load but will not match.
+REFERENCE_CHECKS = {
+    'piutang_tagihan': [('id_student', 'students', 'id_student', 'error')],
+    'penerimaan_penjualan': [('id_student', 'students', 'id_student', 'error'),
+                             ('nomor_invoice', 'piutang_tagihan', 'nomor_invoice', 'warning')],
+    'xendit': [('id_student', 'students', 'id_student', 'warning'),
+               ('nomor_invoice', 'piutang_tagihan', 'nomor_invoice', 'warning')],
+    'paperid': [('id_student', 'students', 'id_student', 'warning'),
+                ('nomor_invoice', 'piutang_tagihan', 'nomor_invoice', 'warning')],
+}
+
+
+def load_snapshot(table, column, refresh=False):
+    """Return the parent keys as a pandas Index, from the cache or the accurate database
+
+    Returns None when the cache is stale and the database cannot be reached.
+    """
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(SNAPSHOT_DIR, f"{table}.{column}.txt")
+    fresh = os.path.exists(path) and time.time() - os.path.getmtime(path) < SNAPSHOT_TTL
+    if refresh or not fresh:
+        try:
+            conn = get_connection('accurate')
+        except Exception:
+            if not os.path.exists(path):
+                return None
+            print(f"🟡 Using stale snapshot {path}")
+        else:
+            try:
+                with conn.cursor() as cur, open(path + '.tmp', 'w', encoding='utf-8') as f:
+                    cur.copy_expert(sql.SQL("COPY (SELECT {} FROM {}) TO STDOUT").format(
+                        sql.Identifier(column), sql.Identifier(table)).as_string(conn), f)
+                os.replace(path + '.tmp', path)
+            finally:
+                conn.close()
+    if os.path.getsize(path) == 0:
+        return pd.Index([], dtype=object)
+    keys = pd.read_csv(path, sep='\t', header=None, names=[column], dtype=str, keep_default_na=False,
+                       quoting=csv.QUOTE_NONE)[column]
+    return pd.Index(keys)
+
+
+def _joined(keys):
+    """One text value per row for a key that may span several columns"""
+    if keys.shape[1] == 1:
+        return keys.iloc[:, 0].to_numpy()
+    return keys.iloc[:, 0].str.cat(keys.iloc[:, 1:], sep='|').to_numpy()
+
+
+def _find_duplicates(issues, column, key_hashes, key_rows):
+    """Report every row whose key hash already appeared on an earlier row of the file"""
+    if not key_hashes:
+        return
+    hashes = np.concatenate(key_hashes)
+    rows = np.concatenate(key_rows)
+    order = np.argsort(hashes, kind='stable')
+    hashes, rows = hashes[order], rows[order]
+    repeat = np.zeros(len(hashes), dtype=bool)
+    repeat[1:] = hashes[1:] == hashes[:-1]
+    # first row of each run of equal hashes, so the report can point back at it
+    first = rows[np.maximum.accumulate(np.where(~repeat, np.arange(len(rows)), 0))]
+    issues.add(rows[repeat], column, np.char.add('same key as row ', first[repeat].astype(str)),
+               'duplicate_key', 'error')
+
+
+class _Issues:
+    """Collects rejected rows column-wise and writes them as one CSV"""
+
+    def __init__(self):
+        self.parts = []
+        self.counts = {}
+
+    def add(self, row_numbers, column, values, rule, severity):
+        if len(row_numbers) == 0:
+            return
+        self.parts.append(pd.DataFrame({'row_number': row_numbers, 'column': column, 'value': values,
+                                        'rule': rule, 'severity': severity}))
+        key = f"{severity}:{rule}:{column}"
+        self.counts[key] = self.counts.get(key, 0) + len(row_numbers)
+
+    def total(self, severity):
+        return sum(n for key, n in self.counts.items() if key.startswith(severity + ':'))
+
+    def write(self, path):
+        frame = pd.concat(self.parts) if self.parts else pd.DataFrame(
+            columns=['row_number', 'column', 'value', 'rule', 'severity'])
+        frame.sort_values('row_number', kind='stable').to_csv(path, sep=';', index=False)
+
+
+def validate_file(adapter, file_path, parents=None, refresh_snapshot=False):
+    """Check a CSV for `adapter` without writing to the database
+
+    Checks the header, date and amount columns, empty and repeated keys, and
+    references to parent keys, all column-wise per chunk. `parents` maps
+    (table, column) to keys already known from files validated in the same
+    run, e.g. the students file when validating invoices.
+
+    Writes `<file>.validation.csv` (one line per problem) and
+    `<file>.validation.json` (summary) and returns the summary dict.
+    """
+    started = time.perf_counter()
+    base = os.path.splitext(file_path)[0]
+    parents = parents if parents is not None else {}
+    issues = _Issues()
+    summary = {'file': file_path, 'source': adapter.name, 'rows': 0, 'filtered': 0}
+
+    header, _ = read_header(file_path)
+    missing = [col for col in adapter.csv_columns() if col not in header]
+    for col in missing:
+        issues.add([0], col, [''], 'missing_column', 'error')
+    if not missing:
+        checks = REFERENCE_CHECKS.get(adapter.name, [])
+        snapshots = {}
+        for _, table, column, _ in checks:
+            if (table, column) not in snapshots:
+                snapshots[(table, column)] = load_snapshot(table, column, refresh_snapshot)
+                if snapshots[(table, column)] is None:
+                    print(f"🟡 No snapshot of {table}.{column}; reference check skipped")
+        date_columns = [adapter.columns[c] for c, cast in adapter.casts.items() if cast == 'date']
+        amount_columns = [adapter.columns[c] for c, cast in adapter.casts.items() if cast == 'numeric']
+        key_columns = [adapter.columns[c] for c in adapter.key_columns]
+        usecols = list(dict.fromkeys(adapter.csv_columns() + ([adapter.row_filter[0]] if adapter.row_filter else [])))
+        date_formats = {}
+        key_hashes, key_rows = [], []
+        file_keys = []
+        first_row = 1
+
+        reader = pd.read_csv(file_path, sep=';', dtype=str, keep_default_na=False, usecols=usecols,
+                             chunksize=VALIDATE_CHUNK_ROWS, encoding='utf-8-sig')
+        for frame in reader:
+            rows = np.arange(first_row, first_row + len(frame))
+            first_row += len(frame)
+            summary['rows'] += len(frame)
+            keep = adapter.keep_mask(frame).to_numpy()
+            summary['filtered'] += int((~keep).sum())
+            frame, rows = frame[keep], rows[keep]
+
+            for col in date_columns:
+                if col not in date_formats:
+                    date_formats[col] = detect_date_format(frame[col])
+                    summary.setdefault('date_formats', {})[col] = date_formats[col]
+                if date_formats[col] is None:
+                    bad = np.ones(len(frame), dtype=bool)
+                else:
+                    bad = parse_dates(frame[col], date_formats[col]).isna().to_numpy()
+                issues.add(rows[bad], col, frame[col].to_numpy()[bad], 'bad_date', 'error')
+            for col in amount_columns:
+                _, valid = to_minor_units(frame[col])
+                issues.add(rows[~valid], col, frame[col].to_numpy()[~valid], 'bad_amount', 'error')
+
+            keys = frame[key_columns]
+            empty = (keys == '').any(axis=1).to_numpy()
+            issues.add(rows[empty], '+'.join(key_columns), _joined(keys[empty]), 'empty_key', 'error')
+            key_hashes.append(pd.util.hash_pandas_object(keys[~empty], index=False).to_numpy())
+            key_rows.append(rows[~empty])
+            if len(key_columns) == 1:
+                file_keys.append(frame[key_columns[0]])
+
+            for col, table, column, severity in checks:
+                known = snapshots[(table, column)]
+                if known is None:
+                    continue
+                values = frame[col]
+                orphan = (values != '') & ~values.isin(known)
+                if (table, column) in parents:
+                    orphan &= ~values.isin(parents[(table, column)])
+                orphan = orphan.to_numpy()
+                issues.add(rows[orphan], col, values.to_numpy()[orphan], f'unknown_{table}', severity)
+
+        _find_duplicates(issues, '+'.join(key_columns), key_hashes, key_rows)
+        if len(key_columns) == 1 and file_keys:
+            parents[(adapter.table, adapter.key_columns[0])] = pd.Index(pd.concat(file_keys))
+
+    issues.write(base + '.validation.csv')
+    summary.update({
+        'errors': issues.total('error'),
+        'warnings': issues.total('warning'),
+        'issues': issues.counts,
+        'seconds': round(time.perf_counter() - started, 3),
+    })
+    with open(base + '.validation.json', 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    _show_summary(summary, base)
+    return summary
+
+
+def _show_summary(summary, base):
+    """Display validation results"""
+    status = "🔴" if summary['errors'] else "✅"
+    print(f"\n{status} Validation of {summary['file']} ({summary['source']}): "
+          f"{summary['rows']} rows in {summary['seconds']}s")
+    print(f"• Filtered out: {summary['filtered']}")
+    print(f"• Errors: {summary['errors']}")
+    print(f"• Warnings: {summary['warnings']}")
+    for key, count in sorted(summary['issues'].items()):
+        print(f"  - {key}: {count}")
+    print(f"• Report: {base}.validation.csv / {base}.validation.json")
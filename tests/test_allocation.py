@@ -0,0 +1,67 @@
+import pandas as pd
+
+from allocation import _decimal, allocate
+
+
+def _ledger(invoices, payments):
+    return (pd.DataFrame(invoices, columns=['nomor_invoice', 'id_student', 'tanggal', 'total']),
+            pd.DataFrame(payments, columns=['nomor_penerimaan', 'id_student', 'tanggal', 'jumlah']))
+
+
+def _pairs(allocations):
+    return sorted(zip(allocations['nomor_penerimaan'], allocations['nomor_invoice'], allocations['cents']))
+
+
+def test_oldest_invoice_is_paid_first():
+    invoices, payments = _ledger(
+        [('INV1', 'S1', '2024-01-01', '100.00'), ('INV2', 'S1', '2024-02-01', '100.00')],
+        [('PAY1', 'S1', '2024-03-01', '150.00')])
+
+    allocations, invoice_balances, student_balances = allocate(invoices, payments)
+
+    assert _pairs(allocations) == [('PAY1', 'INV1', 10000), ('PAY1', 'INV2', 5000)]
+    assert invoice_balances['status'].tolist() == ['Lunas', 'Belum Lunas']
+    assert invoice_balances['sisa'].tolist() == [0, 5000]
+    assert student_balances[['total_tagihan', 'kredit']].values.tolist() == [[5000, 0]]
+
+
+def test_students_are_allocated_independently():
+    invoices, payments = _ledger(
+        [('INV1', 'S1', '2024-01-01', '100.00'), ('INV2', 'S2', '2024-01-01', '50.00')],
+        [('PAY1', 'S2', '2024-01-05', '80.00'), ('PAY2', 'S1', '2024-01-06', '40.00')])
+
+    allocations, _, student_balances = allocate(invoices, payments)
+
+    assert _pairs(allocations) == [('PAY1', 'INV2', 5000), ('PAY2', 'INV1', 4000)]
+    assert student_balances.set_index('id_student')[['total_tagihan', 'kredit']].to_dict('index') == {
+        'S1': {'total_tagihan': 6000, 'kredit': 0}, 'S2': {'total_tagihan': 0, 'kredit': 3000}}
+
+
+def test_negative_receipt_reverses_the_latest_allocation():
+    invoices, payments = _ledger(
+        [('INV1', 'S1', '2024-01-01', '100.00'), ('INV2', 'S1', '2024-02-01', '100.00')],
+        [('PAY1', 'S1', '2024-02-10', '100.00'), ('PAY2', 'S1', '2024-02-11', '100.00'),
+         ('REV1', 'S1', '2024-02-12', '-60.00')])
+
+    allocations, invoice_balances, student_balances = allocate(invoices, payments)
+
+    assert _pairs(allocations) == [('PAY1', 'INV1', 10000), ('PAY2', 'INV2', 4000)]
+    assert invoice_balances['paid'].tolist() == [10000, 4000]
+    assert student_balances[['total_pembayaran', 'total_tagihan', 'kredit']].values.tolist() == [[14000, 6000, 0]]
+
+
+def test_reversal_beyond_receipts_is_owed():
+    invoices, payments = _ledger(
+        [('INV1', 'S1', '2024-01-01', '100.00')],
+        [('PAY1', 'S1', '2024-01-05', '30.00'), ('REV1', 'S1', '2024-01-06', '-50.00')])
+
+    allocations, invoice_balances, student_balances = allocate(invoices, payments)
+
+    assert allocations.empty
+    assert invoice_balances['paid'].tolist() == [0]
+    balance = student_balances.iloc[0]
+    assert (balance['total_pembayaran'], balance['total_tagihan'], balance['kredit']) == (-2000, 10000, -2000)
+
+
+def test_decimal_keeps_the_sign():
+    assert _decimal([12345, -5, 0, -100]).tolist() == ['123.45', '-0.05', '0.00', '-1.00']
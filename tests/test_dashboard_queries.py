@@ -0,0 +1,42 @@
+from datetime import date
+
+import pandas as pd
+
+from dashboard_queries import compact_invoices
+
+
+def _invoices(rows):
+    return pd.DataFrame(rows, columns=['nomor_invoice', 'id_student', 'name', 'email', 'tanggal', 'total',
+                                       'jumlah_pembayaran', 'status'])
+
+
+def test_amounts_become_cents_and_states_follow_the_outstanding_amount():
+    frame = _invoices([
+        ('INV1', 'S1', 'A', 'a@x', '2024-03-01', '100.00', '100.00', 'Lunas'),
+        ('INV2', 'S1', 'A', 'a@x', '2024-03-01', '100.00', None, 'Belum Lunas'),
+        ('INV3', 'S2', 'B', 'b@x', '2024-03-01', '100.00', '40.50', 'Belum Lunas'),
+        ('INV4', 'S2', 'B', 'b@x', '2024-03-01', '100.00', '120.00', 'Lunas'),
+    ])
+
+    compact = compact_invoices(frame, today=date(2024, 3, 11))
+
+    assert compact['total'].tolist() == [10000] * 4
+    assert compact['jumlah_pembayaran'].tolist() == [10000, 0, 4050, 12000]
+    assert compact['outstanding'].tolist() == [0, 10000, 5950, -2000]
+    assert compact['overpayment'].tolist() == [0, 0, 0, 2000]
+    assert compact['payment_state'].tolist() == ['Paid', 'Unpaid', 'Partially Paid', 'Overpaid']
+    assert compact['id_student'].dtype == 'category'
+
+
+def test_aging_bucket_only_for_outstanding_invoices():
+    frame = _invoices([
+        ('INV1', 'S1', 'A', 'a@x', '2024-03-01', '100.00', None, 'Belum Lunas'),
+        ('INV2', 'S1', 'A', 'a@x', '2024-01-15', '100.00', None, 'Belum Lunas'),
+        ('INV3', 'S1', 'A', 'a@x', '2024-01-15', '100.00', '100.00', 'Lunas'),
+        ('INV4', 'S1', 'A', 'a@x', '2024-03-20', '100.00', None, 'Belum Lunas'),
+    ])
+
+    compact = compact_invoices(frame, today=date(2024, 3, 11))
+
+    assert compact['aging_bucket'].tolist()[:2] == ['0-30', '31-60']
+    assert compact['aging_bucket'].isna().tolist() == [False, False, True, True]
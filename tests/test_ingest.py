@@ -0,0 +1,33 @@
+from ingest import read_header, split_ranges
+
+
+def _csv(tmp_path, rows):
+    path = tmp_path / 'payments.csv'
+    lines = ['id;jumlah'] + [f'P{i:05d};{i * 1000}' for i in range(rows)]
+    path.write_bytes(('\n'.join(lines) + '\n').encode('utf-8'))
+    return str(path)
+
+
+def test_ranges_cover_the_data_rows_once_and_cut_at_line_starts(tmp_path):
+    path = _csv(tmp_path, 1000)
+    _, data_offset = read_header(path)
+    content = open(path, 'rb').read()
+
+    ranges = split_ranges(path, 7)
+
+    assert len(ranges) == 7
+    assert ranges[0][0] == data_offset
+    assert ranges[-1][1] == len(content)
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+    assert all(content[start - 1:start] == b'\n' for start, _ in ranges)
+    lines = b''.join(content[start:end] for start, end in ranges).splitlines()
+    assert lines == content.splitlines()[1:]
+
+
+def test_small_file_gives_fewer_ranges_than_asked(tmp_path):
+    path = _csv(tmp_path, 2)
+
+    ranges = split_ranges(path, 16)
+
+    assert 1 <= len(ranges) <= 2
+    assert ranges[0][0] == read_header(path)[1]
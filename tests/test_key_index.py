@@ -0,0 +1,39 @@
+from key_index import KeyIndex
+from sources import ADAPTERS
+
+
+def _key(row):
+    return row['id']
+
+
+def test_exact_index_drops_known_and_repeated_keys():
+    index = KeyIndex(ADAPTERS['xendit'], max_exact_keys=10)
+    index.add(['P1', 'P2'])
+
+    rows = [{'id': 'P1'}, {'id': 'P3'}, {'id': 'P3'}, {'id': 'P4'}]
+    new_rows, skipped = index.split_new(rows, _key, conn=None)
+
+    assert [row['id'] for row in new_rows] == ['P3', 'P4']
+    assert skipped == 2
+    assert not index.approximate
+
+
+def test_index_switches_to_hashes_past_the_limit():
+    index = KeyIndex(ADAPTERS['xendit'], max_exact_keys=3)
+    index.add(['P1', 'P2', 'P3', 'P4'])
+    index.add(['P5'])
+
+    assert index.approximate
+    assert len(index) == 5
+    assert index._maybe_present(['P1', 'P5', 'P9']).tolist() == [True, True, False]
+
+
+def test_hash_index_needs_no_lookup_for_new_keys():
+    index = KeyIndex(ADAPTERS['xendit'], max_exact_keys=1)
+    index.add(['P1', 'P2'])
+
+    # None of these can be a hash hit, so the database is never asked to confirm
+    new_rows, skipped = index.split_new([{'id': 'N1'}, {'id': 'N2'}], _key, conn=None)
+
+    assert [row['id'] for row in new_rows] == ['N1', 'N2']
+    assert skipped == 0
@@ -0,0 +1,41 @@
+import pandas as pd
+
+from matching import _with_keys, candidate_pairs, score_candidates
+
+
+def _payments(rows):
+    frame = pd.DataFrame(rows, columns=['nomor_penerimaan', 'metode_pembayaran', 'nomor_invoice', 'id_student', 'jumlah'])
+    return _with_keys(frame, 'nomor_invoice', 'jumlah')
+
+
+def _invoices(rows):
+    frame = pd.DataFrame(rows, columns=['nomor_invoice', 'id_student', 'sisa'])
+    return _with_keys(frame, 'nomor_invoice', 'sisa')
+
+
+def test_amount_only_invoice_is_never_paired():
+    payments = _payments([('PAY1', 'xendit', 'XYZ', 'S1', 150000)])
+    invoices = _invoices([('INV/2024/0001', 'S2', 150000)])
+
+    assert candidate_pairs(payments, invoices).empty
+    assert score_candidates(payments, invoices).empty
+
+
+def test_exact_reference_scores_highest():
+    payments = _payments([('PAY1', 'xendit', 'inv-2024 0001', 'S1', 150000)])
+    invoices = _invoices([('INV/2024/0001', 'S1', 150000), ('INV/2024/0002', 'S1', 150000)])
+
+    candidates = score_candidates(payments, invoices)
+    best = candidates.iloc[0]
+    assert best['nomor_invoice'] == 'INV/2024/0001'
+    assert best['match_type'] == 'normalized'
+    assert best['score'] == 1.0
+
+
+def test_amount_decides_between_invoices_of_the_student():
+    payments = _payments([('PAY1', 'paperid', '', 'S1', 200000)])
+    invoices = _invoices([('INV/A', 'S1', 500000), ('INV/B', 'S1', 200000), ('INV/C', 'S9', 200000)])
+
+    candidates = score_candidates(payments, invoices)
+    assert candidates['nomor_invoice'].tolist() == ['INV/B']
+    assert candidates['match_type'].tolist() == ['student_amount']
@@ -0,0 +1,27 @@
+import pandas as pd
+
+from normalize import detect_date_format, to_minor_units
+
+
+def test_amounts_become_integer_minor_units():
+    values, valid = to_minor_units(pd.Series(['549900', '1234.5', '0.05', '-0.50', '-12.34', ' 7 ']))
+
+    assert values.tolist() == [54990000, 123450, 5, -50, -1234, 700]
+    assert valid.all()
+
+
+def test_malformed_amounts_are_invalid_and_zero():
+    values, valid = to_minor_units(pd.Series(['1.234', '1e5', 'abc', '', None, '12345678901234']))
+
+    assert not valid.any()
+    assert values.tolist() == [0] * 6
+
+
+def test_date_format_is_the_one_parsing_most_of_the_sample():
+    assert detect_date_format(pd.Series(['2024-01-31', '2024-02-01'])) == '%Y-%m-%d'
+    assert detect_date_format(pd.Series(['31/01/2024', '01/02/2024', 'rubbish'])) == '%d/%m/%Y'
+    assert detect_date_format(pd.Series(['05 Mar 2024', ''])) == '%d %b %Y'
+
+
+def test_no_date_format_without_values():
+    assert detect_date_format(pd.Series(['', '  ', None])) is None
@@ -0,0 +1,41 @@
+from datetime import date
+from decimal import Decimal
+
+from recon_report import classify
+
+
+def _accurate(method, receipt, amount='100.00', day=1):
+    return (method, receipt, 'INV1', 'S1', date(2024, 1, day), Decimal(amount))
+
+
+def _gateway(source, receipt, amount='100.00', day=1):
+    return (source, receipt, 'INV1', 'S1', date(2024, 1, day), Decimal(amount))
+
+
+def _statuses(left, right):
+    return [(row['nomor_penerimaan'], row['status']) for row in classify(left, right)]
+
+
+def test_each_receipt_number_gets_one_status():
+    left = [_accurate('xendit', 'A'), _accurate('xendit', 'B', '90.00'), _accurate('paperid', 'C', day=2),
+            _accurate('xendit', 'E')]
+    right = [_gateway('xendit', 'A'), _gateway('xendit', 'B'), _gateway('paperid', 'C'), _gateway('paperid', 'D')]
+
+    assert _statuses(left, right) == [('A', 'matched'), ('B', 'amount_mismatch'), ('C', 'date_mismatch'),
+                                      ('D', 'missing_in_accurate'), ('E', 'missing_in_gateway')]
+
+
+def test_gateway_payment_booked_under_another_method():
+    rows = list(classify([_accurate('BCA 1111', 'A')], [_gateway('xendit', 'A')]))
+
+    assert rows[0]['status'] == 'method_mismatch'
+    assert rows[0]['source'] == 'xendit'
+    assert rows[0]['metode_pembayaran'] == 'BCA 1111'
+
+
+def test_receipts_of_other_methods_without_gateway_payment_are_expected():
+    rows = list(classify([_accurate('Kas Sementara', 'K1', '250.00')], []))
+
+    assert rows[0]['status'] == 'accurate_only'
+    assert rows[0]['source'] == 'accurate'
+    assert rows[0]['selisih'] == Decimal('250.00')